@@ -0,0 +1,61 @@
+# Big-integer arithmetic backend.
+#
+# Modular exponentiation and inversion for util.powm() and util.modinv() (and
+# the exponentiations of multiexp and parallel). When gmpy2 is installed they
+# run on GMP; otherwise on builtin ints, with pow(x, -1, m) for inverses. The
+# backend is picked once, at import, as set by config.ARITH_BACKEND. Results
+# are always plain ints, so they can be encoded like any other.
+
+import config
+
+BUILTIN = 'builtin'
+GMPY2 = 'gmpy2'
+
+try:
+	import gmpy2
+except ImportError:
+	gmpy2 = None
+
+
+def _builtin_powmod(base, exp, mod):
+	return pow(base, exp, mod)
+
+
+def _builtin_invert(num, mod):
+	try:
+		return pow(num, -1, mod)
+	except ValueError:
+		return None
+
+
+def _gmpy2_powmod(base, exp, mod):
+	return int(gmpy2.powmod(base, exp, mod))
+
+
+def _gmpy2_invert(num, mod):
+	try:
+		return int(gmpy2.invert(num, mod))
+	except ZeroDivisionError:
+		return None
+
+
+def select(name):
+	"""Returns the (name, powmod, invert) of backend name.
+
+	name is 'auto' (gmpy2 if installed, else builtin), 'gmpy2' or 'builtin'.
+	Raises ValueError if the backend is unknown or not installed.
+	"""
+	if name == 'auto':
+		name = BUILTIN if gmpy2 is None else GMPY2
+	if name == BUILTIN:
+		return BUILTIN, _builtin_powmod, _builtin_invert
+	if name == GMPY2:
+		if gmpy2 is None:
+			raise ValueError('gmpy2 is not installed.')
+		return GMPY2, _gmpy2_powmod, _gmpy2_invert
+	raise ValueError('Unknown arithmetic backend: {}'.format(name))
+
+
+# powmod(base, exp, mod) returns base^exp mod mod, and invert(num, mod) the
+# inverse of num mod mod or None if there is none.
+name, powmod, invert = select(config.ARITH_BACKEND)
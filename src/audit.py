@@ -0,0 +1,213 @@
+# Deferred auditing of announcement shuffles.
+#
+# In audit mode (config.SHUFFLE_AUDIT) a server does not verify the shuffle it
+# receives during the announcement phase. It files the hop (the lists before
+# and after, the shuffle parameters and the non-interactive proof) in an
+# append-only transcript store and carries on with its own hop at once. Auditor
+# processes on the coordinator verify the transcripts of the round as they are
+# filed, and the coordinator only starts the message phase once all of them
+# check out and fit together into one ring. If they don't, the round is called
+# off and its announcement starts over.
+#
+# The store is a directory (config.AUDIT_DIR) that every server and the
+# coordinator must share, e.g. over a network filesystem: servers write their
+# transcripts to it and the auditors read them back. The coordinator leaves a
+# random token in the directory of each round, which servers check before
+# filing anything under it. Audit mode also needs non-interactive shuffle
+# proofs, since nobody is at the other end of an interactive one.
+
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from threading import Lock
+
+import config
+import shuffle
+from util import Constants, encode, decode, eprint
+
+
+class TranscriptStore:
+	"""Append-only store of announcement transcripts in directory path.
+
+	Each round has its own subdirectory, with one file per server that received
+	a hop. Transcripts are never overwritten.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+
+	def round_path(self, round):
+		return os.path.join(self.path, 'round-{}'.format(round))
+
+	def transcript_path(self, round, server_id):
+		return os.path.join(self.round_path(round), '{}.bin'.format(server_id))
+
+	def token_path(self, round):
+		return os.path.join(self.round_path(round), 'coordinator.token')
+
+	def claim(self, round):
+		"""Claims round for the coordinator.
+
+		Returns a random token, which anyone sharing the store reads back with
+		token(). Raises FileExistsError if round was already claimed.
+		"""
+		os.makedirs(self.round_path(round))
+		token = os.urandom(16).hex()
+		with open(self.token_path(round), 'x') as f:
+			f.write(token)
+		return token
+
+	def token(self, round):
+		"""Returns the token round was claimed with, or None."""
+		try:
+			with open(self.token_path(round)) as f:
+				return f.read()
+		except FileNotFoundError:
+			return None
+
+	def append(self, round, server_id, elts_pre, elts_post, g_, h_, proof):
+		"""Files the hop that server_id received in round.
+
+		Raises FileExistsError if the server already filed one this round.
+		"""
+		os.makedirs(self.round_path(round), exist_ok=True)
+		record = [elts_pre, elts_post, g_, h_, proof]
+		with open(self.transcript_path(round, server_id), 'xb') as f:
+			f.write(encode(record, Constants.BINARY))
+
+	def next_round(self):
+		"""Returns a round number that has no transcripts yet."""
+		try:
+			names = os.listdir(self.path)
+		except FileNotFoundError:
+			return 1
+		rounds = [int(name[6:]) for name in names
+			if name.startswith('round-') and name[6:].isdigit()]
+		return max(rounds, default=0) + 1
+
+	def server_ids(self, round):
+		"""Returns the ids of the servers that filed a hop in round."""
+		try:
+			names = os.listdir(self.round_path(round))
+		except FileNotFoundError:
+			return []
+		return [int(name[:-4]) for name in names
+			if name.endswith('.bin') and name[:-4].isdigit()]
+
+	def load(self, round, server_id):
+		"""Returns the (elts_pre, elts_post, g_, h_, proof) filed by server_id."""
+		with open(self.transcript_path(round, server_id), 'rb') as f:
+			record, _ = decode(f.read())
+		return record
+
+
+def check_config():
+	"""Raises ValueError if audit mode is on without non-interactive proofs."""
+	if config.SHUFFLE_AUDIT and config.SHUFFLE_PROOF != Constants.NIZK:
+		raise ValueError('SHUFFLE_AUDIT needs SHUFFLE_PROOF = {!r}.'.format(
+			Constants.NIZK))
+
+
+def digest(elts):
+	"""Returns a digest of an announcement list, to match up hops."""
+	return hashlib.sha256(encode(elts, Constants.BINARY)).digest()
+
+
+def check(path, round, server_id):
+	"""Verifies one transcript. This is what the auditor processes run.
+
+	Returns whether the proof holds, and the digests of the lists before and
+	after the hop.
+	"""
+	try:
+		elts_pre, elts_post, g_, h_, proof = TranscriptStore(path).load(round, server_id)
+	except Exception:
+		return False, None, None # missing or malformed transcript
+	ok = shuffle.verify_nizk(proof, elts_pre, elts_post, g_, h_)
+	return ok, digest(elts_pre), digest(elts_post)
+
+
+def chained(hops):
+	"""Returns whether hops, a list of (digest before, digest after), form one
+	chain in which every hop starts from the list the previous one produced."""
+	after = {post: pre for pre, post in hops}
+	starts = [pre for pre, post in hops if pre not in after]
+	if len(starts) != 1 or len(after) != len(hops):
+		return False
+
+	before = {pre: post for pre, post in hops}
+	elts, count = starts[0], 0
+	while elts in before and count <= len(hops):
+		elts, count = before[elts], count + 1
+	return count == len(hops)
+
+
+class Auditor:
+	"""Verifies the transcripts of a round on a pool of processes."""
+
+	def __init__(self, path, workers):
+		self.store = TranscriptStore(path)
+		self.workers = workers
+		self.executor = None
+		self.round = None
+		self.token = None # token the round was claimed with
+		self.futures = {} # server id -> future of check()
+		self.lock = Lock()
+
+	def start(self):
+		"""Starts auditing a new round, forgetting about the previous one.
+
+		Returns the number of the round, under which servers file its hops.
+		"""
+		if self.executor is None:
+			self.executor = ProcessPoolExecutor(self.workers,
+				mp_context=multiprocessing.get_context('spawn'))
+		with self.lock:
+			self.round = self.store.next_round()
+			self.token = self.store.claim(self.round)
+			self.futures = {}
+			return self.round
+
+	def submit(self, round, server_id):
+		"""Starts verifying the transcript filed by server_id, if not yet started."""
+		with self.lock:
+			if round == self.round and server_id not in self.futures:
+				self.futures[server_id] = self.executor.submit(
+					check, self.store.path, round, server_id)
+
+	def finish(self, expected):
+		"""Waits for the transcripts of the round to be verified.
+
+		expected: The number of hops in the round.
+
+		Returns whether all of them hold and form one chain.
+		"""
+		round = self.round
+		for server_id in self.store.server_ids(round):
+			self.submit(round, server_id)
+		with self.lock:
+			futures = dict(self.futures)
+		wait(futures.values())
+
+		if len(futures) != expected:
+			eprint('AUDITOR', 'Expected {} transcripts, found {}.'.format(
+				expected, len(futures)))
+			return False
+
+		hops = []
+		for server_id, future in sorted(futures.items()):
+			try:
+				ok, pre, post = future.result()
+			except Exception as err:
+				eprint('AUDITOR', 'Auditing server {} failed: {}'.format(server_id, err))
+				return False
+			if not ok:
+				eprint('AUDITOR', 'Shuffle received by server {} failed.'.format(server_id))
+				return False
+			hops.append((pre, post))
+
+		if expected > 0 and not chained(hops):
+			eprint('AUDITOR', 'Shuffles of round {} do not form a ring.'.format(round))
+			return False
+		return True
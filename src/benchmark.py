@@ -0,0 +1,352 @@
+import os
+import sys
+import time
+from random import randrange
+
+import arith
+import config
+import elgamal
+import feedback
+import fixedbase
+import lrs
+import multiexp
+import parallel
+import shuffle
+import vecmath
+from testing_helpers import BIG_G, BIG_P, BIG_Q, announcement, shuffle_proof
+from util import Constants, encode, decode, batch_modinv, egcd
+
+GROUPS = [
+	('24-bit', Constants.G, Constants.P, Constants.Q),
+	('1024-bit', BIG_G, BIG_P, BIG_Q),
+]
+
+
+def timed(func, *args, repeat=3):
+	"""Returns the best wall time of func(*args) in seconds and its result."""
+	best, ret = None, None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		ret = func(*args)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best, ret
+
+
+def report(name, secs):
+	print('{:<40} {:>10.2f} ms'.format(name, secs * 1000))
+
+
+def bench_codec(n=10000):
+	"""Bytes on the wire and encode/decode time of an announcement message."""
+	for name, g, p, q in GROUPS:
+		ann_list_pre = [[randrange(p) for _ in range(n)],
+			[(randrange(p), randrange(p)) for _ in range(n)]]
+		ann_list_post = [[randrange(p) for _ in range(n)],
+			[(randrange(p), randrange(p)) for _ in range(n)]]
+		msg = [Constants.NEW_ANNOUNCEMENT, g, ann_list_pre, ann_list_post, 1, 1, 0]
+
+		print('NEW_ANNOUNCEMENT, n = {}, {} group'.format(n, name))
+		for codec_name in [Constants.JSON, Constants.BINARY]:
+			secs, payload = timed(encode, msg, codec_name)
+			report('  {} encode'.format(codec_name), secs)
+			secs, (args, _) = timed(decode, payload)
+			report('  {} decode'.format(codec_name), secs)
+			assert(args[2][0] == ann_list_pre[0])
+			print('  {} bytes: {}'.format(codec_name, len(payload)))
+
+
+def bench_fixedbase(n=10000):
+	"""Builtin pow against fixed-base tables for random exponents."""
+	for name, g, p, q in GROUPS:
+		exps = [randrange(q) for _ in range(n)]
+		table = fixedbase.FixedBase(g, p, q)
+		secs, _ = timed(table.pow, 1, repeat=1)
+
+		print('{} powers of G, {} group'.format(n, name))
+		report('  table build', secs)
+		secs, expected = timed(lambda: [pow(g, e, p) for e in exps])
+		report('  builtin pow', secs)
+		secs, ret = timed(lambda: [table.pow(e) for e in exps])
+		report('  windowed table', secs)
+		assert(ret == expected)
+
+		if q <= fixedbase.FULL_TABLE_LIMIT:
+			secs, _ = timed(table._build_full, repeat=1)
+			report('  full table build', secs)
+			table.full = table._build_full()
+			secs, ret = timed(lambda: [table.pow(e) for e in exps])
+			report('  full table', secs)
+			assert(ret == expected)
+
+
+def bench_arith(n=10000):
+	"""powm and modinv on each installed arithmetic backend, and batch_modinv."""
+	backends = [arith.BUILTIN] + ([] if arith.gmpy2 is None else [arith.GMPY2])
+	for name, g, p, q in GROUPS:
+		bases = [pow(g, randrange(1, q), p) for _ in range(n)]
+		exps = [randrange(q) for _ in range(n)]
+
+		print('{} powm/modinv, {} group (default backend: {})'.format(
+			n, name, arith.name))
+		secs, expected = timed(lambda: [egcd(b, p)[1] % p for b in bases])
+		report('  modinv, egcd', secs)
+		for backend in backends:
+			_, powmod, invert = arith.select(backend)
+			secs, _ = timed(lambda: [powmod(b, e, p) for b, e in zip(bases, exps)])
+			report('  powm, {}'.format(backend), secs)
+			secs, ret = timed(lambda: [invert(b, p) for b in bases])
+			report('  modinv, {}'.format(backend), secs)
+			assert(ret == expected)
+		secs, ret = timed(batch_modinv, bases, p)
+		report('  batch_modinv', secs)
+		assert(ret == expected)
+
+
+def bench_vecmath(n=100000):
+	"""Vector products and powers with and without numpy, in the 24-bit group."""
+	p, q = Constants.P, Constants.Q
+	a = [randrange(p) for _ in range(n)]
+	b = [randrange(p) for _ in range(n)]
+	exps = [randrange(q) for _ in range(n)]
+	exp = randrange(q)
+	numpy = vecmath.numpy
+
+	print('{} elements, 24-bit group'.format(n))
+	for label in ['loops', 'numpy']:
+		if label == 'numpy' and numpy is None:
+			print('  numpy is not installed')
+			break
+		vecmath.numpy = numpy if label == 'numpy' else None
+		try:
+			secs, _ = timed(vecmath.mulmod, a, b, p)
+			report('  mulmod, {}'.format(label), secs)
+			secs, _ = timed(vecmath.mulmod, a, exp, p)
+			report('  mulmod shared, {}'.format(label), secs)
+			secs, ret = timed(vecmath.powmod, a, exp, p, repeat=1)
+			report('  powmod shared exponent, {}'.format(label), secs)
+			assert(ret[:10] == [pow(x, exp, p) for x in a[:10]])
+			secs, ret = timed(vecmath.powmod, a, exps, p, repeat=1)
+			report('  powmod, {}'.format(label), secs)
+			assert(ret[:10] == [pow(x, e, p) for x, e in zip(a, exps[:10])])
+		finally:
+			vecmath.numpy = numpy
+
+
+def bench_elgamal(n=1000, servers=8):
+	"""Re-encrypting the reputations at one hop of the reverse announcement,
+	one exponentiation per server key and element against one combined mask."""
+	g, p, q = Constants.G, Constants.P, Constants.Q
+	server_pub_keys = [pow(g, randrange(1, q), p) for _ in range(servers)]
+	reps = [pow(g, randrange(1, q), p) for _ in range(n)]
+	eph_key = randrange(1, q)
+
+	def per_key():
+		ret = []
+		for rep in reps:
+			for server_pub_key in server_pub_keys:
+				rep = (rep * pow(server_pub_key, eph_key, p)) % p
+			ret.append(rep)
+		return ret
+
+	def combined():
+		return elgamal.Engine(p).encrypt_all(reps, server_pub_keys, eph_key)
+
+	print('{} reputations, {} servers'.format(n, servers))
+	secs, expected = timed(per_key)
+	report('  per key ({} powm)'.format(n * servers), secs)
+	engine = elgamal.Engine(p)
+	assert(engine.encrypt_all(reps, server_pub_keys, eph_key) == expected)
+	secs, _ = timed(combined)
+	report('  combined mask ({} powm)'.format(engine.exponentiations), secs)
+
+
+def bench_lrs(*sizes):
+	"""Ring signatures with each hash scheme, against the size of the ring."""
+	g, p, q = Constants.G, Constants.P, Constants.Q
+	for n in sizes or [10, 100, 1000]:
+		keys = [randrange(1, q) for _ in range(n)]
+		L = [pow(g, x, p) for x in keys]
+		print('ring signature, ring of {}, 24-bit group'.format(n))
+		for label, version in [('legacy', lrs.LEGACY), ('ring digest', lrs.DIGEST)]:
+			secs, sig = timed(lrs.sign, 'message', keys[0], 0, L, g, p, q, version)
+			report('  sign, {}'.format(label), secs)
+			secs, ret = timed(lambda: lrs.verify('message', L, *sig, g=g, p=p, q=q))
+			report('  verify, {}'.format(label), secs)
+			assert(ret)
+
+		ring = lrs.RingDigest(L[:-1])
+		secs, ret = timed(lambda: lrs.verify('message', L, *sig, g=g, p=p, q=q,
+			ring=ring.extend(L[-1:])))
+		report('  verify, cached ring digest', secs)
+		assert(ret)
+
+		for label, tables in [('', False), (' and tables', True)]:
+			pre = lrs.Ring(L, g, p, q, lrs.DIGEST, tables=tables)
+			secs, ret = timed(lambda: lrs.verify('message', L, *sig, g=g, p=p, q=q, pre=pre))
+			report('  verify, cached ring{}'.format(label), secs)
+			assert(ret)
+
+
+def bench_ringsize(n=4096):
+	"""Votes signed over buckets of the ring against the whole ring: time to
+	sign and verify, and bytes of the NEW_FEEDBACK message."""
+	g, p, q = Constants.G, Constants.P, Constants.Q
+	keys = [randrange(1, q) for _ in range(n)]
+	L = [pow(g, x, p) for x in keys]
+
+	print('ring of {}, 24-bit group'.format(n))
+	for size in [64, 256, 1024, 0]:
+		label = 'buckets of {}'.format(size) if size > 0 else 'whole ring'
+		secs, sig = timed(lrs.sign, 'message', keys[0], 0, L, g, p, q, lrs.DIGEST,
+			None, size, repeat=1)
+		report('  {}, sign'.format(label), secs)
+		secs, pre = timed(lrs.Ring, L, g, p, q, lrs.DIGEST, None, False, size, repeat=1)
+		report('  {}, ring (once per message)'.format(label), secs)
+		secs, ret = timed(lambda: lrs.verify('message', L, *sig, pre=pre, size=size),
+			repeat=1)
+		report('  {}, verify'.format(label), secs)
+		assert(ret)
+		for codec_name in [Constants.JSON, Constants.BINARY]:
+			payload = encode([Constants.NEW_FEEDBACK, 0, 'message', 1, sig], codec_name)
+			print('  {}, {} bytes: {}'.format(label, codec_name, len(payload)))
+
+
+def bench_feedback(votes=200, n=100, max_workers=os.cpu_count()):
+	"""Verifying the votes on one message one by one and in batches."""
+	g, p, q = Constants.G, Constants.P, Constants.Q
+	keys = [randrange(1, q) for _ in range(n)]
+	L = [pow(g, x, p) for x in keys]
+	sigs = [lrs.sign('message', keys[i % n], i % n, L) for i in range(votes)]
+	ring = lrs.Ring(L, tables=config.LRS_RING_TABLES)
+
+	print('{} votes, ring of {}, 24-bit group'.format(votes, n))
+	secs, ret = timed(lambda: [lrs.verify('message', L, *sig, pre=ring) for sig in sigs],
+		repeat=1)
+	report('  one by one', secs)
+	assert(all(ret))
+	for workers in range(max_workers + 1):
+		verifier = feedback.FeedbackVerifier(workers, config.FEEDBACK_BATCH, 0.001)
+		verify = lambda: [future.result() for future in
+			[verifier.submit('message', sig, ring) for sig in sigs]]
+		verify() # start the workers
+		secs, ret = timed(verify, repeat=1)
+		report('  batched, {} workers'.format(workers), secs)
+		assert(all(ret))
+
+
+def nizk_proof(ann_list, new_ann_list, pi, beta, g_, h_,
+		g=Constants.G, p=Constants.P, q=Constants.Q, pre=None):
+	"""Writes and checks one non-interactive shuffle proof."""
+	proof = shuffle.prove_nizk(ann_list, new_ann_list, pi, beta, g_, h_, g, p, q, pre)
+	return shuffle.verify_nizk(proof, ann_list, new_ann_list, g_, h_, g, p, q)
+
+
+def bench_shuffle(n=100):
+	"""Shuffle proof and verification with and without multi-exponentiation,
+	batch verification and precomputed commitments."""
+	multi_exp = shuffle.multi_exp
+	batch = config.SHUFFLE_BATCH_VERIFY
+	variants = [
+		('pow products', multiexp.naive, False),
+		('multi_exp', multi_exp, False),
+		('multi_exp, batched', multi_exp, True),
+	]
+	for name, g, p, q in GROUPS:
+		for size in [n // 4, n // 2, n]:
+			args = announcement(size, g, p, q) + (g, p, q)
+			print('shuffle proof, n = {}, {} group'.format(size, name))
+			for label, func, config.SHUFFLE_BATCH_VERIFY in variants:
+				shuffle.multi_exp = func
+				try:
+					secs, ret = timed(shuffle_proof, *args, repeat=1)
+				finally:
+					shuffle.multi_exp = multi_exp
+					config.SHUFFLE_BATCH_VERIFY = batch
+				assert(ret)
+				report('  {}'.format(label), secs)
+
+			secs, ret = timed(nizk_proof, *args, repeat=1)
+			assert(ret)
+			report('  non-interactive, batched', secs)
+
+			pre = shuffle.Commitments(size, g, p, q)
+			secs, ret = timed(nizk_proof, *args, pre, repeat=1)
+			assert(ret)
+			report('  non-interactive, precomputed', secs)
+
+
+def bench_batch(n=400):
+	"""Verification of a non-interactive shuffle proof, with its equations checked
+	one by one and all at once."""
+	batch = config.SHUFFLE_BATCH_VERIFY
+	for name, g, p, q in GROUPS:
+		for size in [n // 4, n // 2, n]:
+			ann_list, new_ann_list, pi, beta, g_, h_ = announcement(size, g, p, q)
+			proof = shuffle.prove_nizk(ann_list, new_ann_list, pi, beta, g_, h_, g, p, q)
+			args = (proof, ann_list, new_ann_list, g_, h_, g, p, q)
+			print('shuffle verification, n = {}, {} group'.format(size, name))
+			unbatched = None
+			for config.SHUFFLE_BATCH_VERIFY in [False, True]:
+				try:
+					secs, ret = timed(shuffle.verify_nizk, *args, repeat=1)
+				finally:
+					config.SHUFFLE_BATCH_VERIFY = batch
+				assert(ret)
+				if unbatched is None:
+					unbatched = secs
+					report('  one by one', secs)
+				else:
+					report('  batched ({:.2f}x)'.format(unbatched / secs), secs)
+
+
+def bench_parallel(max_workers=os.cpu_count(), *sizes):
+	"""Shuffle proof and verification on 1 to max_workers processes."""
+	workers = config.SHUFFLE_WORKERS
+	for size in sizes or [1000, 10000, 100000]:
+		args = announcement(size)
+		print('shuffle proof, n = {}'.format(size))
+		serial = None
+		for config.SHUFFLE_WORKERS in range(max_workers + 1):
+			# best of two, so that starting the workers is not counted, and another
+			# try if the simple shuffle proof gave up (some s_hat[i] was 0)
+			while True:
+				try:
+					secs, ret = timed(shuffle_proof, *args, repeat=2)
+					break
+				except EOFError:
+					pass
+			assert(ret)
+
+			if serial is None:
+				serial = secs
+				report('  in handler thread', secs)
+			else:
+				report('  {} workers ({:.2f}x)'.format(
+					config.SHUFFLE_WORKERS, serial / secs), secs)
+	config.SHUFFLE_WORKERS = workers
+	parallel.executor()
+
+
+BENCHMARKS = {
+	'arith': bench_arith,
+	'batch': bench_batch,
+	'codec': bench_codec,
+	'elgamal': bench_elgamal,
+	'feedback': bench_feedback,
+	'fixedbase': bench_fixedbase,
+	'lrs': bench_lrs,
+	'parallel': bench_parallel,
+	'ringsize': bench_ringsize,
+	'shuffle': bench_shuffle,
+	'vecmath': bench_vecmath,
+}
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+		print('USAGE: python benchmark.py [{}] [args...]'.format(
+			'|'.join(sorted(BENCHMARKS.keys()))))
+		sys.exit(1)
+
+	BENCHMARKS[sys.argv[1]](*[int(arg) for arg in sys.argv[2:]])
@@ -97,7 +97,6 @@ class MessageBoard:
 		"""Verifies and responds to message."""
 		if not self.verify_message(msg, phase):
 			eprint(self.name, 'Error processing ' + str(msg) + '.')
-			s.close()
 			return
 
 		msg_head, *msg_args = msg
@@ -107,4 +106,3 @@ class MessageBoard:
 			self.respond[msg_head](s, msg_args)
 		else:
 			self.respond[msg_head](msg_args)
-		s.close()
@@ -1,7 +1,7 @@
 from collections import defaultdict
 
 from board import MessageBoard
-from util import Constants, send, sendbytes, sendrecv, eprint, sprint
+from util import Constants, channel, send, sendbytes, sendrecv, eprint, sprint
 
 class BlockchainMessageBoard(MessageBoard):
 	"""Message board that stores reputation on the blockchain."""
@@ -132,7 +132,9 @@ class BlockchainMessageBoard(MessageBoard):
 		if len(participants) == 0:
 			self.coordinator.phase = Constants.COINSHUFFLE_FINISHED_PHASE
 			return
-		sendbytes(participants[0][0], b'')
+		with channel(participants[0][0]) as s:
+			send(s, [Constants.SHUFFLE_PAYLOAD])
+			sendbytes(s, b'')
 
 	def end_coinshuffle(self, msg_args):
 		"""Transfer reputation to the shuffled list of new wallets."""
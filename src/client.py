@@ -4,10 +4,24 @@ import sys
 
 import config
 import lrs
-from util import Constants, send, sendrecv, powm, modinv, msg_hash, randkey, randkeyRP, eprint
+from util import Constants, multiplexer, send, sendrecv, powm, register_base, modinv, msg_hash, randkey, randkeyRP, eprint
+from workers import PrecomputePool
 from hashlib import sha1
 
 
+def signing_material(generator):
+	"""Returns (k, generator^k, k^-1 mod P - 1) for an ElGamal signature."""
+	k = randkeyRP(1, Constants.P - 2)
+	return k, powm(generator, k), modinv(k, Constants.P - 1)
+
+
+class SigningPool(PrecomputePool):
+	"""Material for upcoming signatures, keyed by the round's generator."""
+
+	def __init__(self):
+		super().__init__(signing_material)
+
+
 class Client:
 	"""Base implementation of client."""
 
@@ -18,48 +32,138 @@ class Client:
 		self.pri_key = randkey() if private_key is None else private_key
 		self.pub_key = powm(Constants.G, self.pri_key)
 
+		self.signing = SigningPool() # for message signatures in this round
+		self.stp = (None, None) # round generator and short-term pseudonym
+		self.round = (-1, None, None) # round state version, generator and ring
+
 		# socket variables
 		self.server_addr = (server_host, server_port)
 
 		# new client
 		sendrecv(self.server_addr, [Constants.NEW_CLIENT, self.pub_key])
 
+	def request(self, args, addr=None):
+		"""Sends a request to the server (or addr) without waiting for its reply.
+
+		Requests to the same peer share one connection and can be outstanding at
+		the same time. Returns a future for the reply (see reply()).
+		"""
+		return multiplexer(self.server_addr if addr is None else addr).request(args)
+
+	def reply(self, future):
+		"""Waits for the reply to a request.
+
+		Returns None if the request was turned down.
+		"""
+		reply = future.result()
+		if isinstance(reply, list) and len(reply) == 2 and reply[0] == Constants.FAIL:
+			eprint(self.name, reply[1])
+			return None
+		return reply
+
+	def query(self, args, addr=None):
+		"""Sends a request to the server (or addr) and returns its reply.
+
+		Returns None if the request was turned down.
+		"""
+		return self.reply(self.request(args, addr))
+
+	def prepare(self, generator):
+		"""Starts precomputing what signing in the round of generator takes."""
+		register_base(generator)
+		self.signing.fill(generator, config.SIGNING_POOL)
+
+	def short_term_pseudonym(self, generator):
+		"""Returns the short-term pseudonym of the client in the round of generator."""
+		if self.stp[0] != generator:
+			self.stp = (generator, powm(generator, self.pri_key))
+		return self.stp[1]
+
 	def sign(self, msg, generator):
 		"""Sign with ElGamal signature."""
 		r, s = 0, 0
 
 		while s == 0:
-			k = randkeyRP(1, Constants.P - 2)
-			r = powm(generator, k)
-			s = (msg_hash(msg, sha1) - self.pri_key * r) * modinv(k, Constants.P - 1)
-			s %= Constants.P - 1
+			k, r, k_inv = self.signing.take(generator) or signing_material(generator)
+			s = ((msg_hash(msg, sha1) - self.pri_key * r) * k_inv) % (Constants.P - 1)
 
+		self.prepare(generator)
 		return (r, s)
 
-	def lrs_sign(self, msg):
-		"""Sign for LRS."""
-		generator = sendrecv(self.server_addr, [Constants.GET_GENERATOR])
-		stp_array = sendrecv(self.server_addr, [Constants.GET_STP_ARRAY])
-		stp = powm(generator, self.pri_key)
-		stp_idx = stp_array.index(stp)
+	def request_round_state(self):
+		"""Requests the state of the round, which the server leaves the ring out of
+		if the client already holds it.
 
-		# modify stp_array to prevent duplicate voting
-		stp_array.append(msg_hash(msg, sha1))
+		Returns a future to pass to round_state().
+		"""
+		return self.request([Constants.GET_ROUND_STATE, self.round[0]])
 
-		return lrs.sign(msg, self.pri_key, stp_idx, stp_array, g=generator)
+	def round_state(self, future=None):
+		"""Returns the generator and ring of the round, and caches them.
+
+		future: Future from request_round_state(), if it was already called.
+
+		Returns None if the request was turned down.
+		"""
+		state = self.reply(future or self.request_round_state())
+		if state is None:
+			return None
+
+		version, generator, ring = state
+		if ring is None:
+			ring = self.round[2]
+		self.round = (version, generator, ring)
+		return generator, ring
+
+	def request_ring(self):
+		"""Requests everything lrs_sign() needs from the server at once.
+
+		Returns a list of futures to pass to lrs_sign().
+		"""
+		return [self.request_round_state()]
+
+	def lrs_sign(self, msg, ring=None):
+		"""Sign for LRS.
+
+		ring: Futures from request_ring(), if it was already called.
+		"""
+		state, = ring or self.request_ring()
+		generator, stp_array = self.round_state(state) or (None, None)
+		if generator is None or stp_array is None:
+			return None
+		self.prepare(generator)
+
+		stp_idx = stp_array.index(self.short_term_pseudonym(generator))
+
+		# extend the (cached) stp_array to prevent duplicate voting
+		stp_array = stp_array + [msg_hash(msg, sha1)]
+
+		return lrs.sign(msg, self.pri_key, stp_idx, stp_array, g=generator,
+			version=config.LRS_VERSION, size=config.LRS_RING_SIZE)
 
 	def post(self, msg):
 		"""Post a message."""
-		generator = sendrecv(self.server_addr, [Constants.GET_GENERATOR])
-
-		stp = powm(generator, self.pri_key)
+		# the server does not answer NEW_MESSAGE, so the round state is fetched
+		# every time rather than risk signing under last round's generator (it
+		# is only the generator unless the ring has changed)
+		generator, _ = self.round_state() or (None, None)
+		if generator is None:
+			return
+		self.prepare(generator)
+
+		stp = self.short_term_pseudonym(generator)
 		sig = self.sign(msg, generator)
 
 		send(self.server_addr, [Constants.NEW_MESSAGE, msg, stp, sig])
 
 	def vote(self, amount, msg_id):
 		"""Vote on a message."""
-		messages = sendrecv(config.COORDINATOR_ADDR, [Constants.DISP_BOARD])
+		# the board and the ring are independent, so fetch them concurrently
+		board = self.request([Constants.DISP_BOARD], config.COORDINATOR_ADDR)
+		ring = self.request_ring()
+		messages = self.reply(board)
+		if messages is None:
+			return False
 
 		# verify message id
 		if msg_id < 0 or msg_id >= len(messages):
@@ -67,15 +171,12 @@ class Client:
 			return False
 
 		msg = messages[msg_id][1][Constants.MSG]
-		sig = self.lrs_sign(msg)
-
-		response = sendrecv(
-			self.server_addr, [Constants.NEW_FEEDBACK, msg_id, msg, amount, sig])
-		if response[0] == Constants.FAIL:
-			eprint(self.name, response[1])
+		sig = self.lrs_sign(msg, ring)
+		if sig is None:
 			return False
-		else:
-			return True
+
+		response = self.query([Constants.NEW_FEEDBACK, msg_id, msg, amount, sig])
+		return response is not None
 
 	def get_message_board(self):
 		return sendrecv(config.COORDINATOR_ADDR, [Constants.DISP_BOARD])
@@ -12,7 +12,7 @@ import config
 import lrs
 
 from client import Client
-from util import Constants, msg_hash, recv, recvbytes, send, sendbytes, sendrecv, eprint
+from util import Constants, Channel, channel, msg_hash, recv, recvbytes, send, sendbytes, sendrecv, eprint
 from hashlib import sha1
 from Crypto.Cipher import AES, PKCS1_OAEP
 from Crypto.PublicKey import RSA
@@ -33,11 +33,13 @@ class BlockchainClient(Client):
 		self.respond = {
 			Constants.PARTICIPATION_STATUS: self.give_keys,
 			Constants.KEYS: self.get_keys,
+			Constants.SHUFFLE_PAYLOAD: self.get_payload,
 		}
 
 		self.msg_types = {
 			Constants.PARTICIPATION_STATUS: [int],
 			Constants.KEYS: [list, list],
+			Constants.SHUFFLE_PAYLOAD: [],
 		}
 
 		assert set(self.respond.keys()) == set(self.msg_types.keys())
@@ -45,15 +47,23 @@ class BlockchainClient(Client):
 		super().__init__(server_host, server_port)
 
 
-	def lrs_sign(self, msg):
-		"""Sign for LRS."""
-		ltp_array = sendrecv(self.server_addr, [Constants.GET_LTP_ARRAY])
+	def lrs_sign(self, msg, ring=None):
+		"""Sign for LRS.
+
+		ring: Futures from request_ring(), if it was already called.
+		"""
+		state, = ring or self.request_ring()
+		_, ltp_array = self.round_state(state) or (None, None)
+		if ltp_array is None:
+			return None
+
 		ltp_idx = ltp_array.index(self.pub_key)
 
-		# modify stp_array to prevent duplicate voting
-		ltp_array.append(msg_hash(msg, sha1))
+		# extend the (cached) ltp_array to prevent duplicate voting
+		ltp_array = ltp_array + [msg_hash(msg, sha1)]
 
-		return lrs.sign(msg, self.pri_key, ltp_idx, ltp_array)
+		return lrs.sign(msg, self.pri_key, ltp_idx, ltp_array,
+			version=config.LRS_VERSION, size=config.LRS_RING_SIZE)
 
 	def encrypt(self, payload, rsa_key):
 		"""Encrypt a payload using a hybrid cryptosystem.
@@ -100,7 +110,14 @@ class BlockchainClient(Client):
 		self.next_addr = tuple(next_addr)
 		self.e_keys = [PKCS1_OAEP.new(RSA.importKey(key)) for key in e_keys]
 		send(s, ['ACK'])
-		s, addr = self.ss.accept()
+
+		return True
+
+	def get_payload(self, s, msg_args):
+		"""Handles receiving the CoinShuffle payload from the previous hop.
+
+		The payload follows the header as a raw frame on the same channel.
+		"""
 		self.shuffle(recvbytes(s))
 
 		return True
@@ -149,8 +166,10 @@ class BlockchainClient(Client):
 			send(self.next_addr, [Constants.SHUFFLE,
 				[ct.decode(Constants.ENCODING) for ct in ciphertexts]])
 		else:
-			sendbytes(self.next_addr, len(ciphertexts[0]).to_bytes(
-				Constants.INTEGER_SIZE, byteorder='big') + b''.join(ciphertexts))
+			with channel(self.next_addr) as s:
+				send(s, [Constants.SHUFFLE_PAYLOAD])
+				sendbytes(s, len(ciphertexts[0]).to_bytes(
+					Constants.INTEGER_SIZE, byteorder='big') + b''.join(ciphertexts))
 
 		self.wallets = self.new_wallets
 
@@ -173,13 +192,22 @@ class BlockchainClient(Client):
 
 		return ret
 
-	def start_server(self, ss):
+	def serve(self, s, ss):
+		"""Responds to messages on channel s until the peer closes it.
+
+		Stops the CoinShuffle server ss if a handler says this client is done.
+		"""
 		while True:
 			try:
-				# accept and receive socket message
-				s, addr = ss.accept()
 				msg = recv(s)
+			except (EOFError, OSError):
+				break
+			except Exception:
+				# a malformed frame, after which the stream can't be trusted
+				traceback.print_exc()
+				break
 
+			try:
 				# verify message information
 				if not self.verify_message(msg):
 					eprint(self.name, 'Error processing message.')
@@ -189,19 +217,26 @@ class BlockchainClient(Client):
 
 				# respond to received message
 				if msg_head in Constants.OPEN_SOCKET:
-					if not self.respond[msg_head](s, msg_args):
-						break
+					done = not self.respond[msg_head](s, msg_args)
 				else:
-					if not self.respond[msg_head](msg_args):
-						break
-				if msg_head == Constants.SHUFFLE:
+					done = not self.respond[msg_head](msg_args)
+				if done or msg_head == Constants.SHUFFLE:
+					self.listening = False
+					ss.shutdown(socket.SHUT_RDWR)
 					break
-			except ConnectionAbortedError:
-				print()
-				ss.close()
-				break
 			except Exception:
 				traceback.print_exc()
+
+		s.close()
+
+	def start_server(self, ss):
+		while True:
+			try:
+				# accept socket and serve its messages on a separate thread
+				s, addr = ss.accept()
+			except OSError:
+				break
+			Thread(target=self.serve, args=(Channel(s, addr), ss), daemon=True).start()
 		ss.close()
 		self.listening = False
 
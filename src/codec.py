@@ -0,0 +1,206 @@
+# Compact binary encoding for protocol messages.
+#
+# A payload starts with MAGIC (never the first byte of a JSON document) and
+# holds one tagged value. Lists of non-negative integers, which make up most
+# of the traffic (pseudonyms, reputations, shuffle proofs), are packed as
+# fixed-width big-endian integers instead of decimal text.
+
+import struct
+from itertools import chain
+
+MAGIC = b'\x00'
+
+NONE = b'n'
+TRUE = b't'
+FALSE = b'f'
+INT = b'i'
+STR = b's'
+BYTES = b'b'
+LIST = b'l'
+DICT = b'd'
+VECTOR = b'v'  # list of non-negative ints
+MATRIX = b'm'  # list of equal-length lists of non-negative ints
+
+_LEN = struct.Struct('>I')
+_WORDS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}  # widths struct can (un)pack natively
+
+
+def dumps(obj):
+	"""Encodes obj. Raises TypeError if obj has no binary encoding."""
+	out = [MAGIC]
+	_encode(obj, out)
+	return b''.join(out)
+
+
+def loads(payload):
+	"""Decodes a payload produced by dumps().
+
+	payload can be any bytes-like object. Lists of integers are decoded straight
+	out of it without copying the packed buffer.
+	"""
+	view = memoryview(payload)
+	if view[:1] != MAGIC:
+		raise ValueError('Not a binary payload.')
+	obj, offset = _decode(view, 1)
+	if offset != len(view):
+		raise ValueError('Trailing bytes in binary payload.')
+	return obj
+
+
+def is_binary(payload):
+	"""Returns whether payload was produced by dumps()."""
+	return payload[:1] == MAGIC
+
+
+def _naturals(obj):
+	"""Returns whether obj is a non-empty sequence of non-negative ints."""
+	return len(obj) > 0 and set(map(type, obj)) == {int} and min(obj) >= 0
+
+
+def _width(nums):
+	"""Returns the number of bytes needed to pack every integer in nums."""
+	width = (max(nums, default=0).bit_length() + 7) // 8
+	for w in sorted(_WORDS.keys()):
+		if width <= w:
+			return w
+	return width
+
+
+def _pack(nums, width, out):
+	if width in _WORDS:
+		out.append(struct.pack('>{}{}'.format(len(nums), _WORDS[width]), *nums))
+	else:
+		out.append(b''.join(x.to_bytes(width, byteorder='big') for x in nums))
+
+
+def _unpack(view, offset, count, width):
+	if width in _WORDS:
+		fmt = '>{}{}'.format(count, _WORDS[width])
+		return list(struct.unpack_from(fmt, view, offset))
+	end = offset + count * width
+	return [int.from_bytes(view[i:i + width], byteorder='big')
+		for i in range(offset, end, width)]
+
+
+def _encode(obj, out):
+	if obj is None:
+		out.append(NONE)
+	elif obj is True:
+		out.append(TRUE)
+	elif obj is False:
+		out.append(FALSE)
+	elif type(obj) is int:
+		size = (obj + (obj < 0)).bit_length() // 8 + 1
+		out.append(INT + _LEN.pack(size) + obj.to_bytes(size, 'big', signed=True))
+	elif isinstance(obj, str):
+		data = obj.encode('UTF-8')
+		out.append(STR + _LEN.pack(len(data)) + data)
+	elif isinstance(obj, (bytes, bytearray, memoryview)):
+		out.append(BYTES + _LEN.pack(len(obj)))
+		out.append(bytes(obj))
+	elif isinstance(obj, (list, tuple)):
+		_encode_list(obj, out)
+	elif isinstance(obj, dict):
+		if not all(isinstance(k, str) for k in obj.keys()):
+			raise TypeError('Only dicts with str keys can be encoded.')
+		out.append(DICT + _LEN.pack(len(obj)))
+		for k, v in obj.items():
+			_encode(k, out)
+			_encode(v, out)
+	else:
+		raise TypeError('Cannot encode {}.'.format(type(obj).__name__))
+
+
+def _encode_list(obj, out):
+	if _naturals(obj):
+		width = _width(obj)
+		out.append(VECTOR + _LEN.pack(len(obj)) + _LEN.pack(width))
+		_pack(obj, width, out)
+		return
+
+	if (len(obj) > 0 and set(map(type, obj)) <= {list, tuple} and
+			len(set(map(len, obj))) == 1):
+		flat = list(chain.from_iterable(obj))
+		if _naturals(flat):
+			width = _width(flat)
+			out.append(MATRIX + _LEN.pack(len(obj)) + _LEN.pack(len(obj[0])) +
+				_LEN.pack(width))
+			_pack(flat, width, out)
+			return
+
+	out.append(LIST + _LEN.pack(len(obj)))
+	for x in obj:
+		_encode(x, out)
+
+
+def _length(view, offset):
+	return _LEN.unpack_from(view, offset)[0], offset + _LEN.size
+
+
+def _packed_end(view, offset, count, width):
+	"""Returns where count packed integers of width bytes at offset end.
+
+	Raises ValueError if they would run past the end of view, before anything
+	is allocated for them.
+	"""
+	if width == 0:
+		raise ValueError('Zero-width integers in binary payload.')
+	end = offset + count * width
+	if end > len(view):
+		raise ValueError('Packed integers run past the end of binary payload.')
+	return end
+
+
+def _decode(view, offset):
+	tag = bytes(view[offset:offset + 1])
+	offset += 1
+
+	if tag == NONE:
+		return None, offset
+	if tag == TRUE:
+		return True, offset
+	if tag == FALSE:
+		return False, offset
+	if tag == INT:
+		size, offset = _length(view, offset)
+		end = offset + size
+		return int.from_bytes(view[offset:end], 'big', signed=True), end
+	if tag == STR:
+		size, offset = _length(view, offset)
+		end = offset + size
+		return str(view[offset:end], 'UTF-8'), end
+	if tag == BYTES:
+		size, offset = _length(view, offset)
+		end = offset + size
+		return bytes(view[offset:end]), end
+	if tag == LIST:
+		count, offset = _length(view, offset)
+		ret = []
+		for _ in range(count):
+			obj, offset = _decode(view, offset)
+			ret.append(obj)
+		return ret, offset
+	if tag == DICT:
+		count, offset = _length(view, offset)
+		ret = {}
+		for _ in range(count):
+			k, offset = _decode(view, offset)
+			ret[k], offset = _decode(view, offset)
+		return ret, offset
+	if tag == VECTOR:
+		count, offset = _length(view, offset)
+		width, offset = _length(view, offset)
+		end = _packed_end(view, offset, count, width)
+		return _unpack(view, offset, count, width), end
+	if tag == MATRIX:
+		rows, offset = _length(view, offset)
+		cols, offset = _length(view, offset)
+		width, offset = _length(view, offset)
+		end = _packed_end(view, offset, rows * cols, width)
+		if cols == 0:
+			raise ValueError('Empty rows in binary payload.')
+		flat = _unpack(view, offset, rows * cols, width)
+		ret = [flat[i:i + cols] for i in range(0, rows * cols, cols)]
+		return ret, end
+
+	raise ValueError('Unknown tag {!r} in binary payload.'.format(tag))
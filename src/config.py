@@ -3,3 +3,22 @@ COORDINATOR_ADDR = ('localhost', 6667)
 CLIENT_ADDR = ('localhost', 0)
 MESSAGE_PHASE_LENGTH_IN_SECS = 6
 FEEDBACK_PHASE_LENGTH_IN_SECS = 6
+RUNTIME = 'threaded'  # 'threaded' or 'asyncio' for servers and the coordinator
+SERVER_WORKERS = 8  # handler threads per server
+SERVER_QUEUE_LIMIT = 256  # queued client messages per header before rejecting
+SHUFFLE_BATCH_VERIFY = True  # check shuffle proof equations all at once first
+SHUFFLE_WORKERS = 0  # processes for shuffle proofs (0 runs them in the handler thread)
+SHUFFLE_PROOF = 'nizk'  # 'nizk' or 'interactive' proofs between servers in the ring
+SHUFFLE_SPECULATE = True  # start each hop of the ring while the previous one is verified
+ARITH_BACKEND = 'auto'  # 'auto', 'gmpy2' or 'builtin' modular arithmetic (see arith.py)
+SHUFFLE_AUDIT = False  # auditors on the coordinator verify announcement shuffles, off the ring's path (needs 'nizk')
+AUDIT_DIR = 'transcripts'  # transcript store, must be the same directory for all servers and the coordinator
+AUDIT_WORKERS = 2  # auditor processes on the coordinator
+LRS_VERSION = 2  # linkable ring signature hash scheme used and accepted (see lrs.py)
+LRS_RING_SIZE = 0  # sign feedback over buckets of this many pseudonyms (0 signs over all of them, see lrs.buckets())
+LRS_RING_CACHE = 64  # rings of feedback messages kept per round for LRS verification
+LRS_RING_TABLES = True  # fixed-base tables for each cached ring (see lrs.Ring)
+SIGNING_POOL = 4  # message signatures clients precompute for the current round
+FEEDBACK_WORKERS = 2  # processes verifying feedback signatures (0 verifies them on one thread)
+FEEDBACK_BATCH = 64  # most feedback signatures verified in one batch
+FEEDBACK_BATCH_DELAY = 0.005  # seconds to wait for more feedback to batch
@@ -3,11 +3,14 @@ import socket
 import sys
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
+import audit
 import config
+import runtime
 from board import MessageBoard
-from util import Constants, sendrecv, send, recv, eprint, sprint
+from util import Constants, Channel, sendrecv, send, recvrequest, eprint, sprint
 
 
 class Coordinator:
@@ -15,6 +18,7 @@ class Coordinator:
 
 	def __init__(self, host, port):
 		self.name = 'COORDINATOR'
+		audit.check_config()
 
 		# servers variables
 		self.num_servers = 0
@@ -31,6 +35,9 @@ class Coordinator:
 		self.ss.listen(5)
 		self.server_started = False
 		self.servers_ready = 0
+		self.executor = ThreadPoolExecutor(max_workers=1) # one message at a time
+		self.auditor = audit.Auditor(config.AUDIT_DIR, config.AUDIT_WORKERS)
+		self.round = None # audited round (see audit.py)
 
 		sys.stdout.write('\r# servers: 0 | []')
 		sys.stdout.flush()
@@ -40,6 +47,8 @@ class Coordinator:
 				Constants.NEW_SERVER: self.new_server,
 				Constants.END_ANNOUNCEMENT_PHASE: self.end_announcement_phase,
 				Constants.UPDATE_NEIGHBORS: self.server_ready,
+				Constants.NEW_TRANSCRIPT: self.new_transcript,
+				Constants.SHUFFLE_FAILED: self.shuffle_failed,
 		}
 
 		# message type dict for received messages
@@ -47,6 +56,8 @@ class Coordinator:
 				Constants.NEW_SERVER: [list, int],
 				Constants.END_ANNOUNCEMENT_PHASE: [],
 				Constants.UPDATE_NEIGHBORS: [],
+				Constants.NEW_TRANSCRIPT: [int, int],
+				Constants.SHUFFLE_FAILED: [int],
 		}
 
 		assert set(self.respond.keys()) == set(self.msg_types.keys())
@@ -75,35 +86,97 @@ class Coordinator:
 		server_addr, server_pub_key = msg_args
 		server_addr = tuple(server_addr)
 
-		# update new server id
+		# add server to ring ((host, port)) before it hears back, so that it is
+		# in the ring of any broadcast once it knows its id
 		server_id = self.num_servers
-		send(server_addr, [Constants.UPDATE_ID, server_id])
-
-		# add server to ring ((host, port))
 		self.servers.append(server_addr)
 		self.num_servers += 1
 
+		# update new server id
+		send(server_addr, [Constants.UPDATE_ID, server_id])
+
 		sys.stdout.write(
 			'\r# servers: {} | {}'.format(self.num_servers, self.servers))
 		sys.stdout.flush()
 
 	def end_announcement_phase(self, msg_args):
-		"""Handles end of announcement phase."""
+		"""Handles end of announcement phase.
+
+		In audit mode, the message phase only begins once the auditors are done.
+		"""
+		if config.SHUFFLE_AUDIT and self.round is not None:
+			Thread(target=self.accept_announcement, daemon=True).start()
+			return
+
 		sprint(self.name, 'Beginning message phase...')
 		self.phase = Constants.MESSAGE_PHASE
 
+	def accept_announcement(self):
+		"""Begins the message phase if the round's shuffles pass the audit."""
+		# every server receives one hop, unless it is alone in the ring
+		expected = self.num_servers if self.num_servers > 1 else 0
+		if not self.auditor.finish(expected):
+			eprint(self.name,
+				'Audit of round {} failed, restarting the round.'.format(self.round))
+			self.abort_round()
+			return
+
+		sprint(self.name, 'Beginning message phase...')
+		self.phase = Constants.MESSAGE_PHASE
+
+	def shuffle_failed(self, msg_args):
+		"""Handles a server rejecting the shuffle of the hop before it.
+
+		The round is called off. A failed announcement is started over, and a
+		failed reverse announcement ends the round without new long-term
+		pseudonyms.
+
+		server_id: The id of the server that rejected the shuffle.
+		"""
+		server_id, = msg_args
+		eprint(self.name,
+			'Server {} rejected a shuffle, restarting the round.'.format(server_id))
+		announcement = self.phase == Constants.ANNOUNCEMENT_PHASE
+		Thread(target=self.abort_round, args=(announcement,), daemon=True).start()
+
+	def abort_round(self, announcement=True):
+		"""Tells all servers to call off the round, and starts the next one.
+
+		announcement: Whether to begin its announcement phase right away, or to
+		leave that to the main loop, as at the end of a round.
+		"""
+		for server_addr in self.servers:
+			sendrecv(server_addr, [Constants.ABORT_ROUND])
+		if announcement:
+			self.begin_announcement_phase()
+		else:
+			self.board.restart_round([])
+
+	def new_transcript(self, msg_args):
+		"""Handles a server filing a transcript, which the auditors start on.
+
+		round: The round the transcript was filed under.
+		server_id: The id of the server that filed it.
+		"""
+		round, server_id = msg_args
+		self.auditor.submit(round, server_id)
+
 	def server_ready(self, msg_args):
 		self.servers_ready += 1
 
 	def broadcast_neighbors(self):
-		"""Tells all servers about their neighbors."""
-		for idx, server_addr in enumerate(self.servers):
-			prev_idx = (idx - 1) % self.num_servers
-			next_idx = (idx + 1) % self.num_servers
-			prev_addr = self.servers[prev_idx]
-			next_addr = self.servers[next_idx]
+		"""Tells all servers about their neighbors, and waits until they all have
+		acknowledged it (so no acknowledgement is left over for the next time)."""
+		servers = list(self.servers)
+		self.servers_ready = 0
+		for idx, server_addr in enumerate(servers):
+			prev_addr = servers[(idx - 1) % len(servers)]
+			next_addr = servers[(idx + 1) % len(servers)]
 			send(server_addr, [Constants.UPDATE_NEIGHBORS, prev_addr, next_addr])
 
+		while self.servers_ready < len(servers):
+			time.sleep(0.01)
+
 	def begin_client_registration(self):
 		"""Begins the client registration phase."""
 		sprint(self.name, 'Beginning client registration...')
@@ -121,13 +194,8 @@ class Coordinator:
 		random.shuffle(self.servers)
 
 		# update servers and neighbors
-		self.servers_ready = 0
 		self.broadcast_neighbors()
 
-		# pause before beginning announcement phase
-		while self.servers_ready != self.num_servers:
-			time.sleep(0.01)
-
 		server_addr = self.servers[0]
 
 		# get ciphertexts (secret, encrypted reputation)
@@ -141,8 +209,17 @@ class Coordinator:
 			sendrecv(server_addr,
 				[Constants.UPDATE_CLIENTS, secret, reputation, clients])
 
+		if config.SHUFFLE_AUDIT:
+			self.round = self.auditor.start()
+			for server_addr in self.servers:
+				reply = sendrecv(server_addr,
+					[Constants.AUDIT_ROUND, self.round, self.auditor.token])
+				if reply != Constants.SUCCESS:
+					raise ValueError('Server {} does not share AUDIT_DIR ({}).'.format(
+						server_addr, config.AUDIT_DIR))
+
 		send(self.servers[0], [Constants.NEW_ANNOUNCEMENT,
-				Constants.G, [], [], 0, 0, Constants.INIT_ID])
+				Constants.G, [], [], 0, 0, Constants.INIT_ID, []])
 
 	def begin_feedback_phase(self):
 		"""Begins the feedback phase."""
@@ -153,45 +230,77 @@ class Coordinator:
 		"""Sends signal to servers to end the round."""
 		server_addr = self.servers[-1]
 		send(server_addr, [Constants.REV_ANNOUNCEMENT,
-				Constants.INIT_SECRET, [], [], [], 0, 0, Constants.INIT_ID])
+				Constants.INIT_SECRET, [], [], [], 0, 0, Constants.INIT_ID, []])
+
+	def handle(self, s, msg):
+		"""Verifies and responds to a message received on channel s."""
+		try:
+			# displaying a board can be done at any time
+			if len(msg) > 0 and msg[0] == Constants.DISP_BOARD:
+				self.board.process_message(s, msg, self.phase)
+				return
+
+			# a failed shuffle can be reported at either end of a round
+			if (self.phase not in [Constants.REGISTRATION_PHASE,
+					Constants.ANNOUNCEMENT_PHASE] and
+					msg[:1] != [Constants.SHUFFLE_FAILED]):
+				self.board.process_message(s, msg, self.phase)
+				return
+
+			# verify message information
+			if not self.verify_message(msg):
+				eprint(self.name, 'Error processing ' + str(msg) + '.')
+				return
+
+			msg_head, *msg_args = msg
+
+			# respond to received message
+			if msg_head in Constants.OPEN_SOCKET:
+				self.respond[msg_head](s, msg_args)
+			else:
+				self.respond[msg_head](msg_args)
+		except Exception:
+			traceback.print_exc()
+
+	def dispatch(self, s, msg):
+		"""Queues a message received on channel s.
+
+		Returns a future to wait on before reading the next message from s.
+		"""
+		return self.executor.submit(self.handle, s, msg)
+
+	def serve(self, s):
+		"""Responds to messages on channel s until the peer closes it."""
+		while True:
+			try:
+				msg, reply = recvrequest(s)
+			except (EOFError, OSError):
+				break
+			except Exception:
+				# a malformed frame, after which the stream can't be trusted
+				traceback.print_exc()
+				break
+
+			# multiplexed requests are answered whenever they are done
+			future = self.dispatch(reply, msg)
+			if reply is s:
+				future.result()
+
+		s.close()
 
 	def run(self):
+		if config.RUNTIME == Constants.ASYNCIO:
+			runtime.run(self)
+			return
+
 		while True:
-			s, addr = self.ss.accept()
 			try:
-				# accept and receive socket message
-				msg = recv(s)
-
-				# displaying a board can be done at any time
-				if len(msg) > 0 and msg[0] == Constants.DISP_BOARD:
-					self.board.process_message(s, msg, self.phase)
-					continue
-
-				if self.phase not in [Constants.REGISTRATION_PHASE,
-						Constants.ANNOUNCEMENT_PHASE]:
-					self.board.process_message(s, msg, self.phase)
-					continue
-
-				# verify message information
-				if not self.verify_message(msg):
-					eprint(self.name, 'Error processing ' + str(msg) + '.')
-					continue
-
-				msg_head, *msg_args = msg
-
-				# respond to received message
-				if msg_head in Constants.OPEN_SOCKET:
-					self.respond[msg_head](s, msg_args)
-				else:
-					self.respond[msg_head](msg_args)
+				# accept socket and serve its messages on a separate thread
+				s, addr = self.ss.accept()
 			except ConnectionAbortedError:
 				print()
-				self.ss.close()
 				break
-			except Exception:
-				traceback.print_exc()
-			finally:
-				s.close()
+			Thread(target=self.serve, args=(Channel(s, addr),), daemon=True).start()
 		self.ss.close()
 
 
@@ -41,11 +41,7 @@ class BlockchainCoordinator(Coordinator):
 	def update_servers(self):
 		# update servers and neighbors
 		random.shuffle(self.servers)
-		self.servers_ready = 0
 		self.broadcast_neighbors()
-		# pause before beginning message phase
-		while self.servers_ready != self.num_servers:
-			time.sleep(0.01)
 
 	def begin_message_phase(self):
 		"""Begins message phase."""
@@ -0,0 +1,48 @@
+# ElGamal re-encryption of reputations.
+#
+# At every hop of the reputation ring (Server.new_reputation) and of the
+# reverse announcement (Server.announcement_bwd), a server adds its layer of
+# encryption by multiplying each reputation by server_pub_key ** eph_key for
+# every server public key so far. That mask is the same for every reputation,
+# and since it equals (prod server_pub_keys) ** eph_key, an Engine computes it
+# with k multiplications and one exponentiation per hop, for k servers, and then
+# applies it with one multiplication per reputation.
+
+from threading import Lock
+
+import vecmath
+from util import Constants, powm
+
+
+class Engine:
+	"""Re-encrypts reputations under the public keys of the servers so far."""
+
+	def __init__(self, p=Constants.P):
+		self.p = p
+		self.exponentiations = 0 # modular exponentiations done, for benchmarks
+		self.last = (None, None) # ((eph_key, server_pub_keys), mask)
+		self.lock = Lock()
+
+	def mask(self, server_pub_keys, eph_key):
+		"""Returns the product of server_pub_key ** eph_key over server_pub_keys."""
+		key = (eph_key, tuple(server_pub_keys))
+		last_key, mask = self.last
+		if last_key == key:
+			return mask
+
+		h = 1
+		for server_pub_key in server_pub_keys:
+			h = (h * server_pub_key) % self.p
+		mask = powm(h, eph_key, self.p)
+		with self.lock:
+			self.exponentiations += 1
+			self.last = (key, mask)
+		return mask
+
+	def encrypt(self, rep, server_pub_keys, eph_key):
+		"""Adds a layer of encryption with eph_key to the reputation rep."""
+		return (rep * self.mask(server_pub_keys, eph_key)) % self.p
+
+	def encrypt_all(self, reps, server_pub_keys, eph_key):
+		"""Adds a layer of encryption with eph_key to every reputation in reps."""
+		return vecmath.mulmod(reps, self.mask(server_pub_keys, eph_key), self.p)
@@ -0,0 +1,82 @@
+# Batched verification of feedback signatures.
+#
+# Servers hand the linkable ring signature of every NEW_FEEDBACK to a
+# FeedbackVerifier instead of verifying it on the request thread. It collects
+# the signatures that arrive within FEEDBACK_BATCH_DELAY of each other into a
+# batch, groups them by the ring they are verified against and verifies each
+# group on config.FEEDBACK_WORKERS processes (or, with no workers, on its own
+# thread), so that the votes at the end of the feedback phase are not all
+# verified one by one under the GIL.
+
+import multiprocessing
+import queue
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Thread
+
+import lrs
+
+
+class FeedbackVerifier:
+	"""Verifies signatures of feedback in batches."""
+
+	def __init__(self, workers, batch_size, delay):
+		self.batch_size = batch_size
+		self.delay = delay # seconds to wait for more signatures to batch
+		self.executor = None
+		if workers > 0:
+			self.executor = ProcessPoolExecutor(workers,
+				mp_context=multiprocessing.get_context('spawn'))
+		self.queue = queue.Queue() # (msg, sig, ring, future)
+
+		Thread(target=self.run, daemon=True).start()
+
+	def submit(self, msg, sig, ring):
+		"""Queues sig on msg for verification against ring, an lrs.Ring.
+
+		Returns a future for whether sig is valid. It may be resolved on the
+		thread of the process pool, so its callbacks must not block.
+		"""
+		future = Future()
+		self.queue.put((msg, sig, ring, future))
+		return future
+
+	def next_batch(self):
+		"""Waits for a signature and returns it with those that follow shortly."""
+		batch = [self.queue.get()]
+		deadline = time.monotonic() + self.delay
+		while len(batch) < self.batch_size:
+			timeout = deadline - time.monotonic()
+			try:
+				batch.append(self.queue.get(timeout=max(timeout, 0)))
+			except queue.Empty:
+				break
+		return batch
+
+	def run(self):
+		"""This is what the batching thread runs."""
+		while True:
+			groups = {} # (msg, id(ring)) -> (ring, list of (sig, future))
+			for msg, sig, ring, future in self.next_batch():
+				groups.setdefault((msg, id(ring)), (ring, []))[1].append((sig, future))
+
+			for (msg, _), (ring, items) in groups.items():
+				sigs = [sig for sig, future in items]
+				futures = [future for sig, future in items]
+				if self.executor is None:
+					self.resolve(futures, lambda: lrs.verify_batch(msg, sigs, ring))
+				else:
+					done = self.executor.submit(lrs.verify_batch, msg, sigs, ring)
+					done.add_done_callback(
+						lambda done, futures=futures: self.resolve(futures, done.result))
+
+	@staticmethod
+	def resolve(futures, results):
+		"""Sets futures to the list that results() returns."""
+		try:
+			for future, ok in zip(futures, results()):
+				future.set_result(ok)
+		except BaseException as err:
+			for future in futures:
+				if not future.done():
+					future.set_exception(err)
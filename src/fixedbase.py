@@ -0,0 +1,126 @@
+# Fixed-base exponentiation.
+#
+# Bases that are raised to many different exponents (the group generator and
+# each round's generator) are registered here together with their order. They
+# get a table of precomputed powers, so an exponentiation only needs one
+# multiplication per window of the exponent instead of a full square-and-
+# multiply. Small groups additionally get a table of every power of the base,
+# once the base has been used often enough to pay for building it.
+
+from array import array
+from collections import OrderedDict
+from itertools import count
+from threading import Lock
+
+WINDOW = 8  # bits of the exponent handled by each row of a windowed table
+FULL_TABLE_LIMIT = 2 ** 20  # largest order for which every power is tabulated
+FULL_TABLE_USES = 4  # build the full table after order // FULL_TABLE_USES uses
+MAX_BASES = 4  # registered bases kept besides pinned ones
+
+
+class FixedBase:
+	"""Precomputed powers of a base of known order modulo p.
+
+	Tables are built on first use. Exponents are reduced modulo the order, so
+	negative exponents work too.
+	"""
+
+	def __init__(self, base, p, order, window=WINDOW):
+		self.base = base
+		self.p = p
+		self.order = order
+		self.window = window
+		self.mask = (1 << window) - 1
+
+		self.rows = None # rows[j][d] = base^(d * 2^(window * j))
+		self.full = None # full[e] = base^e, for small orders
+		self.uses = count() # next() counts a use atomically, without taking the lock
+		self.lock = Lock()
+
+	def _build_rows(self):
+		rows = []
+		b = self.base
+		for _ in range((self.order.bit_length() + self.window - 1) // self.window):
+			row = [1]
+			for _ in range(self.mask):
+				row.append((row[-1] * b) % self.p)
+			rows.append(row)
+			b = (row[-1] * b) % self.p
+		return rows
+
+	def _build_full(self):
+		full = array('Q', bytes(8 * self.order)) if self.p < 2 ** 64 else [0] * self.order
+		x = 1
+		for e in range(self.order):
+			full[e] = x
+			x = (x * self.base) % self.p
+		return full
+
+	def pow(self, exp):
+		"""Returns base^exp mod p."""
+		exp %= self.order
+		if self.full is not None:
+			return self.full[exp]
+
+		uses = next(self.uses)
+		if self.rows is None or (self.order <= FULL_TABLE_LIMIT and
+				uses >= self.order // FULL_TABLE_USES):
+			# threads that get here together build each table only once
+			with self.lock:
+				if self.rows is None:
+					self.rows = self._build_rows()
+				elif self.full is None:
+					self.full = self._build_full()
+				if self.full is not None:
+					return self.full[exp]
+
+		ret = 1
+		for row in self.rows:
+			if exp == 0:
+				break
+			digit = exp & self.mask
+			if digit != 0:
+				ret = (ret * row[digit]) % self.p
+			exp >>= self.window
+		return ret
+
+
+_bases = OrderedDict() # (base, p) -> FixedBase, least recently registered first
+_pinned = {} # (base, p) -> FixedBase, never evicted
+_lock = Lock()
+
+
+def register(base, p, order, pinned=False):
+	"""Registers base for fixed-base exponentiation modulo p.
+
+	order must be a multiple of the order of base. Pinned bases are kept for the
+	lifetime of the process; others are evicted once MAX_BASES newer ones are
+	registered. Returns whether base was registered.
+	"""
+	key = (base, p)
+	with _lock:
+		if key in _pinned:
+			return True
+		if key in _bases:
+			_bases.move_to_end(key)
+			return True
+
+	if base <= 1 or pow(base, order, p) != 1:
+		return False
+
+	table = FixedBase(base, p, order)
+	with _lock:
+		if pinned:
+			_bases.pop(key, None)
+			_pinned[key] = table
+		else:
+			_bases[key] = table
+			while len(_bases) > MAX_BASES:
+				_bases.popitem(last=False)
+	return True
+
+
+def lookup(base, p):
+	"""Returns the FixedBase registered for base modulo p, or None."""
+	key = (base, p)
+	return _pinned.get(key) or _bases.get(key)
@@ -1,73 +1,286 @@
 # Adapted from https://eprint.iacr.org/2004/027.pdf
 # See above for more details.
+#
+# Signatures carry the version of the hash scheme they were made with:
+# LEGACY hashes the whole ring into every step, DIGEST hashes the ring once
+# into a RingDigest and only feeds that digest to the steps.
+#
+# DIGEST signatures can also be made over a bucket of the ring instead of the
+# whole ring (see buckets()), so that signing and verifying take O(size)
+# exponentiations. h is still taken of the whole ring, so the tag t of a
+# signer is the same in every bucket and double votes are still linked.
 
+from collections import OrderedDict
+from threading import Lock
+
+import fixedbase
+from multiexp import multi_exp
 from util import Constants, powm, randkey
-from hashlib import sha1
+from hashlib import sha1, sha256
+
+LEGACY = 1  # H1 and H2 hash str() of the whole ring
+DIGEST = 2  # H1 and H2 hash a RingDigest of the ring
+
+
+class RingDigest:
+	"""SHA-256 digest of a ring of public keys.
+
+	Extending a ring by a few keys (like the message hash that is appended to
+	prevent duplicate votes) reuses the digest state of the ring instead of
+	hashing it again.
+	"""
+
+	def __init__(self, L=(), state=None):
+		self.hash = sha256() if state is None else state
+		for y in L:
+			b = _to_bytes(y)
+			self.hash.update(len(b).to_bytes(4, byteorder='big') + b)
+
+	def extend(self, keys):
+		"""Returns the RingDigest of this ring followed by keys."""
+		return RingDigest(keys, self.hash.copy())
+
+	def digest(self):
+		return self.hash.digest()
+
+
+class Ring:
+	"""What verifying signatures against a ring takes besides the signatures.
+
+	Holds the ring L, its digest and h = H2 of it for one version and group,
+	its buckets of size (if any) and optionally fixed-base tables of g and h.
+	Build one per ring that several signatures are verified against and pass it
+	to verify() as pre.
+	"""
+
+	def __init__(self, L, g=Constants.G, p=Constants.P, q=Constants.Q,
+			version=DIGEST, ring=None, tables=False, size=0):
+		self.L = L
+		self.g, self.p, self.q = g, p, q
+		self.version = version
+		steps = _hash_steps('', L, version, ring)
+		self.digest = steps.ring if version == DIGEST else None
+		self.h = H2(steps.ring, g, p, q)
+		self.size = size
+		self.buckets = buckets(L, size, self.digest) if size > 0 and self.digest else None
+		self.tables = tables
+		self._build_tables()
+
+	def _build_tables(self):
+		self.g_table = self.h_table = None
+		if self.tables:
+			g, p, q = self.g, self.p, self.q
+			self.g_table = fixedbase.lookup(g, p) or fixedbase.FixedBase(g, p, q)
+			self.h_table = fixedbase.FixedBase(self.h, p, q)
+
+	def __getstate__(self):
+		# tables are rebuilt by the process that unpickles the ring
+		state = dict(self.__dict__)
+		state['g_table'] = state['h_table'] = None
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._build_tables()
 
+	def matches(self, L, version, g, p, q):
+		return (self.L is L and self.version == version and
+			(self.g, self.p, self.q) == (g, p, q))
 
-def sign(msg, x_i, idx, L, g=Constants.G, p=Constants.P, q=Constants.Q):
+
+class RingCache:
+	"""Rings of the current round, keyed by (round, message hash).
+
+	Holds up to size rings, evicting the least recently used one. Counts hits
+	and misses, so that it can be confirmed the feedback path reuses them.
+	"""
+
+	def __init__(self, size):
+		self.size = size
+		self.round = 0
+		self.rings = OrderedDict() # (round, key) -> Ring
+		self.hits = 0
+		self.misses = 0
+		self.lock = Lock()
+
+	def clear(self):
+		"""Forgets every ring, when the ring of keys changes."""
+		with self.lock:
+			self.round += 1
+			self.rings.clear()
+
+	def get(self, key, build):
+		"""Returns the ring under key, calling build() to make it if needed."""
+		with self.lock:
+			round = self.round
+			ring = self.rings.get((round, key))
+			if ring is not None:
+				self.hits += 1
+				self.rings.move_to_end((round, key))
+				return ring
+			self.misses += 1
+
+		ring = build()
+		with self.lock:
+			# a ring built while the round changed is not kept
+			if round == self.round:
+				self.rings[(round, key)] = ring
+				while len(self.rings) > self.size:
+					self.rings.popitem(last=False)
+		return ring
+
+	def stats(self):
+		"""Returns the hit and miss counts and the number of rings held."""
+		with self.lock:
+			return {'hits': self.hits, 'misses': self.misses, 'size': len(self.rings)}
+
+
+def buckets(L, size, digest):
+	"""Splits ring L into buckets of size to 2 * size - 1 keys.
+
+	The split only depends on the keys and digest, the ring's digest, so anyone
+	who knows the ring rebuilds the same buckets. A ring of fewer than 2 * size
+	keys is a single bucket.
+	"""
+	k = max(1, len(L) // size)
+	if k == 1:
+		return [list(L)]
+	order = sorted(range(len(L)), key=lambda i: sha256(digest + _to_bytes(L[i])).digest())
+	return [[L[i] for i in order[j::k]] for j in range(k)]
+
+
+def sign(msg, x_i, idx, L, g=Constants.G, p=Constants.P, q=Constants.Q,
+		version=DIGEST, ring=None, size=0):
 	"""Signs a message using a linkable ring signature.
 
 	msg: The message to be signed
 	x_i: The private key of the signer
 	idx: The index of the public key in L
 	L: List of public keys
+	version: The hash scheme to use (LEGACY or DIGEST)
+	ring: RingDigest of L, if already known (DIGEST only)
+	size: Sign over the signer's bucket of this size instead of all of L
+	(DIGEST only)
 
 	Returns the signature.
 	"""
+	# step 1
+	steps = _hash_steps(msg, L, version, ring)
+	h = H2(steps.ring, g, p, q)
+	t = powm(h, x_i, p)
+
+	bucket = None
+	if size > 0:
+		if version != DIGEST:
+			raise ValueError('Only DIGEST signatures can be made over a bucket.')
+		y = L[idx]
+		bucket, L = next((j, B) for j, B in enumerate(buckets(L, size, steps.ring))
+			if y in B)
+		idx = L.index(y)
+	steps.start(t, bucket)
+
 	n = len(L)
 	c = [0 for _ in range(n)]
 	s = [0 for _ in range(n)]
 
-	# step 1
-	h = H2(L, g, p, q)
-	t = powm(h, x_i, p)
-
 	# step 2
 	u = randkey(0, q - 1)
-	c[(idx + 1) % n] = H1([L, t, msg, powm(g, u, p), powm(h, u, p)])
+	c[(idx + 1) % n] = steps.step(powm(g, u, p), powm(h, u, p))
 
 	# step 3
 	i = (idx + 1) % n
 	while i != idx:
 		s[i] = randkey(0, q - 1)
-		z_1 = (powm(g, s[i], p) * powm(L[i], c[i], p)) % p
-		z_2 = (powm(h, s[i], p) * powm(t, c[i], p)) % p
-		c[(i + 1) % n] = H1([L, t, msg, z_1, z_2])
+		z_1 = multi_exp([g, L[i]], [s[i], c[i]], p)
+		z_2 = multi_exp([h, t], [s[i], c[i]], p)
+		c[(i + 1) % n] = steps.step(z_1, z_2)
 		i = (i + 1) % n
 
 	# step 4
 	s[idx] = (u - ((x_i * c[idx]) % q)) % q
 
-	return (c[0], s, t)
+	if bucket is None:
+		return (c[0], s, t, version)
+	return (c[0], s, t, version, bucket)
 
 
-def verify(msg, L, c_0, s, t, g=Constants.G, p=Constants.P, q=Constants.Q):
+def verify(msg, L, c_0, s, t, version=LEGACY, bucket=None,
+		g=Constants.G, p=Constants.P, q=Constants.Q, ring=None, pre=None, size=0):
 	"""Verifies a message signed with a linkable ring signature.
 
 	msg: The message to be signed
 	L: List of public keys
-	c_0, s, t: The values returned by sign()
+	c_0, s, t, version, bucket: The values returned by sign() (signatures
+	without a version are LEGACY, and those without a bucket are over all of L)
+	ring: RingDigest of L, if already known (DIGEST only)
+	pre: Ring of L, if already built (ignored unless its version and group match)
+	size: The size of buckets, for signatures over a bucket
 
 	Returns whether the signature is valid.
 	"""
+	if pre is None or not pre.matches(L, version, g, p, q):
+		pre = None
+		steps = _hash_steps(msg, L, version, ring)
+		h, g_table, h_table = H2(steps.ring, g, p, q), None, None
+	else:
+		steps = _hash_steps(msg, L, version, digest=pre.digest)
+		h, g_table, h_table = pre.h, pre.g_table, pre.h_table
+
+	if bucket is not None:
+		if size <= 0 or version != DIGEST:
+			return False
+		B = pre.buckets if pre is not None and pre.size == size else \
+			buckets(L, size, steps.ring)
+		if not 0 <= bucket < len(B):
+			return False
+		L = B[bucket]
+	steps.start(t, bucket)
+
 	n = len(L)
+	if len(s) != n:
+		return False
 	c = [0 for _ in range(n)]
 	c[0] = c_0
 
-	h = H2(L, g, p, q)
-
 	for i in range(n):
-		z_1 = (powm(g, s[i], p) * powm(L[i], c[i], p)) % p
-		z_2 = (powm(h, s[i], p) * powm(t, c[i], p)) % p
-		c[(i + 1) % n] = H1([L, t, msg, z_1, z_2])
+		z_1 = _pow2(g_table, g, L[i], s[i], c[i], p)
+		z_2 = _pow2(h_table, h, t, s[i], c[i], p)
+		c[(i + 1) % n] = steps.step(z_1, z_2)
 
 	return c_0 == c[0]
 
 
+def verify_batch(msg, sigs, pre):
+	"""Verifies several signatures of msg against the Ring pre.
+
+	Returns a list of whether each is valid. Malformed signatures are invalid.
+	"""
+	ret = []
+	for sig in sigs:
+		try:
+			ret.append(verify(msg, pre.L, *sig, g=pre.g, p=pre.p, q=pre.q,
+				pre=pre, size=pre.size))
+		except (TypeError, ValueError, IndexError, OverflowError):
+			ret.append(False)
+	return ret
+
+
+def _pow2(table, base, y, e, f, p):
+	"""Returns base^e * y^f mod p, using table for base if there is one."""
+	if table is None:
+		return multi_exp([base, y], [e, f], p)
+	return (table.pow(e) * multi_exp([y], [f], p)) % p
+
+
+def signature_version(sig):
+	"""Returns the version of a signature returned by sign()."""
+	return sig[3] if len(sig) > 3 else LEGACY
+
+
 def H1(msg):
-	"""Hash function 1."""
-	msg = str(msg).encode(Constants.ENCODING)
+	"""Hash function 1. Hashes str(msg), or msg itself if it is bytes."""
+	if not isinstance(msg, bytes):
+		msg = str(msg).encode(Constants.ENCODING)
 	return int(sha1(msg).hexdigest(), 16)
 
 
@@ -75,3 +288,60 @@ def H2(msg, g, p, q):
 	"""Hash function 2."""
 	val = H1(msg) % q
 	return powm(g, val, p)
+
+
+def _hash_steps(msg, L, version, ring=None, digest=None):
+	if version == LEGACY:
+		return _LegacySteps(msg, L)
+	if version == DIGEST:
+		if digest is None:
+			digest = (ring or RingDigest(L)).digest()
+		return _DigestSteps(msg, digest)
+	raise ValueError('Unknown LRS version: {}'.format(version))
+
+
+class _LegacySteps:
+	"""H1 of every step of a LEGACY signature: [L, t, msg, z_1, z_2]."""
+
+	def __init__(self, msg, L):
+		self.msg = msg
+		self.L = L
+		self.ring = L # what H2 is taken of
+
+	def start(self, t, bucket=None):
+		self.t = t
+
+	def step(self, z_1, z_2):
+		return H1([self.L, self.t, self.msg, z_1, z_2])
+
+
+class _DigestSteps:
+	"""H1 of every step of a DIGEST signature.
+
+	Hashes the ring digest, t and msg once, and then only z_1 and z_2 per step.
+	"""
+
+	def __init__(self, msg, digest):
+		self.ring = digest # what H2 is taken of
+		self.msg = msg.encode(Constants.ENCODING)
+
+	def start(self, t, bucket=None):
+		self.prefix = sha1(self.ring)
+		for value in [t, self.msg] + ([] if bucket is None else [bucket]):
+			self._update(self.prefix, value)
+
+	def step(self, z_1, z_2):
+		h = self.prefix.copy()
+		self._update(h, z_1)
+		self._update(h, z_2)
+		return int.from_bytes(h.digest(), byteorder='big')
+
+	@staticmethod
+	def _update(h, value):
+		if isinstance(value, int):
+			value = _to_bytes(value)
+		h.update(len(value).to_bytes(4, byteorder='big') + value)
+
+
+def _to_bytes(value):
+	return value.to_bytes((value.bit_length() + 7) // 8, byteorder='big')
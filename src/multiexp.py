@@ -0,0 +1,102 @@
+# Multi-exponentiation.
+#
+# Computes products of powers, like the Lambda and Phi products of the shuffle
+# proof, in one pass that shares the squarings between all terms: Straus's
+# interleaved windows for a few terms and Pippenger's buckets for many. Bases
+# registered with fixedbase use their tables instead.
+
+import arith
+import fixedbase
+
+STRAUS_WINDOW = 4  # bits of each exponent handled per step of straus()
+PIPPENGER_MIN = 64  # number of terms from which pippenger() beats straus()
+SMALL_MODULUS = 2 ** 64  # below this, builtin pow is faster for a few terms
+SMALL_MIN = 32  # number of terms from which pippenger() beats builtin pow
+
+
+def naive(bases, exponents, p):
+	"""Returns the product of bases[i]^exponents[i] mod p, one pow at a time."""
+	ret = 1
+	for base, exp in zip(bases, exponents):
+		ret = (ret * arith.powmod(base, exp, p)) % p
+	return ret
+
+
+def straus(bases, exponents, p, window=STRAUS_WINDOW):
+	"""Like naive(), with interleaved fixed windows of the exponents."""
+	mask = (1 << window) - 1
+	rows = []
+	for base in bases:
+		row = [1, base % p]
+		for _ in range(mask - 1):
+			row.append((row[-1] * base) % p)
+		rows.append(row)
+
+	ret = 1
+	bits = max(exp.bit_length() for exp in exponents)
+	for shift in range(((bits + window - 1) // window - 1) * window, -1, -window):
+		if ret != 1:
+			for _ in range(window):
+				ret = (ret * ret) % p
+		for row, exp in zip(rows, exponents):
+			digit = (exp >> shift) & mask
+			if digit != 0:
+				ret = (ret * row[digit]) % p
+	return ret
+
+
+def pippenger(bases, exponents, p, window=None):
+	"""Like naive(), summing the bases into one bucket per window digit."""
+	if window is None:
+		window = max(1, len(bases).bit_length() - 2)
+	mask = (1 << window) - 1
+
+	ret = 1
+	bits = max(exp.bit_length() for exp in exponents)
+	for shift in range(((bits + window - 1) // window - 1) * window, -1, -window):
+		if ret != 1:
+			for _ in range(window):
+				ret = (ret * ret) % p
+
+		buckets = [1] * (mask + 1)
+		for base, exp in zip(bases, exponents):
+			digit = (exp >> shift) & mask
+			if digit != 0:
+				buckets[digit] = (buckets[digit] * base) % p
+
+		# product of bucket[d]^d for all digits d
+		running, total = 1, 1
+		for digit in range(mask, 0, -1):
+			running = (running * buckets[digit]) % p
+			total = (total * running) % p
+		ret = (ret * total) % p
+	return ret
+
+
+def multi_exp(bases, exponents, p):
+	"""Returns the product of bases[i]^exponents[i] mod p.
+
+	Negative exponents are handed to arith.powmod(), like powm() would.
+	"""
+	assert(len(bases) == len(exponents))
+
+	ret = 1
+	rest_bases, rest_exponents = [], []
+	for base, exp in zip(bases, exponents):
+		table = fixedbase.lookup(base, p)
+		if table is not None:
+			ret = (ret * table.pow(exp)) % p
+		elif exp < 0:
+			ret = (ret * arith.powmod(base, exp, p)) % p
+		elif exp != 0:
+			rest_bases.append(base)
+			rest_exponents.append(exp)
+
+	n = len(rest_bases)
+	if n == 0:
+		return ret
+	if p < SMALL_MODULUS and n < SMALL_MIN:
+		return (ret * naive(rest_bases, rest_exponents, p)) % p
+	if n < PIPPENGER_MIN:
+		return (ret * straus(rest_bases, rest_exponents, p)) % p
+	return (ret * pippenger(rest_bases, rest_exponents, p)) % p
@@ -0,0 +1,105 @@
+# Process pool for the vector computations of the shuffle proof.
+#
+# Lists of independent exponentiations are split into chunks that run on
+# config.SHUFFLE_WORKERS processes, so a proof isn't limited to the one core
+# its handler thread gets under the GIL. With no workers configured (or for
+# short lists) everything runs in the calling thread.
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+import config
+import fixedbase
+import multiexp
+import vecmath
+
+MIN_CHUNK = 512  # fewest exponentiations worth sending to another process
+CHUNKS_PER_WORKER = 4  # chunks per worker, to even out uneven chunks
+
+_executor = None
+_workers = 0
+_lock = Lock()
+
+
+def executor():
+	"""Returns the process pool, or None if no workers are configured.
+
+	The pool is (re)started whenever config.SHUFFLE_WORKERS changes.
+	"""
+	global _executor, _workers
+	with _lock:
+		if _workers != config.SHUFFLE_WORKERS:
+			if _executor is not None:
+				_executor.shutdown()
+			_executor = None
+			_workers = config.SHUFFLE_WORKERS
+			if _workers > 0:
+				_executor = ProcessPoolExecutor(_workers,
+					mp_context=multiprocessing.get_context('spawn'))
+		return _executor
+
+
+def _split(n):
+	"""Returns the (start, end) ranges to split n items into.
+
+	Returns None if the items are better handled in this process.
+	"""
+	if n < 2 * MIN_CHUNK or executor() is None:
+		return None
+	size = max(MIN_CHUNK, -(-n // (CHUNKS_PER_WORKER * _workers)))
+	return [(i, min(i + size, n)) for i in range(0, n, size)]
+
+
+def _powers_of(exps, base, p, order):
+	if fixedbase.register(base, p, order):
+		table = fixedbase.lookup(base, p)
+		return [table.pow(exp) for exp in exps]
+	return vecmath.powmod(base, exps, p)
+
+
+def _powers(bases, exp, p):
+	return vecmath.powmod(bases, exp, p)
+
+
+def _multi_exp(bases, exps, p):
+	return multiexp.multi_exp(bases, exps, p)
+
+
+def powers_of(base, exps, p, order):
+	"""Returns [base^exp mod p for exp in exps].
+
+	order must be a multiple of the order of base (see fixedbase.register()).
+	"""
+	chunks = _split(len(exps))
+	if chunks is None:
+		return _powers_of(exps, base, p, order)
+
+	futures = [executor().submit(_powers_of, exps[start:end], base, p, order)
+		for start, end in chunks]
+	return [x for future in futures for x in future.result()]
+
+
+def powers(bases, exp, p):
+	"""Returns [base^exp mod p for base in bases]."""
+	chunks = _split(len(bases))
+	if chunks is None:
+		return _powers(bases, exp, p)
+
+	futures = [executor().submit(_powers, bases[start:end], exp, p)
+		for start, end in chunks]
+	return [x for future in futures for x in future.result()]
+
+
+def multi_exp(bases, exps, p):
+	"""Like multiexp.multi_exp(), with the terms split between the workers."""
+	chunks = _split(len(bases))
+	if chunks is None:
+		return _multi_exp(bases, exps, p)
+
+	futures = [executor().submit(_multi_exp, bases[start:end], exps[start:end], p)
+		for start, end in chunks]
+	ret = 1
+	for future in futures:
+		ret = (ret * future.result()) % p
+	return ret
@@ -0,0 +1,92 @@
+# asyncio runtime for servers and the coordinator.
+#
+# Connections are accepted and framed on a single event loop. Messages are
+# handed to the node's dispatch(), which runs the handlers on the node's own
+# workers, so the loop itself only ever waits on I/O.
+
+import asyncio
+import traceback
+
+from util import Constants, Channel, unpack_request
+
+
+class StreamSocket:
+	"""Blocking socket interface to an asyncio stream, for executor threads."""
+
+	def __init__(self, reader, writer, loop):
+		self.reader = reader
+		self.writer = writer
+		self.loop = loop
+
+	async def _write(self, data):
+		self.writer.write(data)
+		await self.writer.drain()
+
+	def sendall(self, data):
+		asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+
+	def recv(self, size):
+		return asyncio.run_coroutine_threadsafe(
+			self.reader.read(size), self.loop).result()
+
+	def recv_into(self, view):
+		data = self.recv(len(view))
+		view[:len(data)] = data
+		return len(data)
+
+	def close(self):
+		self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class StreamChannel(Channel):
+	"""Channel over an asyncio stream, handed to handlers in place of a socket."""
+
+	def __init__(self, reader, writer, loop):
+		super().__init__(StreamSocket(reader, writer, loop),
+			writer.get_extra_info('peername'))
+
+
+async def _serve(node, reader, writer):
+	"""Reads messages from a connection until the peer closes it."""
+	loop = asyncio.get_running_loop()
+	s = StreamChannel(reader, writer, loop)
+	node.server_started = True
+
+	while True:
+		try:
+			header = await reader.readexactly(Constants.INTEGER_SIZE)
+			payload = await reader.readexactly(
+				int.from_bytes(header, byteorder='big'))
+		except (asyncio.IncompleteReadError, ConnectionError):
+			break
+
+		# messages on one connection are handled in order, like the threaded mode,
+		# except multiplexed requests, which are answered whenever they are done
+		try:
+			msg, reply = unpack_request(s, payload)
+			future = node.dispatch(reply, msg)
+			if future is None:
+				break
+			if reply is s:
+				await asyncio.wrap_future(future)
+		except Exception:
+			traceback.print_exc()
+			break
+
+	writer.close()
+
+
+def run(node):
+	"""Serves node.ss with an event loop.
+
+	node must provide dispatch(s, msg), which queues msg without blocking and
+	returns a future to wait on before reading the next message (or None to
+	close the connection).
+	"""
+	async def main():
+		server = await asyncio.start_server(
+			lambda reader, writer: _serve(node, reader, writer), sock=node.ss)
+		async with server:
+			await server.serve_forever()
+
+	asyncio.run(main())
@@ -1,12 +1,21 @@
+import queue
 import socket
 import sys
 import traceback
-from threading import Thread
+from concurrent.futures import Future, wait
+from threading import Lock, Thread
 
+import audit
 import config
+import elgamal
+import feedback
 import lrs
+import parallel
+import runtime
 import shuffle
-from util import Constants, send, recv, powm, modinv, msg_hash, randkey, sprint, eprint
+import vecmath
+import workers
+from util import Constants, Channel, Encoded, channel, send, recvrequest, powm, register_base, modinv, msg_hash, randkey, sprint, eprint
 from hashlib import sha1
 
 
@@ -15,6 +24,7 @@ class Server:
 
 	def __init__(self, host, port):
 		self.name = 'SERVER'
+		audit.check_config()
 
 		# identification
 		self.server_id = Constants.INIT_ID
@@ -28,12 +38,25 @@ class Server:
 		self.pri_key = randkey()
 		self.pub_key = powm(Constants.G, self.pri_key)
 		self.secret = None # secret used for encryption/decryption
+		self.ltp_keys = None # (eph_key, secret) of ltp_list during a reverse announcement
 		self.ltp_list = {} # long-term pseudonyms and encrypted reputation scores
 		self.stp_list = {} # short-term pseudonyms and decrypted reputation scores
 		self.stp_array = [] # short-term pseudonym array
+		self.ring = lrs.RingDigest() # digest of stp_array for LRS verification
+		self.lrs_rings = lrs.RingCache(config.LRS_RING_CACHE) # rings of this round by message
 		self.generator = None # round-based global generator
 		self.nym_list = {} # pseudonym list used for decryption
-		self.lrs_duplicates = set() # duplicate feedback set
+		self.elgamal = elgamal.Engine() # re-encrypts reputations under server keys
+		self.lrs_duplicates = set() # tags of feedback that was accepted or is being verified
+		self.lrs_lock = Lock() # reserves tags in lrs_duplicates
+		self.feedback = feedback.FeedbackVerifier(
+			config.FEEDBACK_WORKERS, config.FEEDBACK_BATCH, config.FEEDBACK_BATCH_DELAY)
+		self.commitments = shuffle.CommitmentPool() # for upcoming shuffle proofs
+		self.round = None # round to file announcement transcripts under (see audit.py)
+
+		# what clients fetch with GET_ROUND_STATE: [version, generator, ring], where
+		# versions start at random so that a restarted server's are new to clients
+		self.round_state = Encoded([randkey(), None, []])
 
 		# socket variables
 		self.addr = (host, port)
@@ -41,6 +64,8 @@ class Server:
 		self.ss.bind(self.addr)
 		self.ss.listen(5)
 		self.server_started = False
+		self.workers = workers.WorkerPool(
+			config.SERVER_WORKERS, config.SERVER_QUEUE_LIMIT, Constants.RING)
 
 		send(config.COORDINATOR_ADDR,
 			[Constants.NEW_SERVER, self.addr, self.pub_key])
@@ -59,76 +84,158 @@ class Server:
 				Constants.UPDATE_NEIGHBORS: self.update_neighbors,
 				Constants.GET_GENERATOR: self.get_generator,
 				Constants.GET_STP_ARRAY: self.get_stp_array,
+				Constants.GET_ROUND_STATE: self.get_round_state,
 				Constants.GET_CIPHERTEXTS: self.get_ciphertexts,
 				Constants.GET_CLIENTS: self.get_clients,
 				Constants.UPDATE_CLIENTS: self.update_clients,
+				Constants.AUDIT_ROUND: self.audit_round,
+				Constants.ABORT_ROUND: self.abort_round,
 		}
 
 		# message type dict for received messages
 		self.msg_types = {
 				Constants.NEW_CLIENT: [int],
 				Constants.NEW_REPUTATION: [int, int, list, int],
-				Constants.NEW_ANNOUNCEMENT: [int, list, list, int, int, int],
+				Constants.NEW_ANNOUNCEMENT: [int, list, list, int, int, int, list],
 				Constants.REPLACE_STP: [list, int, int],
 				Constants.NEW_MESSAGE: [str, int, list],
 				Constants.NEW_FEEDBACK: [int, str, int, list],
-				Constants.REV_ANNOUNCEMENT: [int, list, list, list, int, int, int],
+				Constants.REV_ANNOUNCEMENT: [int, list, list, list, int, int, int, list],
 				Constants.REPLACE_LTP: [list, int, int],
 				Constants.UPDATE_ID: [int],
 				Constants.UPDATE_NEIGHBORS: [list, list],
 				Constants.GET_GENERATOR: [],
 				Constants.GET_STP_ARRAY: [],
+				Constants.GET_ROUND_STATE: [int],
 				Constants.GET_CIPHERTEXTS: [],
 				Constants.GET_CLIENTS: [],
 				Constants.UPDATE_CLIENTS: [int, int, list],
+				Constants.AUDIT_ROUND: [int, str],
+				Constants.ABORT_ROUND: [],
 		}
 
 		assert set(self.respond.keys()) == set(self.msg_types.keys())
 
 	def encryptElGamal(self, rep, server_pub_keys):
 		"""ElGamal encryption of rep using server_pub_keys."""
-		for server_pub_key in server_pub_keys:
-			rep = (rep * powm(server_pub_key, self.eph_key)) % Constants.P
+		return self.elgamal.encrypt(rep, server_pub_keys, self.eph_key)
 
-		return rep
-
-	def decryptElGamal(self, sec_inv, rep):
+	def decryptElGamal(self, sec_inv, reps):
 		"""ElGamal decryption.
 
 		sec_inv: Inverse secret for ElGamal decryption
-		rep: The reputation to decrypt
+		reps: The list of reputations to decrypt
 		"""
-		rep = (rep * sec_inv) % Constants.P
-
-		return rep
+		return vecmath.mulmod(reps, sec_inv, Constants.P)
 
 	def announcement_fwd(self, ann_list, sec_inv):
 		"""Encrypts pseudonyms and decrypts reputations."""
-		new_ann_list = [[], []]
-		for nym in ann_list[0]:
-			new_nym = powm(nym, self.eph_key)
-			self.nym_list[new_nym] = nym
-			new_ann_list[0].append(new_nym)
-		for sec, rep in ann_list[1]:
-			new_rep = self.decryptElGamal(sec_inv, rep)
-			new_ann_list[1].append((sec, new_rep))
+		# one exponent for all pseudonyms, on the shuffle workers if there are any
+		new_nyms = parallel.powers(ann_list[0], self.eph_key, Constants.P)
+		self.nym_list.update(zip(new_nyms, ann_list[0]))
+		secs = [sec for sec, rep in ann_list[1]]
+		new_reps = self.decryptElGamal(sec_inv, [rep for sec, rep in ann_list[1]])
 
-		return new_ann_list
+		return [new_nyms, list(zip(secs, new_reps))]
 
 	def announcement_bwd(self, ann_list, secret, server_pub_keys):
 		"""Decrypts pseudonyms and encrypts reputations."""
-		new_ann_list = [[], []]
-		for nym in ann_list[0]:
-			new_nym = self.nym_list[nym]
-			new_ann_list[0].append(new_nym)
-		for sec, rep in ann_list[1]:
-			new_rep = self.encryptElGamal(rep, server_pub_keys)
-			new_ann_list[1].append((secret, new_rep))
+		new_ann_list = [[self.nym_list[nym] for nym in ann_list[0]], []]
+		new_reps = self.elgamal.encrypt_all(
+			[rep for sec, rep in ann_list[1]], server_pub_keys, self.eph_key)
+		new_ann_list[1] = [(secret, new_rep) for new_rep in new_reps]
 
-		self.nym_list.clear()
+		self.nym_list = {}
 
 		return new_ann_list
 
+	def verify_shuffle(self, s, elts_pre, elts_post, g_, h_, proof):
+		"""Verifies the previous server's shuffle.
+
+		The proof is either carried out over channel s or, for non-interactive
+		proofs, came with the message.
+		"""
+		if config.SHUFFLE_PROOF == Constants.NIZK:
+			return shuffle.verify_nizk(proof, elts_pre, elts_post, g_, h_)
+		return shuffle.verify(s, elts_pre, elts_post, g_, h_)
+
+	def start_verify_shuffle(self, s, elts_pre, elts_post, g_, h_, proof):
+		"""Like verify_shuffle(), but returns a future for the result.
+
+		With config.SHUFFLE_SPECULATE the verification runs alongside the rest of
+		the hop: on the shuffle process pool if there is one and the proof is
+		non-interactive, and on its own thread otherwise. Without it, the
+		verification is done before returning.
+		"""
+		if not config.SHUFFLE_SPECULATE:
+			future = Future()
+			future.set_result(self.verify_shuffle(s, elts_pre, elts_post, g_, h_, proof))
+			return future
+
+		pool = parallel.executor()
+		if config.SHUFFLE_PROOF == Constants.NIZK and pool is not None:
+			return pool.submit(shuffle.verify_nizk, proof, elts_pre, elts_post, g_, h_)
+		return workers.spawn(self.verify_shuffle, s, elts_pre, elts_post, g_, h_, proof)
+
+	def finish_verify_shuffle(self, verified):
+		"""Waits for a verification from start_verify_shuffle(), if any, to end.
+
+		An interactive verification reads the channel of the request, so the
+		handler must not return (and let the channel be read again) before it.
+		"""
+		if verified is not None:
+			wait([verified])
+
+	def audit_shuffle(self, elts_pre, elts_post, g_, h_, proof):
+		"""Files the previous server's shuffle for the auditors instead of verifying it."""
+		store = audit.TranscriptStore(config.AUDIT_DIR)
+		store.append(self.round, self.server_id, elts_pre, elts_post, g_, h_, proof)
+		send(config.COORDINATOR_ADDR,
+			[Constants.NEW_TRANSCRIPT, self.round, self.server_id])
+
+	def shuffle_failed(self):
+		"""Reports that the shuffle of the hop before this server's failed its
+		verification, so that the coordinator calls off the round."""
+		eprint(self.name, 'Verifiable shuffle failed.')
+		send(config.COORDINATOR_ADDR, [Constants.SHUFFLE_FAILED, self.server_id])
+
+	def send_shuffle(self, addr, msg, elts_pre, elts_post, pi, beta, g_, h_,
+			verified=None):
+		"""Sends msg to the server at addr along with a proof of the shuffle.
+
+		The proof is appended to msg if it is non-interactive, and carried out
+		after msg otherwise. Nothing is proven to this server itself.
+
+		verified: Future for the verification of the shuffle this one builds on.
+		Nothing is sent unless it succeeds. Returns whether msg was sent.
+		"""
+		prove = self.addr != addr
+		pre = self.commitments.take(len(pi)) if prove else None
+		if config.SHUFFLE_PROOF == Constants.NIZK:
+			proof = shuffle.prove_nizk(
+				elts_pre, elts_post, pi, beta, g_, h_, pre=pre) if prove else []
+			if verified is not None and not verified.result():
+				return False
+			send(addr, msg + [proof])
+			return True
+
+		if verified is not None and not verified.result():
+			return False
+		with channel(addr) as s:
+			send(s, msg + [[]])
+			if prove:
+				shuffle.prove(s, elts_pre, elts_post, pi, beta, g_, h_, pre=pre)
+		return True
+
+	def precompute_shuffles(self, count):
+		"""Starts precomputing the commitments of count upcoming shuffle proofs.
+
+		Proofs are of the registered clients, and are only needed if there are
+		other servers in the ring.
+		"""
+		if self.next_addr is not None and self.addr != self.next_addr:
+			self.commitments.fill(len(self.ltp_list), count)
+
 	def verify_message(self, msg):
 		"""Verifies that the incoming message is valid."""
 		if len(msg) == 0:
@@ -162,14 +269,41 @@ class Server:
 		v = (powm(stp, r) * powm(r, s)) % Constants.P
 		return u == v
 
+	def lrs_ring(self, client_msg):
+		"""Returns the lrs.Ring that feedback on client_msg is verified against.
+
+		Every vote on a message in a round shares the ring, so it is cached.
+		"""
+		extra = msg_hash(client_msg, sha1)
+		return self.lrs_rings.get(extra, lambda: lrs.Ring(
+			# append the message hash to prevent duplicate voting
+			self.stp_array + [extra], self.generator, version=config.LRS_VERSION,
+			ring=self.ring.extend([extra]), tables=config.LRS_RING_TABLES,
+			size=config.LRS_RING_SIZE))
+
 	def verify_lrs_signature(self, client_msg, client_sig):
-		"""Verifies whether the LRS signature is valid."""
+		"""Verifies whether the LRS signature is valid.
+
+		Only signatures of version config.LRS_VERSION are accepted, since a tag
+		depends on the version and duplicates must be detected.
+		"""
+		return self.start_verify_lrs_signature(client_msg, client_sig).result()
+
+	def start_verify_lrs_signature(self, client_msg, client_sig):
+		"""Like verify_lrs_signature(), but returns a future for the result.
 
-		# modify copy of stp_array to prevent duplicate voting
-		stp_array = list(self.stp_array)
-		stp_array.append(msg_hash(client_msg, sha1))
+		The signature is verified in a batch with other feedback (see feedback.py).
+		"""
+		try:
+			if lrs.signature_version(client_sig) == config.LRS_VERSION:
+				return self.feedback.submit(
+					client_msg, client_sig, self.lrs_ring(client_msg))
+		except (TypeError, ValueError, IndexError, OverflowError):
+			pass # malformed signature
 
-		return lrs.verify(client_msg, stp_array, *client_sig, g=self.generator)
+		future = Future()
+		future.set_result(False)
+		return future
 
 	def new_client(self, s, msg_args):
 		"""Handles the creation of a new client.
@@ -207,6 +341,40 @@ class Server:
 		secret, reputation, clients = msg_args
 		self.secret = secret
 		self.ltp_list = {client: reputation for client in clients}
+		self.lrs_rings.clear()
+		self.update_round_state()
+		send(s, Constants.SUCCESS)
+
+	def audit_round(self, s, msg_args):
+		"""Handles a request from the coordinator to start an audited round.
+
+		round: The round to file announcement transcripts under.
+		token: The token the coordinator claimed the round with in the
+		transcript store, which this server must be able to read back.
+		"""
+		round, token = msg_args
+		if audit.TranscriptStore(config.AUDIT_DIR).token(round) != token:
+			send(s, [Constants.FAIL, 'AUDIT_DIR is not shared with the coordinator.'])
+			return
+
+		self.round = round
+		send(s, Constants.SUCCESS)
+
+	def abort_round(self, s, msg_args):
+		"""Handles the coordinator calling off a round whose announcement failed
+		its audit or the verification of a hop, so that none of its pseudonyms
+		are used."""
+		sprint(self.name, 'Round aborted.')
+		if self.ltp_keys is not None:
+			self.eph_key, self.secret = self.ltp_keys
+			self.ltp_keys = None
+		self.stp_list = {}
+		self.stp_array = []
+		self.nym_list = {}
+		self.generator = None
+		self.ring = lrs.RingDigest()
+		self.lrs_rings.clear()
+		self.update_round_state()
 		send(s, Constants.SUCCESS)
 
 	def new_reputation(self, msg_args):
@@ -236,7 +404,6 @@ class Server:
 				[Constants.NEW_REPUTATION, secret, rep, server_pub_keys, init_id])
 		else:
 			send(self.ciphertext_socket, [secret, rep])
-			self.ciphertext_socket.close()
 
 	def new_announcement(self, s, msg_args):
 		"""Handles a request to carry out one step of the announcement phase.
@@ -246,60 +413,67 @@ class Server:
 		ann_list_post: Announcement list after the previous server's modifications.
 		g_, h_: Verifiable shuffle parameters
 		init_id: The id of the server that was the first in the ring.
+		proof: The previous server's shuffle proof, if it is non-interactive.
 		"""
-		generator, ann_list_pre, ann_list_post, g_, h_, init_id = msg_args
+		generator, ann_list_pre, ann_list_post, g_, h_, init_id, proof = msg_args
 		ann_list = ann_list_post
 
 		if init_id != self.server_id:
+			verified = None
 			if init_id == Constants.INIT_ID:
 				init_id = self.server_id
 				ann_list = []
 				ann_list.append(list(self.ltp_list.keys()))
 				ann_list.append([(self.secret, v) for v in self.ltp_list.values()])
 
+			elif config.SHUFFLE_AUDIT:
+				# the auditors verify the shuffle while the ring goes on
+				self.audit_shuffle(ann_list_pre, ann_list_post, g_, h_, proof)
+
 			else:
-				# verify shuffle from prev server
-				if not shuffle.verify(s, ann_list_pre, ann_list_post, g_, h_):
-					eprint(self.name, 'Verifiable shuffle failed.')
-					s.close()
+				# verify shuffle from prev server, while this hop is computed
+				verified = self.start_verify_shuffle(
+					s, ann_list_pre, ann_list_post, g_, h_, proof)
+				if verified.done() and not verified.result():
+					self.shuffle_failed()
 					return
 
-			s.close()
-
-			# update announcement list
-			secret_inv = modinv(powm(self.secret, self.pri_key))
-			new_ann_list = self.announcement_fwd(ann_list, secret_inv)
-
-			# shuffle announcement list
-			n = len(new_ann_list[0])
-			pi = shuffle.generate_permutation(n)
-			new_ann_list = [shuffle.shuffle(elts, pi) for elts in new_ann_list]
-
-			# update generator and parameters
-			new_generator = powm(generator, self.eph_key)
-			beta = 1
-			g_ = 1
-			h_ = secret_inv
-
-			# pass announcement list to next server
-			s = socket.socket()
-			s.connect(self.next_addr)
-			send(s, [Constants.NEW_ANNOUNCEMENT,
-					new_generator, ann_list, new_ann_list, g_, h_, init_id])
-
-			# prove shuffle to next server (if more than one server)
-			if self.addr != self.next_addr:
-				shuffle.prove(s, ann_list, new_ann_list, pi, beta, g_, h_)
+			# the hop is only undone if the verification it went ahead of fails
+			speculating = verified is not None and not verified.done()
+			nym_list = dict(self.nym_list) if speculating else None
+			try:
+				# update announcement list
+				secret_inv = modinv(powm(self.secret, self.pri_key))
+				new_ann_list = self.announcement_fwd(ann_list, secret_inv)
+
+				# shuffle announcement list
+				n = len(new_ann_list[0])
+				pi = shuffle.generate_permutation(n)
+				new_ann_list = [shuffle.shuffle(elts, pi) for elts in new_ann_list]
+
+				# update generator and parameters
+				new_generator = powm(generator, self.eph_key)
+				beta = 1
+				g_ = 1
+				h_ = secret_inv
+
+				# pass announcement list to next server, with proof of the shuffle
+				if not self.send_shuffle(self.next_addr, [Constants.NEW_ANNOUNCEMENT,
+						new_generator, ann_list, new_ann_list, g_, h_, init_id],
+						ann_list, new_ann_list, pi, beta, g_, h_, verified):
+					self.nym_list = nym_list
+					self.shuffle_failed()
+			finally:
+				self.finish_verify_shuffle(verified)
 		else:
 			# verify shuffle from prev server (if more than one server)
 			if self.addr != self.prev_addr:
-				if not shuffle.verify(s, ann_list_pre, ann_list_post, g_, h_):
-					eprint(self.name, 'Verifiable shuffle failed.')
-					s.close()
+				if config.SHUFFLE_AUDIT:
+					self.audit_shuffle(ann_list_pre, ann_list_post, g_, h_, proof)
+				elif not self.verify_shuffle(s, ann_list_pre, ann_list_post, g_, h_, proof):
+					self.shuffle_failed()
 					return
 
-			s.close()
-
 			# initialize add announcement
 			stp_list = list(zip(ann_list[0], [rep for sec, rep in ann_list[1]]))
 			stp_args = [stp_list, generator, Constants.INIT_ID]
@@ -314,6 +488,7 @@ class Server:
 		"""
 		stp_list, generator, init_id = msg_args
 		self.generator = generator
+		register_base(generator)
 
 		# tell coordinator that announcement phase is finished
 		if init_id == self.server_id:
@@ -328,6 +503,13 @@ class Server:
 			'Announcement phase finished. Updated short-term pseudonyms.')
 		self.stp_list = {k: v for (k, v) in stp_list}
 		self.stp_array = [k for (k, v) in stp_list]
+		self.ring = lrs.RingDigest(self.stp_array)
+		self.lrs_rings.clear()
+		self.update_round_state()
+
+		# during the message and feedback phases, prepare the proofs of the
+		# reverse announcement and of the next round's announcement
+		self.precompute_shuffles(2)
 
 		# modify for printing purposes
 		stp_list_print = {}
@@ -364,6 +546,29 @@ class Server:
 		"""Handles a request for the short-term pseudonym list."""
 		send(s, self.stp_array)
 
+	def round_ring(self):
+		"""Returns the pseudonyms clients sign feedback with this round."""
+		return self.stp_array
+
+	def update_round_state(self):
+		"""Starts a new version of the round state, once the ring has changed."""
+		version = self.round_state.args[0] + 1
+		self.round_state = Encoded([version, self.generator, list(self.round_ring())])
+
+	def get_round_state(self, s, msg_args):
+		"""Handles a request for the state of the round: its version, generator and
+		ring (see round_ring()), encoded once per version and codec.
+
+		version: The version the client already holds. Its ring is left out of the
+		reply (None) if it is still current.
+		"""
+		version, = msg_args
+		state = self.round_state
+		if version == state.args[0]:
+			send(s, state.args[:2] + [None])
+		else:
+			send(s, state)
+
 	def new_feedback(self, s, msg_args):
 		"""Handles a request for posting feedback to a message.
 
@@ -381,22 +586,47 @@ class Server:
 			send(s, [Constants.FAIL, 'Invalid vote amount.'])
 			return
 
-		# verify not a duplicate
-		if client_tag in self.lrs_duplicates:
+		# verify not a duplicate, and reserve the tag until the signature is
+		# verified so that concurrent duplicates are rejected as well
+		with self.lrs_lock:
+			duplicate = client_tag in self.lrs_duplicates
+			if not duplicate:
+				self.lrs_duplicates.add(client_tag)
+		if duplicate:
 			eprint(self.name, 'Feedback linkable ring signature duplicate detected.')
 			send(s, [Constants.FAIL, 'Duplicate vote.'])
 			return
 
-		# verify linkable ring signature
-		if not self.verify_lrs_signature(client_msg, client_sig):
-			eprint(self.name, 'Feedback linkable ring signature verification failed.')
-			send(s, [Constants.FAIL, 'LRS verification failed.'])
-			return
+		# verify linkable ring signature, answering once it is done
+		verified = self.start_verify_lrs_signature(client_msg, client_sig)
+		answered = Future()
 
-		self.lrs_duplicates.add(client_tag)
-		send(config.COORDINATOR_ADDR,
-			[Constants.POST_FEEDBACK, client_msg_id, client_vote])
-		send(s, [Constants.SUCCESS])
+		def reply(verified):
+			try:
+				if (verified.cancelled() or verified.exception() is not None
+						or not verified.result()):
+					eprint(self.name, 'Feedback linkable ring signature verification failed.')
+					with self.lrs_lock:
+						self.lrs_duplicates.discard(client_tag)
+					send(s, [Constants.FAIL, 'LRS verification failed.'])
+					return
+
+				send(config.COORDINATOR_ADDR,
+					[Constants.POST_FEEDBACK, client_msg_id, client_vote])
+				send(s, [Constants.SUCCESS])
+			finally:
+				answered.set_result(None)
+
+		def answer(verified):
+			# verified may be resolved on the thread of the verifiers' process pool,
+			# which must not wait on a slow client
+			try:
+				self.workers.submit(Constants.POST_FEEDBACK, reply, verified)
+			except queue.Full:
+				workers.spawn(reply, verified)
+
+		verified.add_done_callback(answer)
+		return answered
 
 	def rev_announcement(self, s, msg_args):
 		"""Handles doing a reverse announcement.
@@ -407,67 +637,66 @@ class Server:
 		ann_list_post: Announcement list after the previous server's modifications.
 		g_, h_: Verifiable shuffle parameters
 		init_id: The id of the server that was the first in the ring.
+		proof: The next server's shuffle proof, if it is non-interactive.
 		"""
 		(secret, server_pub_keys, ann_list_pre,
-			ann_list_post, g_, h_, init_id) = msg_args
-		ann_list = ann_list_post
+			ann_list_post, g_, h_, init_id, proof) = msg_args
+		ann_list = list(ann_list_post) # ann_list_post may still be being verified
 
 		if init_id != self.server_id:
+			verified = None
 			if init_id == Constants.INIT_ID:
 				init_id = self.server_id
 				ann_list = []
 				ann_list.append([k for k in self.stp_list.keys()])
 				ann_list.append([(secret, v) for v in self.stp_list.values()])
 			else:
-				# verify shuffle from prev server
-				if not shuffle.verify(s, ann_list_pre, ann_list_post, g_, h_):
-					eprint(self.name, 'Verifiable shuffle failed.')
-					s.close()
+				# verify shuffle from prev server, while this hop is computed
+				verified = self.start_verify_shuffle(
+					s, ann_list_pre, ann_list_post, g_, h_, proof)
+				if verified.done() and not verified.result():
+					self.shuffle_failed()
 					return
 
-			s.close()
-
+			state = (self.eph_key, self.secret, self.nym_list)
+			self.ltp_keys = state[:2]
 			self.eph_key = randkey()
-
-			# update announcement list
-			server_pub_keys.append(self.pub_key)
-			self.secret = powm(secret, self.pri_key)
-			secret = (secret * powm(Constants.G, self.eph_key)) % Constants.P
-			ann_list[1] = [(sec, (rep * self.secret) % Constants.P)
-				for sec, rep in ann_list[1]]
-			new_ann_list = self.announcement_bwd(ann_list, secret, server_pub_keys)
-
-			# shuffle announcement list
-			n = len(new_ann_list[0])
-			pi = shuffle.generate_permutation(n)
-			new_ann_list = [shuffle.shuffle(elts, pi) for elts in new_ann_list]
-
-			# update parameters
-			beta = self.eph_key
-			g_ = Constants.G
-			h_ = 1
-			for server_pub_key in server_pub_keys:
-				h_ = (h_ * server_pub_key) % Constants.P
-
-			# pass announcement list to next server
-			s = socket.socket()
-			s.connect(self.prev_addr)
-			send(s, [Constants.REV_ANNOUNCEMENT,
-					secret, server_pub_keys, ann_list, new_ann_list, g_, h_, init_id])
-
-			# prove shuffle to prev server
-			if self.addr != self.prev_addr:
-				shuffle.prove(s, ann_list, new_ann_list, pi, beta, g_, h_)
+			try:
+				# update announcement list
+				server_pub_keys.append(self.pub_key)
+				self.secret = powm(secret, self.pri_key)
+				secret = (secret * powm(Constants.G, self.eph_key)) % Constants.P
+				ann_list[1] = list(zip([sec for sec, rep in ann_list[1]], vecmath.mulmod(
+					[rep for sec, rep in ann_list[1]], self.secret, Constants.P)))
+				new_ann_list = self.announcement_bwd(ann_list, secret, server_pub_keys)
+
+				# shuffle announcement list
+				n = len(new_ann_list[0])
+				pi = shuffle.generate_permutation(n)
+				new_ann_list = [shuffle.shuffle(elts, pi) for elts in new_ann_list]
+
+				# update parameters
+				beta = self.eph_key
+				g_ = Constants.G
+				h_ = 1
+				for server_pub_key in server_pub_keys:
+					h_ = (h_ * server_pub_key) % Constants.P
+
+				# pass announcement list to prev server, with proof of the shuffle
+				if not self.send_shuffle(self.prev_addr, [Constants.REV_ANNOUNCEMENT,
+						secret, server_pub_keys, ann_list, new_ann_list, g_, h_, init_id],
+						ann_list, new_ann_list, pi, beta, g_, h_, verified):
+					self.eph_key, self.secret, self.nym_list = state
+					self.shuffle_failed()
+			finally:
+				self.finish_verify_shuffle(verified)
 		else:
 			# verify shuffle from next server (if more than one server)
 			if self.addr != self.next_addr:
-				if not shuffle.verify(s, ann_list_pre, ann_list_post, g_, h_):
-					eprint(self.name, 'Verifiable shuffle failed.')
-					s.close()
+				if not self.verify_shuffle(s, ann_list_pre, ann_list_post, g_, h_, proof):
+					self.shuffle_failed()
 					return
 
-			s.close()
-
 			# initialize add announcement
 			ltp_list = list(zip(ann_list[0], [rep for sec, rep in ann_list[1]]))
 			ann_args = [ltp_list, secret, Constants.INIT_ID]
@@ -482,8 +711,11 @@ class Server:
 		"""
 		ltp_list, secret, init_id = msg_args
 		self.secret = secret
+		self.ltp_keys = None
 		self.generator = None
-		self.lrs_duplicates.clear()
+		with self.lrs_lock:
+			self.lrs_duplicates.clear()
+		self.lrs_rings.clear()
 
 		# tell coordinator that it's time to start a new round
 		if init_id == self.server_id:
@@ -495,6 +727,8 @@ class Server:
 
 		# add announcement list to current server and update next server
 		self.ltp_list = {k: v for (k, v) in ltp_list}
+		self.update_round_state()
+		self.precompute_shuffles(1)
 
 		# modify for printing purposes
 		ltp_list_print = {}
@@ -523,28 +757,75 @@ class Server:
 
 		send(config.COORDINATOR_ADDR, [Constants.UPDATE_NEIGHBORS])
 
+	def dispatch(self, s, msg):
+		"""Verifies a message received on channel s and queues it for a worker.
+
+		Returns a future to wait on before reading the next message from s, or
+		None if the message was invalid. Messages that need the channel resolve
+		once answered, so a reply (or a shuffle proof) never interleaves with the
+		next message, or when the future returned by their handler does. s can
+		also be a Reply to a multiplexed request.
+		"""
+		# verify message information
+		if not self.verify_message(msg):
+			eprint(self.name, 'Error processing ' + str(msg) + '.')
+			return None
+
+		msg_head, *msg_args = msg
+
+		# queue response to received message
+		try:
+			if msg_head in Constants.OPEN_SOCKET:
+				return workers.settle(
+					self.workers.submit(msg_head, self.respond[msg_head], s, msg_args))
+
+			future = self.workers.submit(msg_head, self.respond[msg_head], msg_args)
+			future.add_done_callback(workers.log_exception)
+		except queue.Full:
+			eprint(self.name, 'Overloaded, rejected {}.'.format(msg_head))
+			if msg_head in Constants.OPEN_SOCKET:
+				send(s, [Constants.FAIL, 'Server overloaded.'])
+
+		return workers.DONE
+
+	def serve(self, s):
+		"""Responds to messages on channel s until the peer closes it."""
+		while True:
+			try:
+				msg, reply = recvrequest(s)
+			except (EOFError, OSError):
+				break
+			except Exception:
+				# a malformed frame, after which the stream can't be trusted
+				traceback.print_exc()
+				break
+
+			try:
+				future = self.dispatch(reply, msg)
+				if future is None:
+					break
+
+				# multiplexed requests are answered whenever they are done
+				if reply is s:
+					future.result()
+			except Exception:
+				traceback.print_exc()
+				break
+
+		s.close()
+
 	def run(self):
 		"""This is what the main server thread runs."""
+		if config.RUNTIME == Constants.ASYNCIO:
+			runtime.run(self)
+			return
+
 		while True:
 			try:
-				# accept and receive socket message
+				# accept socket and serve its messages on a separate thread
 				s, addr = self.ss.accept()
 				self.server_started = True
-				msg = recv(s)
-
-				# verify message information
-				if not self.verify_message(msg):
-					eprint(self.name, 'Error processing ' + str(msg) + '.')
-					s.close()
-					continue
-
-				msg_head, *msg_args = msg
-
-				# respond to received message
-				if msg_head in Constants.OPEN_SOCKET:
-					Thread(target=self.respond[msg_head], args=(s, msg_args)).start()
-				else:
-					Thread(target=self.respond[msg_head], args=(msg_args,)).start()
+				Thread(target=self.serve, args=(Channel(s, addr),), daemon=True).start()
 			except Exception:
 				traceback.print_exc()
 
@@ -29,12 +29,20 @@ class BlockchainServer(Server):
 		self.respond.update(new_respond)
 		self.msg_types.update(new_msg_types)
 
-	def verify_lrs_signature(self, client_msg, client_sig):
-		# modify copy of ltp_array to prevent duplicate voting
-		ltp_array = list(self.ltp_list.keys())
-		ltp_array.append(msg_hash(client_msg, sha1))
-
-		return lrs.verify(client_msg, ltp_array, *client_sig)
+	def new_client(self, s, msg_args):
+		super().new_client(s, msg_args)
+		self.update_round_state()
+
+	def round_ring(self):
+		return list(self.ltp_list.keys())
+
+	def lrs_ring(self, client_msg):
+		# new clients only ever add long-term pseudonyms during a round
+		extra = msg_hash(client_msg, sha1)
+		return self.lrs_rings.get((len(self.ltp_list), extra), lambda: lrs.Ring(
+			# append the message hash to prevent duplicate voting
+			list(self.ltp_list.keys()) + [extra], version=config.LRS_VERSION,
+			tables=config.LRS_RING_TABLES, size=config.LRS_RING_SIZE))
 
 	def new_message(self, msg_args):
 		"""Handles posting a new message to the message board."""
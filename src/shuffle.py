@@ -2,7 +2,14 @@
 # See above for more details.
 
 import random
-from util import Constants, send, recv, randkey, powm, modinv, divide
+
+import config
+import multiexp
+from parallel import multi_exp, powers, powers_of
+from transcript import Interactive, Transcript
+from util import Constants, randkey, powm, modinv, batch_modinv, eprint
+from vecmath import mulmod
+from workers import PrecomputePool
 
 
 def generate_permutation(n):
@@ -17,41 +24,155 @@ def shuffle(elts, pi):
 	return [elts[pi[i]] for i in range(len(elts))]
 
 
-def _prove_simple(sock, gamma, r, s,
-		g=Constants.G, p=Constants.P, q=Constants.Q):
+class Commitments:
+	"""The random values and commitments of a proof of n elements.
+
+	None of them depend on the elements, so they can be computed ahead of time.
+	Each instance must be used for one proof only.
+	"""
+
+	def __init__(self, n, g=Constants.G, p=Constants.P, q=Constants.Q):
+		self.n = n
+		self.group = (g, p, q)
+
+		# step 1 of the shuffle proof
+		self.a = [randkey(0, q - 1) for _ in range(n)]
+		self.u = [randkey(0, q - 1) for _ in range(n)]
+		self.w = [randkey(0, q - 1) for _ in range(n)]
+		self.tau_0 = randkey(0, q - 1)
+		self.gamma = randkey(1, q - 1)
+		self.Gamma = powm(g, self.gamma, p)
+		self.A = powers_of(g, self.a, p, q)
+		self.U = powers_of(g, self.u, p, q)
+		self.W = powers_of(g, mulmod(self.w, self.gamma, q), p, q)
+
+		# step 2 of the simple shuffle proof
+		self.theta = [0] + [randkey(0, q - 1) for _ in range(2 * n - 1)]
+
+
+class CommitmentPool(PrecomputePool):
+	"""Commitments for upcoming proofs, keyed by their number of elements."""
+
+	def __init__(self, g=Constants.G, p=Constants.P, q=Constants.Q):
+		super().__init__(lambda n: Commitments(n, g, p, q))
+
+
+def _in_subgroup(values, p, q):
+	"""Returns whether all values are in the order q subgroup mod p.
+
+	Raising every value to q costs about as much as checking the equations one
+	by one, so for large p, products of random subsets of the values are raised
+	to q instead. A value outside the subgroup spoils each product with
+	probability at least 1/2, whatever its order, so after min(log2(q),
+	BATCH_BITS) products it is let through with about the same probability as a
+	false equation in _batch_holds(). The products are looked up in tables of
+	every subset of BATCH_WINDOW values at a time.
+	"""
+	values = list(set(values))
+	rounds = min(q.bit_length() - 1, Constants.BATCH_BITS)
+	if p < multiexp.SMALL_MODULUS or len(values) <= rounds:
+		return all(x == 1 for x in powers(values, q, p))
+
+	tables = []
+	for i in range(0, len(values), Constants.BATCH_WINDOW):
+		table = [1]
+		for x in values[i:i + Constants.BATCH_WINDOW]:
+			table.extend([(y * x) % p for y in table])
+		tables.append(table)
+
+	for _ in range(rounds):
+		product = 1
+		for table in tables:
+			product = (product * table[randkey(0, len(table) - 1)]) % p
+		if powm(product, q, p) != 1:
+			return False
+	return True
+
+
+def _batch_holds(equations, p, q):
+	"""Checks all equations at once with the small exponent test.
+
+	Every equation is raised to a small random exponent and the results are
+	multiplied together, which takes two multi-exponentiations. The exponents
+	are below min(q, 2^BATCH_BITS), so a false equation is accepted with
+	probability at most 1/(min(q, 2^BATCH_BITS) - 1), about 2^-19 in the 24-bit
+	group. This only holds for elements of the order q subgroup (an element
+	times p - 1 would pass for every even exponent), so anything else fails the
+	batch and is left to the checks one by one.
+	"""
+	values = [lhs for lhs, bases, exps in equations]
+	values.extend(base for lhs, bases, exps in equations for base in bases)
+	if not _in_subgroup(values, p, q):
+		return False
+
+	r = [randkey(1, min(q, 2 ** Constants.BATCH_BITS) - 1) for _ in equations]
+	lhs = multi_exp([lhs for lhs, bases, exps in equations], r, p)
+
+	# merge the right hand sides, which share bases like g and Gamma
+	combined = {}
+	for r_i, (lhs_i, bases, exps) in zip(r, equations):
+		for base, exp in zip(bases, exps):
+			combined[base] = (combined.get(base, 0) + r_i * exp) % q
+	return lhs == multi_exp(list(combined.keys()), list(combined.values()), p)
+
+
+def verify_equations(equations, p=Constants.P, q=Constants.Q):
+	"""Checks equations of the form lhs == prod(bases[j]^exps[j]) mod p.
+
+	equations: List of (lhs, bases, exps)
+
+	If config.SHUFFLE_BATCH_VERIFY is set, the equations are first checked all at
+	once, and only checked one by one if that fails.
+
+	Returns the index of the first false equation, or None if all of them hold.
+	"""
+	if config.SHUFFLE_BATCH_VERIFY and _batch_holds(equations, p, q):
+		return None
+
+	for i, (lhs, bases, exps) in enumerate(equations):
+		if lhs != multi_exp(bases, exps, p):
+			return i
+	return None
+
+
+def _prove_simple(chan, gamma, r, s,
+		g=Constants.G, p=Constants.P, q=Constants.Q, theta=None):
 	assert(len(r) == len(s))
 	n = len(r)
+	if theta is None:
+		theta = [0] + [randkey(0, q - 1) for _ in range(2 * n - 1)]
 
 	# step 1
-	t = recv(sock)
+	t = chan.challenge()
 
 	# step 2
 	r_hat = [(r[i] - t) % q for i in range(n)]
 	s_hat = [(s[i] - gamma * t) % q for i in range(n)]
-	theta = [0] + [randkey(0, q - 1) for _ in range(2 * n - 1)]
-	Theta = []
+	exps = []
 	for i in range(2 * n):
 		if i < n:
 			exp = (theta[i] * r_hat[i]) % q
 			exp -= (theta[i + 1] * s_hat[i]) % q
 			exp %= q
-			Theta.append(powm(g, exp, p))
+			exps.append(exp)
 		else:
 			exp = (theta[i] * gamma) % q
 			exp -= theta[(i + 1) % (2 * n)]
 			exp %= q
-			Theta.append(powm(g, exp, p))
-	send(sock, Theta)
+			exps.append(exp)
+	Theta = powers_of(g, exps, p, q)
+	chan.send(Theta)
 
 	# step 3
-	c = recv(sock)
+	c = chan.challenge()
 
 	# step 4
+	s_hat_inv = batch_modinv(s_hat, q)
 	alpha = [c]
 	tmp = c
 	for i in range(2 * n - 1):
 		if i < n:
-			tmp = (tmp * divide(r_hat[i], s_hat[i], q)) % q
+			tmp = (tmp * r_hat[i] * s_hat_inv[i]) % q
 			alpha.append((tmp + theta[i + 1]) % q)
 		elif i == n:
 			inv = modinv(gamma, q)
@@ -60,46 +181,59 @@ def _prove_simple(sock, gamma, r, s,
 		else:
 			tmp = (tmp * gamma) % q
 			alpha.append((tmp + theta[i + 1]) % q)
-	send(sock, alpha)
+	chan.send(alpha)
+
+
+def _lengths_match(vectors, n):
+	"""Returns whether the prover sent vectors of n elements each."""
+	if all(isinstance(v, list) and len(v) == n for v in vectors):
+		return True
+	eprint('SHUFFLE', 'Malformed shuffle proof.')
+	return False
 
 
-def _verify_simple(sock, Gamma, R, S,
+def _verify_simple(chan, Gamma, R, S,
 		g=Constants.G, p=Constants.P, q=Constants.Q):
 	assert(len(R) == len(S))
 	n = len(R)
 
 	# step 1
-	t = randkey(0, q - 1)
-	send(sock, t)
+	t = chan.challenge()
 
 	# step 2
-	Theta = recv(sock)
+	Theta = chan.recv()
 
 	# step 3
-	c = randkey(0, q - 1)
-	send(sock, c)
+	c = chan.challenge()
 
 	# step 4
-	alpha = recv(sock)
+	alpha = chan.recv()
+	if not _lengths_match([Theta, alpha], 2 * n):
+		return False
+	if alpha[0] != c:
+		return False
 
 	# step 5
 	U = powm(g, -t % q, p)
 	W = powm(Gamma, -t % q, p)
-	R_hat = [(R[i] * U) % p for i in range(n)]
-	S_hat = [(S[i] * W) % p for i in range(n)]
+	R_hat = mulmod(R, U, p)
+	S_hat = mulmod(S, W, p)
 
-	ret = True
+	equations = []
 	for i in range(2 * n):
 		if i < n:
-			ver = powm(R_hat[i], alpha[i], p) * powm(S_hat[i], -alpha[i + 1] % q, p)
-			ver %= p
-			ret = ret and (Theta[i] == ver)
+			equations.append((Theta[i],
+				[R_hat[i], S_hat[i]], [alpha[i], -alpha[i + 1] % q]))
 		else:
-			ver = powm(Gamma, alpha[i], p) * powm(g, -alpha[(i + 1) % (2 * n)] % q, p)
-			ver %= p
-			ret = ret and (Theta[i] == ver)
+			equations.append((Theta[i],
+				[Gamma, g], [alpha[i], -alpha[(i + 1) % (2 * n)] % q]))
 
-	return ret
+	bad = verify_equations(equations, p, q)
+	if bad is not None:
+		eprint('SHUFFLE', 'Simple shuffle check {} failed.'.format(bad))
+		return False
+
+	return True
 
 
 """
@@ -139,8 +273,13 @@ def prove_general(sock, nym_pre, nym_post, gamma, u, v,
 """
 
 
+def _statement(elts_pre, elts_post, g_, h_, g, p, q):
+	"""What a non-interactive shuffle proof is about."""
+	return [elts_pre, elts_post, g_, h_, g, p, q]
+
+
 def prove(sock, elts_pre, elts_post, pi, beta, g_, h_,
-		g=Constants.G, p=Constants.P, q=Constants.Q):
+		g=Constants.G, p=Constants.P, q=Constants.Q, pre=None):
 	"""Generate a zero-knowledge proof for the verifiable shuffle.
 
 	sock: Socket to send messages through
@@ -148,7 +287,24 @@ def prove(sock, elts_pre, elts_post, pi, beta, g_, h_,
 	elts_post: Elements after cryptographic operation
 	pi: Permutation list
 	beta, g_, h_: Verifiable shuffle parameters
+	pre: Precomputed Commitments, computed here if None or of the wrong size
+	"""
+	chan = Interactive(sock, True, q)
+	_prove(chan, elts_pre, elts_post, pi, beta, g_, h_, g, p, q, pre)
+
+
+def prove_nizk(elts_pre, elts_post, pi, beta, g_, h_,
+		g=Constants.G, p=Constants.P, q=Constants.Q, pre=None):
+	"""Like prove(), but non-interactive (Fiat-Shamir).
+
+	Returns the proof, to be checked with verify_nizk().
 	"""
+	chan = Transcript(_statement(elts_pre, elts_post, g_, h_, g, p, q), q=q)
+	_prove(chan, elts_pre, elts_post, pi, beta, g_, h_, g, p, q, pre)
+	return chan.proof
+
+
+def _prove(chan, elts_pre, elts_post, pi, beta, g_, h_, g, p, q, pre=None):
 	nym_pre = elts_pre[0]
 	nym_post = elts_post[0]
 	XY_pre = elts_pre[1]
@@ -163,46 +319,40 @@ def prove(sock, elts_pre, elts_post, pi, beta, g_, h_,
 		pi_inv[pi[i]] = i
 
 	# step 1
-	a = [randkey(0, q - 1) for _ in range(n)]
-	u = [randkey(0, q - 1) for _ in range(n)]
-	w = [randkey(0, q - 1) for _ in range(n)]
-	tau_0 = randkey(0, q - 1)
-	gamma = randkey(1, q - 1)
-
-	Gamma = powm(g, gamma, p)
-	A = [powm(g, a[i], p) for i in range(n)]
-	C = [powm(A[pi[i]], gamma, p) for i in range(n)]
-	U = [powm(g, u[i], p) for i in range(n)]
-	W = [powm(g, gamma * w[i], p) for i in range(n)]
+	if pre is None or pre.n != n or pre.group != (g, p, q):
+		pre = Commitments(n, g, p, q)
+	a, u, w, tau_0, gamma = pre.a, pre.u, pre.w, pre.tau_0, pre.gamma
+	Gamma, A, U, W = pre.Gamma, pre.A, pre.U, pre.W
+	C = powers([A[pi[i]] for i in range(n)], gamma, p)
 	Lambda_1 = powm(g_, tau_0 + sum([(w[i] * beta) % q for i in range(n)]), p)
 	Lambda_2 = powm(h_, tau_0 + sum([(w[i] * beta) % q for i in range(n)]), p)
-	for i in range(n):
-		X_i, Y_i = XY_pre[i]
-		Lambda_1 = (Lambda_1 * powm(X_i, (w[pi_inv[i]] - u[i]) % q, p)) % p
-		Lambda_2 = (Lambda_2 * powm(Y_i, (w[pi_inv[i]] - u[i]) % q, p)) % p
-	send(sock, [A, C, U, W, Gamma, Lambda_1, Lambda_2])
+	X, Y = [X_i for X_i, Y_i in XY_pre], [Y_i for X_i, Y_i in XY_pre]
+	exps = [(w[pi_inv[i]] - u[i]) % q for i in range(n)]
+	Lambda_1 = (Lambda_1 * multi_exp(X, exps, p)) % p
+	Lambda_2 = (Lambda_2 * multi_exp(Y, exps, p)) % p
+	chan.send([A, C, U, W, Gamma, Lambda_1, Lambda_2])
 
 	# step 2
-	rho = recv(sock)
+	rho = chan.challenge(n)
 
 	# step 3
 	b = [(rho[i] - u[i]) % q for i in range(n)]
-	d = [(gamma * b[pi[i]]) % q for i in range(n)]
-	D = [powm(g, d[i], p) for i in range(n)]
-	send(sock, D)
+	d = mulmod([b[pi[i]] for i in range(n)], gamma, q)
+	D = powers_of(g, d, p, q)
+	chan.send(D)
 
 	# step 4
-	lam = recv(sock)
+	lam = chan.challenge()
 
 	# step 5
 	r = [(a[i] + lam * b[i]) % q for i in range(n)]
-	s = [(gamma * r[pi[i]]) % q for i in range(n)]
+	s = mulmod([r[pi[i]] for i in range(n)], gamma, q)
 	sigma = [(w[i] + b[pi[i]]) % q for i in range(n)]
 	tau = (-tau_0 + sum([(b[i] * beta) % q for i in range(n)])) % q
-	send(sock, [tau, sigma])
+	chan.send([tau, sigma])
 
 	# step 6
-	_prove_simple(sock, gamma, r, s, g, p, q)
+	_prove_simple(chan, gamma, r, s, g, p, q, pre.theta)
 
 	# nym proof
 	# prove_general(sock, nym_pre, nym_post, gamma, r, s, g, p, q)
@@ -217,6 +367,25 @@ def verify(sock, elts_pre, elts_post, g_, h_,
 	elts_post: Elements after cryptographic operation
 	g_, h_: Verifiable shuffle parameters
 	"""
+	chan = Interactive(sock, False, q)
+	return _verify(chan, elts_pre, elts_post, g_, h_, g, p, q)
+
+
+def verify_nizk(proof, elts_pre, elts_post, g_, h_,
+		g=Constants.G, p=Constants.P, q=Constants.Q):
+	"""Verify a proof returned by prove_nizk().
+
+	Returns False if the proof is malformed.
+	"""
+	chan = Transcript(_statement(elts_pre, elts_post, g_, h_, g, p, q), proof, q)
+	try:
+		return _verify(chan, elts_pre, elts_post, g_, h_, g, p, q) and chan.finished()
+	except (AssertionError, ValueError, TypeError, IndexError):
+		eprint('SHUFFLE', 'Malformed shuffle proof.')
+		return False
+
+
+def _verify(chan, elts_pre, elts_post, g_, h_, g, p, q):
 	nym_pre = elts_pre[0]
 	nym_post = elts_post[0]
 	XY_pre = elts_pre[1]
@@ -228,39 +397,45 @@ def verify(sock, elts_pre, elts_post, g_, h_,
 	n = len(nym_pre)
 
 	# step 1
-	A, C, U, W, Gamma, Lambda_1, Lambda_2 = recv(sock)
+	A, C, U, W, Gamma, Lambda_1, Lambda_2 = chan.recv()
+	if not _lengths_match([A, C, U, W], n):
+		return False
 
 	# step 2
-	rho = [randkey(0, q - 1) for _ in range(n)]
-	B = [divide(powm(g, rho[i], p), U[i], p) for i in range(n)]
-	send(sock, rho)
+	rho = chan.challenge(n)
+	U_inv = batch_modinv(U, p)
+	B = mulmod(powers_of(g, rho, p, q), U_inv, p)
 
 	# step 3
-	D = recv(sock)
+	D = chan.recv()
+	if not _lengths_match([D], n):
+		return False
 
 	# step 4
-	lam = randkey(0, q - 1)
-	send(sock, lam)
+	lam = chan.challenge()
 
 	# step 5
-	tau, sigma = recv(sock)
+	tau, sigma = chan.recv()
+	if not _lengths_match([sigma], n):
+		return False
 
 	# step 6
-	R = [(A[i] * powm(B[i], lam, p)) % p for i in range(n)]
-	S = [(C[i] * powm(D[i], lam, p)) % p for i in range(n)]
-	ret = _verify_simple(sock, Gamma, R, S, g, p, q)
+	R = mulmod(A, powers(B, lam, p), p)
+	S = mulmod(C, powers(D, lam, p), p)
+	ret = _verify_simple(chan, Gamma, R, S, g, p, q)
 
 	# step 7
-	Phi_1 = 1
-	Phi_2 = 1
-	for i in range(n):
-		X_i, Y_i = XY_pre[i]
-		X_ibar, Y_ibar = XY_post[i]
-		Phi_1 = (Phi_1 * powm(X_ibar, sigma[i], p) * powm(X_i, -rho[i] % q, p)) % p
-		Phi_2 = (Phi_2 * powm(Y_ibar, sigma[i], p) * powm(Y_i, -rho[i] % q, p)) % p
-
-	for i in range(n):
-		ret = ret and (powm(Gamma, sigma[i], p) == (W[i] * D[i]) % p)
+	X, Y = [X_i for X_i, Y_i in XY_pre], [Y_i for X_i, Y_i in XY_pre]
+	X_bar, Y_bar = [X_i for X_i, Y_i in XY_post], [Y_i for X_i, Y_i in XY_post]
+	exps = sigma + [-rho[i] % q for i in range(n)]
+	Phi_1 = multi_exp(X_bar + X, exps, p)
+	Phi_2 = multi_exp(Y_bar + Y, exps, p)
+
+	bad = verify_equations(
+		[((W[i] * D[i]) % p, [Gamma], [sigma[i]]) for i in range(n)], p, q)
+	if bad is not None:
+		eprint('SHUFFLE', 'Shuffle check {} failed.'.format(bad))
+		ret = False
 
 	ret = ret and (Phi_1 == (Lambda_1 * powm(g_, tau, p)) % p)
 	ret = ret and (Phi_2 == (Lambda_2 * powm(h_, tau, p)) % p)
@@ -0,0 +1,41 @@
+from random import randrange
+
+import arith
+from testing_helpers import BIG_P
+from util import Constants, modinv, divide, batch_modinv
+
+
+def test_backends():
+	backends = [arith.BUILTIN] + ([] if arith.gmpy2 is None else [arith.GMPY2])
+	for backend in backends:
+		_, powmod, invert = arith.select(backend)
+		for p in [Constants.P, BIG_P]:
+			for _ in range(20):
+				x, e = randrange(1, p), randrange(p)
+				assert(powmod(x, e, p) == pow(x, e, p))
+				assert(type(powmod(x, e, p)) is int)
+				assert((invert(x, p) * x) % p == 1)
+			assert(invert(0, p) is None)
+			assert(invert(p, p) is None)
+		# not invertible mod a composite
+		assert(invert(6, Constants.P - 1) is None)
+
+
+def test_util():
+	assert(modinv(0) is None)
+	assert(divide(6, 3) == 2)
+	assert(divide(1, 0) is None)
+	assert((modinv(-5) * -5) % Constants.P == 1)
+
+
+def test_batch_modinv():
+	for p in [Constants.Q, BIG_P]:
+		nums = [randrange(p) for _ in range(50)] + [0, p, 1, -3]
+		assert(batch_modinv(nums, p) == [modinv(num, p) for num in nums])
+	assert(batch_modinv([]) == [])
+	assert(batch_modinv([0, 0]) == [None, None])
+
+	# composite modulus with non-invertible entries
+	p = Constants.P - 1
+	nums = [5, 6, 7, 0, 11]
+	assert(batch_modinv(nums, p) == [modinv(num, p) for num in nums])
@@ -0,0 +1,99 @@
+import tempfile
+from random import randrange
+
+import audit
+import config
+import shuffle
+from testing_helpers import announcement
+from util import Constants, modinv
+
+
+def hop(elts_pre):
+	"""Returns one hop from elts_pre, as a server would file it."""
+	p, q = Constants.P, Constants.Q
+	eph_key = randrange(1, q)
+	secret_inv = modinv(pow(Constants.G, randrange(1, q), p))
+	elts_post = [[pow(nym, eph_key, p) for nym in elts_pre[0]],
+		[(sec, (rep * secret_inv) % p) for sec, rep in elts_pre[1]]]
+	pi = shuffle.generate_permutation(len(elts_pre[0]))
+	elts_post = [shuffle.shuffle(elts, pi) for elts in elts_post]
+	proof = shuffle.prove_nizk(elts_pre, elts_post, pi, 1, 1, secret_inv)
+	return [elts_pre, elts_post, 1, secret_inv, proof]
+
+
+def test_store():
+	store = audit.TranscriptStore(tempfile.mkdtemp())
+	assert(store.next_round() == 1)
+	assert(store.server_ids(1) == [])
+
+	elts = announcement(5)[0]
+	store.append(1, 3, elts, elts, 1, 1, [])
+	assert(store.next_round() == 2)
+	assert(store.server_ids(1) == [3])
+	assert(store.load(1, 3)[0] == [elts[0], [list(pair) for pair in elts[1]]])
+
+	# transcripts are never overwritten
+	try:
+		store.append(1, 3, elts, elts, 1, 1, [])
+		assert(False)
+	except FileExistsError:
+		pass
+
+	# rounds are claimed with a token that anyone sharing the store can read
+	assert(store.token(2) is None)
+	token = store.claim(2)
+	assert(audit.TranscriptStore(store.path).token(2) == token)
+	assert(audit.TranscriptStore(tempfile.mkdtemp()).token(2) is None)
+	assert(store.server_ids(2) == [] and store.next_round() == 3)
+
+
+def test_auditor():
+	path = tempfile.mkdtemp()
+	store = audit.TranscriptStore(path)
+	auditor = audit.Auditor(path, 1)
+
+	first = hop(announcement(10)[0])
+	second = hop(first[1])
+
+	round = auditor.start()
+	store.append(round, 0, *first)
+	auditor.submit(round, 0)
+	store.append(round, 1, *second)
+	assert(auditor.finish(2))
+	assert(not auditor.finish(3))
+
+	# hops that don't follow each other
+	round = auditor.start()
+	store.append(round, 0, *first)
+	store.append(round, 1, *hop(announcement(10)[0]))
+	assert(not auditor.finish(2))
+
+	# a shuffle that doesn't match its proof
+	round = auditor.start()
+	elts_pre, elts_post, g_, h_, proof = first
+	store.append(round, 0, elts_pre, elts_post, g_, h_ + 1, proof)
+	assert(not auditor.finish(1))
+
+
+def test_chained():
+	assert(audit.chained([(1, 2), (2, 3), (3, 4)]))
+	assert(audit.chained([(2, 3), (3, 4), (1, 2)]))
+	assert(not audit.chained([(1, 2), (3, 4)]))
+	assert(not audit.chained([(1, 2), (2, 1)]))
+	assert(not audit.chained([(1, 2), (1, 3)]))
+
+
+def test_check_config():
+	audit_, proof = config.SHUFFLE_AUDIT, config.SHUFFLE_PROOF
+	try:
+		config.SHUFFLE_AUDIT, config.SHUFFLE_PROOF = True, Constants.INTERACTIVE
+		try:
+			audit.check_config()
+			assert(False)
+		except ValueError:
+			pass
+
+		config.SHUFFLE_PROOF = Constants.NIZK
+		audit.check_config()
+	finally:
+		config.SHUFFLE_AUDIT, config.SHUFFLE_PROOF = audit_, proof
@@ -1,5 +1,10 @@
+import socket
+import tempfile
+
 from testing_helpers import *
-from util import Constants
+import codec
+import config
+from util import Constants, sendrecv
 
 
 def test_announcement_phase():
@@ -63,3 +68,173 @@ def test_message_and_feedback_phase():
 	assert(board_after_voting[1][1][Constants.FB] == [1, 0])
 
 	anonrep.end_round()
+
+
+def test_asyncio_runtime():
+	runtime = config.RUNTIME
+	config.RUNTIME = Constants.ASYNCIO
+	try:
+		test_message_and_feedback_phase()
+	finally:
+		config.RUNTIME = runtime
+
+
+def test_interactive_shuffle_proofs():
+	proof = config.SHUFFLE_PROOF
+	config.SHUFFLE_PROOF = Constants.INTERACTIVE
+	try:
+		test_announcement_phase()
+	finally:
+		config.SHUFFLE_PROOF = proof
+
+
+def test_without_speculation():
+	speculate = config.SHUFFLE_SPECULATE
+	config.SHUFFLE_SPECULATE = False
+	try:
+		test_announcement_phase()
+	finally:
+		config.SHUFFLE_SPECULATE = speculate
+
+
+def test_audited_announcements():
+	audit, path = config.SHUFFLE_AUDIT, config.AUDIT_DIR
+	config.SHUFFLE_AUDIT, config.AUDIT_DIR = True, tempfile.mkdtemp()
+	try:
+		test_announcement_phase()
+	finally:
+		config.SHUFFLE_AUDIT, config.AUDIT_DIR = audit, path
+
+
+def test_failed_audit_restarts_round():
+	audit, path = config.SHUFFLE_AUDIT, config.AUDIT_DIR
+	config.SHUFFLE_AUDIT, config.AUDIT_DIR = True, tempfile.mkdtemp()
+	try:
+		anonrep = LocalBaseAnonRep(2, [1, 1])
+		auditor = anonrep.co.auditor
+		finish, rounds = auditor.finish, []
+
+		def fail_once(expected):
+			rounds.append(auditor.round)
+			return finish(expected) and len(rounds) > 1
+
+		auditor.finish = fail_once
+		anonrep.start_message_phase()
+
+		# the announcement was done again, under a new round
+		assert(len(rounds) == 2 and rounds[0] != rounds[1])
+		s1, s2 = anonrep.servers
+		assert(s1.stp_list == s2.stp_list and len(s1.stp_list) == 2)
+	finally:
+		config.SHUFFLE_AUDIT, config.AUDIT_DIR = audit, path
+
+
+def reject_once(servers):
+	"""Makes the first shuffle verification of any of servers fail, and returns
+	the list of rejections."""
+	rejected = []
+	for server in servers:
+		def verify_shuffle(*args, verify=server.verify_shuffle):
+			if rejected:
+				return verify(*args)
+			time.sleep(0.1)
+			rejected.append(True)
+			return False
+		server.verify_shuffle = verify_shuffle
+	return rejected
+
+
+def test_speculative_hop_aborts():
+	anonrep = LocalBaseAnonRep(2, [1, 1])
+	s1, s2 = anonrep.servers
+	rejected = reject_once(anonrep.servers)
+	aborted = []
+	abort_round = anonrep.co.abort_round
+	anonrep.co.abort_round = lambda *args: (aborted.append(True), abort_round(*args))
+
+	# the second server computed its hop, but the round was called off and
+	# done again instead of being passed on
+	anonrep.start_message_phase()
+	assert(rejected == [True] and aborted == [True])
+	assert(s1.stp_list == s2.stp_list and len(s1.stp_list) == 2)
+
+
+def test_failed_reverse_hop_aborts():
+	anonrep = LocalBaseAnonRep(2, [1, 1])
+	s1, s2 = anonrep.servers
+	anonrep.start_message_phase()
+	old_ltp_list = dict(s1.ltp_list)
+
+	rejected = reject_once(anonrep.servers)
+	anonrep.start_feedback_phase()
+	anonrep.end_round()
+
+	# the round ended without new long-term pseudonyms, and the next one works
+	assert(rejected == [True])
+	assert(s1.ltp_list == old_ltp_list and s1.stp_list == {})
+	anonrep.start_message_phase()
+	assert(s1.stp_list == s2.stp_list and len(s1.stp_list) == 2)
+
+
+def test_failed_hop_waits_for_verification():
+	anonrep = LocalBaseAnonRep(2, [1, 1])
+	s1, s2 = anonrep.servers
+	verified = []
+
+	def verify(*args):
+		time.sleep(0.2)
+		verified.append(True)
+		return True
+
+	def send_shuffle(*args):
+		raise OSError('Next server is gone.')
+
+	s2.verify_shuffle, s2.send_shuffle, s2.secret = verify, send_shuffle, 5
+	ann_list = [[Constants.G, Constants.G ** 2], [(1, 2), (3, 4)]]
+
+	# the verification could still be reading the channel of the request
+	try:
+		s2.new_announcement(None,
+			[Constants.G, ann_list, ann_list, 1, 1, s1.server_id, []])
+		assert(False)
+	except OSError:
+		pass
+	assert(verified == [True])
+
+
+def test_pipelined_requests():
+	anonrep = LocalBaseAnonRep(1, [2])
+	s1, = anonrep.servers
+	c1, c2 = anonrep.clients
+
+	anonrep.start_message_phase()
+
+	# many outstanding requests on one connection get their own replies back
+	headers = [Constants.GET_GENERATOR, Constants.GET_STP_ARRAY] * 20
+	futures = [c1.request([header]) for header in headers]
+	for header, future in zip(headers, futures):
+		if header == Constants.GET_GENERATOR:
+			assert(future.result() == s1.generator)
+		else:
+			assert(future.result() == s1.stp_array)
+
+	anonrep.start_feedback_phase()
+	anonrep.end_round()
+
+
+def test_malformed_frames():
+	anonrep = LocalBaseAnonRep(1, [1])
+	s1, = anonrep.servers
+	payload = codec.dumps([Constants.GET_GENERATOR, 2 ** 100])[:-3]
+
+	for addr in [s1.addr, anonrep.co.addr]:
+		s = socket.create_connection(addr)
+		s.settimeout(5)
+		s.sendall(len(payload).to_bytes(Constants.INTEGER_SIZE, byteorder='big') + payload)
+
+		# the connection is closed rather than left without a reader
+		assert(s.recv(1) == b'')
+		s.close()
+
+	# while other connections are still served
+	assert(sendrecv(s1.addr, [Constants.GET_GENERATOR]) is None)
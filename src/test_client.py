@@ -0,0 +1,72 @@
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import server as server_module
+from client import Client, SigningPool
+from server import Server
+from util import Constants, Encoded, encode, decode, powm, randkey
+
+
+def test_signing_pool():
+	pool = SigningPool()
+	generator = powm(Constants.G, randkey(1))
+	pool.fill(generator, 1)
+	while pool.filling:
+		time.sleep(0.01)
+
+	k, r, k_inv = pool.take(generator)
+	assert(r == powm(generator, k) and (k * k_inv) % (Constants.P - 1) == 1)
+
+
+def test_pooled_signatures():
+	generator = powm(Constants.G, randkey(1))
+	pri_key = randkey()
+	user = SimpleNamespace(pri_key=pri_key, signing=SigningPool(), stp=(None, None))
+	for name in ['prepare', 'short_term_pseudonym', 'sign']:
+		setattr(user, name, getattr(Client, name).__get__(user))
+	server = SimpleNamespace(generator=generator)
+
+	stp = user.short_term_pseudonym(generator)
+	assert(stp == powm(generator, pri_key))
+	for msg in ['hello', 'world', 'again']:
+		sig = user.sign(msg, generator)
+		assert(Server.verify_signature(server, msg, stp, sig))
+		while user.signing.filling:
+			time.sleep(0.01)
+	assert(not Server.verify_signature(server, 'other', stp, sig))
+
+
+def test_round_state(monkeypatch):
+	server = SimpleNamespace(generator=Constants.G, stp_array=[1, 2, 3],
+		round_state=Encoded([randkey(), None, []]))
+	for name in ['round_ring', 'update_round_state', 'get_round_state']:
+		setattr(server, name, getattr(Server, name).__get__(server))
+
+	# replies go through the codec like they would on a socket
+	sent = []
+	monkeypatch.setattr(server_module, 'send',
+		lambda s, args: sent.append(decode(encode(args))[0]))
+
+	def request(args):
+		server.get_round_state(None, args[1:])
+		future = Future()
+		future.set_result(sent[-1])
+		return future
+
+	user = SimpleNamespace(name='CLIENT', request=request, round=(-1, None, None))
+	for name in ['reply', 'request_round_state', 'round_state']:
+		setattr(user, name, getattr(Client, name).__get__(user))
+
+	server.update_round_state()
+	assert(user.round_state() == (Constants.G, [1, 2, 3]))
+	version = user.round[0]
+
+	# the ring is only sent again once it has changed
+	assert(user.round_state() == (Constants.G, [1, 2, 3]))
+	assert(sent[-1] == [version, Constants.G, None])
+
+	server.generator, server.stp_array = 2203 ** 2, [4, 5]
+	server.update_round_state()
+	assert(user.round_state() == (2203 ** 2, [4, 5]))
+	assert(user.round[0] == version + 1)
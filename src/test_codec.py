@@ -0,0 +1,86 @@
+import socket
+import struct
+from threading import Thread
+
+import codec
+from util import Constants, Channel, Encoded, encode, decode, multiplexer, recvrequest
+
+
+def test_roundtrip():
+	msg = [Constants.NEW_ANNOUNCEMENT, 2203,
+		[[1, 2, 3], [(4, 5), (6, 7), (8, 9)]], [], -5, 2 ** 2048 + 1, None, True,
+		{Constants.MSG: 'hello', Constants.FB: [1, -1]}, 'café']
+
+	payload = codec.dumps(msg)
+	assert(codec.is_binary(payload))
+
+	# tuples come back as lists, just like with JSON
+	assert(codec.loads(payload) == decode(encode(msg, Constants.JSON))[0])
+
+
+def test_fixed_width_vectors():
+	for bits in [1, 8, 24, 64, 65, 2048]:
+		nums = [2 ** bits - 1, 0, 2 ** (bits - 1)]
+		assert(codec.loads(codec.dumps(nums)) == nums)
+		assert(codec.loads(codec.dumps([nums, nums])) == [nums, nums])
+
+
+def test_oversized_counts():
+	frames = [
+		codec.VECTOR + struct.pack('>I', 10 ** 7) + struct.pack('>I', 3),
+		codec.VECTOR + struct.pack('>I', 4) + struct.pack('>I', 8) + bytes(31),
+		codec.MATRIX + struct.pack('>III', 10 ** 5, 10 ** 5, 1) + bytes(16),
+		codec.VECTOR + struct.pack('>I', 10 ** 7) + struct.pack('>I', 0),
+	]
+	for frame in frames:
+		try:
+			codec.loads(codec.MAGIC + frame)
+			assert(False)
+		except ValueError:
+			pass
+
+
+def test_json_fallback():
+	# JSON turns int dict keys into strings, binary does not, so use JSON
+	args, codec_name = decode(encode({1: 2}, Constants.BINARY))
+	assert(codec_name == Constants.JSON)
+	assert(args == {'1': 2})
+
+	args, codec_name = decode(encode([1, 2, 3], Constants.BINARY))
+	assert(codec_name == Constants.BINARY)
+	assert(args == [1, 2, 3])
+
+
+def test_encoded():
+	args = Encoded([1, [2, 3], None])
+	for codec_name in [Constants.JSON, Constants.BINARY]:
+		payload = encode(args, codec_name)
+		assert(encode(args, codec_name) is payload)
+		assert(decode(payload) == (args.args, codec_name))
+
+
+def test_multiplexer_bad_reply():
+	ss = socket.socket()
+	ss.bind(('localhost', 0))
+	ss.listen(1)
+
+	def answer():
+		s, addr = ss.accept()
+		chan = Channel(s, addr)
+		msg, reply = recvrequest(chan)
+		# a reply whose payload is cut short
+		chan.sendframe(Constants.MUX + reply.req_id.to_bytes(
+			Constants.INTEGER_SIZE, byteorder='big') + codec.dumps([2 ** 100])[:-3])
+
+	Thread(target=answer, daemon=True).start()
+	mux = multiplexer(ss.getsockname())
+	future = mux.request([Constants.GET_GENERATOR])
+	try:
+		future.result(timeout=5)
+		assert(False)
+	except Exception as err:
+		assert(not isinstance(err, TimeoutError))
+
+	# the broken connection is not handed out again
+	assert(mux.closed)
+	ss.close()
@@ -0,0 +1,25 @@
+import elgamal
+from util import Constants, powm, randkey
+
+
+def test_combined_mask():
+	server_pub_keys = [powm(Constants.G, randkey(1)) for _ in range(5)]
+	reps = [powm(Constants.G, randkey(1)) for _ in range(100)]
+	eph_key = randkey(1)
+
+	expected = []
+	for rep in reps:
+		for server_pub_key in server_pub_keys:
+			rep = (rep * powm(server_pub_key, eph_key)) % Constants.P
+		expected.append(rep)
+
+	engine = elgamal.Engine()
+	assert(engine.encrypt_all(reps, server_pub_keys, eph_key) == expected)
+	assert(engine.encrypt(reps[0], server_pub_keys, eph_key) == expected[0])
+	assert(engine.exponentiations == 1)
+
+	# a new key or hop needs a new mask
+	server_pub_keys.append(powm(Constants.G, randkey(1)))
+	engine.encrypt_all(reps, server_pub_keys, eph_key)
+	engine.encrypt_all(reps, server_pub_keys, randkey(1))
+	assert(engine.exponentiations == 3)
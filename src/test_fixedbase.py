@@ -0,0 +1,59 @@
+from random import randrange
+from threading import Thread
+
+import fixedbase
+from testing_helpers import BIG_G, BIG_P, BIG_Q
+from util import Constants, powm
+
+
+def test_windowed():
+	for g, p, q in [(Constants.G, Constants.P, Constants.Q), (BIG_G, BIG_P, BIG_Q)]:
+		table = fixedbase.FixedBase(g, p, q)
+		for exp in [0, 1, q - 1, q, -1, q * q + 5] + [randrange(p) for _ in range(50)]:
+			assert(table.pow(exp) == pow(g, exp % q, p))
+
+
+def test_full_table():
+	# small group (see the commented out values in Constants)
+	g, p, q = 190, 66071, 6607
+	table = fixedbase.FixedBase(g, p, q)
+	for exp in range(3 * q):
+		assert(table.pow(exp) == pow(g, exp, p))
+	assert(table.full is not None)
+
+
+def test_threads():
+	g, p, q = 190, 66071, 6607
+	table = fixedbase.FixedBase(g, p, q)
+	wrong = []
+
+	def use():
+		for exp in range(q // 2):
+			if table.pow(exp) != pow(g, exp, p):
+				wrong.append(exp)
+
+	threads = [Thread(target=use) for _ in range(4)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	# uses are counted from every thread, so the full table is built in time
+	assert(wrong == [] and table.full is not None)
+
+
+def test_register():
+	assert(fixedbase.lookup(Constants.G, Constants.P) is not None)
+	assert(powm(Constants.G, 12345) == pow(Constants.G, 12345, Constants.P))
+
+	# bases outside the subgroup are not registered
+	assert(not fixedbase.register(Constants.P - 1, Constants.P, Constants.Q))
+	assert(fixedbase.lookup(Constants.P - 1, Constants.P) is None)
+
+	# unpinned bases are evicted once newer ones are registered
+	bases = [powm(Constants.G, k) for k in range(2, fixedbase.MAX_BASES + 3)]
+	for base in bases:
+		assert(fixedbase.register(base, Constants.P, Constants.Q))
+	assert(fixedbase.lookup(bases[0], Constants.P) is None)
+	assert(fixedbase.lookup(bases[-1], Constants.P) is not None)
+	assert(fixedbase.lookup(Constants.G, Constants.P) is not None)
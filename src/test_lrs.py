@@ -0,0 +1,192 @@
+import threading
+from concurrent.futures import Future
+from functools import partial
+from types import SimpleNamespace
+
+import config
+import feedback
+import lrs
+import server as server_module
+import workers
+from server import Server
+from util import Constants, msg_hash, randkey
+from hashlib import sha1
+
+
+def ring(n, g=Constants.G, p=Constants.P, q=Constants.Q):
+	keys = [randkey(1, q - 1) for _ in range(n)]
+	return keys, [pow(g, x, p) for x in keys]
+
+
+def test_versions():
+	keys, L = ring(10)
+	for version in [lrs.LEGACY, lrs.DIGEST]:
+		sig = lrs.sign('msg', keys[3], 3, L, version=version)
+		assert(lrs.signature_version(sig) == version)
+		assert(lrs.verify('msg', L, *sig))
+		assert(not lrs.verify('other', L, *sig))
+		assert(not lrs.verify('msg', L[:-1] + [L[-1] + 1], *sig))
+
+	# legacy signatures have no version
+	assert(lrs.verify('msg', L, *lrs.sign('msg', keys[0], 0, L, version=lrs.LEGACY)[:3]))
+
+	# the tag of a signer depends on the version
+	tags = {lrs.sign('msg', keys[0], 0, L, version=v)[2] for v in [lrs.LEGACY, lrs.DIGEST]}
+	assert(len(tags) == 2)
+
+
+def test_ring_digest():
+	keys, L = ring(10)
+	base = lrs.RingDigest(L[:-1])
+	assert(base.extend(L[-1:]).digest() == lrs.RingDigest(L).digest())
+	assert(base.digest() == lrs.RingDigest(L[:-1]).digest())
+
+	sig = lrs.sign('msg', keys[2], 2, L, ring=base.extend(L[-1:]))
+	assert(lrs.verify('msg', L, *sig, ring=lrs.RingDigest(L)))
+
+
+def server(L):
+	"""Returns the state Server.verify_lrs_signature() needs, for ring L."""
+	state = SimpleNamespace(stp_array=L, ring=lrs.RingDigest(L), generator=Constants.G,
+		lrs_rings=lrs.RingCache(config.LRS_RING_CACHE),
+		feedback=feedback.FeedbackVerifier(0, config.FEEDBACK_BATCH, 0))
+	for name in ['lrs_ring', 'verify_lrs_signature', 'start_verify_lrs_signature']:
+		setattr(state, name, partial(getattr(Server, name), state))
+	return state
+
+
+def test_prepared_ring():
+	keys, L = ring(10)
+	for version in [lrs.LEGACY, lrs.DIGEST]:
+		sig = lrs.sign('msg', keys[4], 4, L, version=version)
+		for tables in [False, True]:
+			pre = lrs.Ring(L, version=version, tables=tables)
+			assert(lrs.verify('msg', L, *sig, pre=pre))
+			assert(not lrs.verify('other', L, *sig, pre=pre))
+
+	# a ring of another version is not used
+	sig = lrs.sign('msg', keys[4], 4, L, version=lrs.DIGEST)
+	assert(lrs.verify('msg', L, *sig, pre=lrs.Ring(L, version=lrs.LEGACY)))
+
+
+def test_ring_cache():
+	cache = lrs.RingCache(2)
+	built = []
+	build = lambda key: lambda: built.append(key) or key
+	assert([cache.get(key, build(key)) for key in [1, 1, 2, 1, 3, 2]] == [1, 1, 2, 1, 3, 2])
+	assert(built == [1, 2, 3, 2]) # 2 was evicted by 3
+	assert(cache.stats() == {'hits': 2, 'misses': 4, 'size': 2})
+
+	cache.clear()
+	assert(cache.get(3, build(3)) == 3)
+	assert(built[-1] == 3)
+
+	# rings built while the round changes are not kept
+	assert(cache.get(4, lambda: cache.clear() or 4) == 4)
+	assert(cache.stats()['size'] == 0)
+
+
+def test_server_ring_cache():
+	keys, L = ring(5)
+	state = server(L)
+	stp_array = L + [msg_hash('msg', sha1)]
+	for idx in range(3):
+		sig = lrs.sign('msg', keys[idx], idx, stp_array, version=config.LRS_VERSION)
+		assert(state.verify_lrs_signature('msg', sig))
+	assert(not state.verify_lrs_signature('other', sig))
+	stats = state.lrs_rings.stats()
+	assert((stats['hits'], stats['misses']) == (2, 2))
+
+
+def test_server_version():
+	keys, L = ring(5)
+	state = server(L)
+	verify = state.verify_lrs_signature
+	stp_array = L + [msg_hash('msg', sha1)]
+
+	version = config.LRS_VERSION
+	try:
+		for config.LRS_VERSION in [lrs.LEGACY, lrs.DIGEST]:
+			for v in [lrs.LEGACY, lrs.DIGEST]:
+				sig = lrs.sign('msg', keys[1], 1, stp_array, version=v)
+				assert(verify('msg', sig) == (v == config.LRS_VERSION))
+			assert(not verify('msg', [1, 2]))
+			assert(not verify('msg', 7))
+	finally:
+		config.LRS_VERSION = version
+
+
+def test_feedback_batches():
+	keys, L = ring(20)
+	stp_array = L + [msg_hash('msg', sha1)]
+	sigs = [lrs.sign('msg', keys[idx], idx, stp_array) for idx in range(6)]
+	sigs[3] = (sigs[3][0] + 1,) + sigs[3][1:]
+	sigs.append([1, 2])
+
+	for max_workers in [0, 1]:
+		state = server(L)
+		state.feedback = feedback.FeedbackVerifier(max_workers, 4, 0.05)
+		futures = [state.start_verify_lrs_signature('msg', sig) for sig in sigs]
+		assert([future.result() for future in futures] == [True] * 3 + [False] + [True] * 2 + [False])
+
+
+def test_feedback_replies(monkeypatch):
+	keys, L = ring(5)
+	state = server(L)
+	state.name = 'SERVER'
+	state.lrs_duplicates, state.lrs_lock = set(), threading.Lock()
+	state.workers = workers.WorkerPool(1, 10, [])
+
+	# replies are sent from the server's workers, not where verification ends
+	sent = []
+	monkeypatch.setattr(server_module, 'send',
+		lambda s, args: sent.append((threading.current_thread(), s, args)))
+
+	verified = Future()
+	state.start_verify_lrs_signature = lambda msg, sig: verified
+	answered = Server.new_feedback(state, 'client', [0, 'msg', 1, [1, 2, 3, 4]])
+	verified.cancel()
+	answered.result(timeout=5)
+	assert(sent[-1][1:] == ('client', [Constants.FAIL, 'LRS verification failed.']))
+	assert(sent[-1][0] is not threading.current_thread())
+	assert(state.lrs_duplicates == set())
+
+
+def test_buckets():
+	keys, L = ring(50)
+	digest = lrs.RingDigest(L).digest()
+	B = lrs.buckets(L, 8, digest)
+	assert(len(B) == 6 and all(8 <= len(b) < 16 for b in B))
+	assert(sorted(y for b in B for y in b) == sorted(L))
+	assert(B == lrs.buckets(L, 8, digest))
+	assert(B != lrs.buckets(L, 8, lrs.RingDigest(L[1:]).digest()))
+	assert(lrs.buckets(L, 30, digest) == [L])
+
+	full = lrs.sign('msg', keys[7], 7, L)
+	sig = lrs.sign('msg', keys[7], 7, L, size=8)
+	assert(len(sig[1]) == len(B[sig[4]]) and L[7] in B[sig[4]])
+	assert(lrs.verify('msg', L, *sig, size=8))
+	assert(lrs.verify('msg', L, *sig, size=8, pre=lrs.Ring(L, size=8)))
+	assert(not lrs.verify('msg', L, *sig))
+	assert(not lrs.verify('msg', L, *sig, size=9))
+	assert(not lrs.verify('msg', L, *(sig[:4] + ((sig[4] + 1) % 6,)), size=8))
+
+	# the tag does not depend on the bucket
+	assert(sig[2] == full[2])
+
+
+def test_server_buckets():
+	keys, L = ring(40)
+	stp_array = L + [msg_hash('msg', sha1)]
+	size = config.LRS_RING_SIZE
+	try:
+		config.LRS_RING_SIZE = 8
+		state = server(L)
+		for idx in range(3):
+			sig = lrs.sign('msg', keys[idx], idx, stp_array, size=8)
+			assert(len(sig) == 5 and state.verify_lrs_signature('msg', sig))
+		assert(state.verify_lrs_signature('msg', lrs.sign('msg', keys[5], 5, stp_array)))
+		assert(not state.verify_lrs_signature('msg',
+			lrs.sign('msg', keys[5], 5, stp_array, size=16)))
+	finally:
+		config.LRS_RING_SIZE = size
@@ -0,0 +1,45 @@
+from random import randrange
+
+import config
+import multiexp
+import parallel
+from testing_helpers import BIG_G, BIG_P, BIG_Q
+from util import Constants
+
+
+def test_algorithms_agree():
+	for g, p, q in [(Constants.G, Constants.P, Constants.Q), (BIG_G, BIG_P, BIG_Q)]:
+		for n in [1, 2, 5, 70]:
+			bases = [pow(g, randrange(q), p) for _ in range(n)]
+			exps = [randrange(q) for _ in range(n - 1)] + [0]
+			expected = multiexp.naive(bases, exps, p)
+			assert(multiexp.straus(bases, exps, p) == expected)
+			assert(multiexp.pippenger(bases, exps, p) == expected)
+			assert(multiexp.multi_exp(bases, exps, p) == expected)
+
+
+def test_registered_and_negative():
+	p = Constants.P
+	bases = [Constants.G, 5, 7]
+	exps = [123456789, -3, 2 ** 160 + 1]
+	expected = 1
+	for base, exp in zip(bases, exps):
+		expected = (expected * pow(base, exp, p)) % p
+	assert(multiexp.multi_exp(bases, exps, p) == expected)
+
+
+def test_parallel():
+	g, p, q = Constants.G, Constants.P, Constants.Q
+	n = 2 * parallel.MIN_CHUNK + 1
+	bases = [pow(g, randrange(q), p) for _ in range(n)]
+	exps = [randrange(q) for _ in range(n)]
+
+	workers = config.SHUFFLE_WORKERS
+	try:
+		config.SHUFFLE_WORKERS = 2
+		assert(parallel.powers_of(g, exps, p, q) == [pow(g, e, p) for e in exps])
+		assert(parallel.powers(bases, exps[0], p) == [pow(b, exps[0], p) for b in bases])
+		assert(parallel.multi_exp(bases, exps, p) == multiexp.naive(bases, exps, p))
+	finally:
+		config.SHUFFLE_WORKERS = workers
+		parallel.executor()
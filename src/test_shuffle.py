@@ -0,0 +1,112 @@
+import time
+from random import randrange
+
+import config
+import shuffle
+from testing_helpers import BIG_G, BIG_P, BIG_Q, announcement, shuffle_proof
+from transcript import Transcript
+from util import Constants
+
+
+def test_proof_both_modes():
+	batch = config.SHUFFLE_BATCH_VERIFY
+	try:
+		for config.SHUFFLE_BATCH_VERIFY in [True, False]:
+			assert(shuffle_proof(*announcement(20)))
+	finally:
+		config.SHUFFLE_BATCH_VERIFY = batch
+
+
+def test_verify_equations():
+	g, p, q = Constants.G, Constants.P, Constants.Q
+	equations = []
+	for _ in range(30):
+		bases = [pow(g, randrange(q), p) for _ in range(2)]
+		exps = [randrange(q) for _ in range(2)]
+		lhs = (pow(bases[0], exps[0], p) * pow(bases[1], exps[1], p)) % p
+		equations.append((lhs, bases, exps))
+	assert(shuffle.verify_equations(equations) is None)
+
+	lhs, bases, exps = equations[17]
+	equations[17] = ((lhs * g) % p, bases, exps)
+	assert(shuffle.verify_equations(equations) == 17)
+
+	# p - 1 has order 2, so it is not cancelled out by even batch exponents
+	equations[17] = ((lhs * (p - 1)) % p, bases, exps)
+	for _ in range(10):
+		assert(shuffle.verify_equations(equations) == 17)
+
+
+def test_in_subgroup():
+	# in the large group, with more values than products, products of random
+	# subsets of them are checked
+	for g, p, q in [(Constants.G, Constants.P, Constants.Q), (BIG_G, BIG_P, BIG_Q)]:
+		values = [pow(g, randrange(q), p) for _ in range(100)]
+		assert(shuffle._in_subgroup(values, p, q))
+		for bad in [p - 1, (values[0] * (p - 1)) % p, 0]:
+			for _ in range(5):
+				assert(not shuffle._in_subgroup(values + [bad], p, q))
+
+
+def test_nizk():
+	for g, p, q, n in [(Constants.G, Constants.P, Constants.Q, 20),
+			(BIG_G, BIG_P, BIG_Q, 3)]:
+		ann_list, new_ann_list, pi, beta, g_, h_ = announcement(n, g, p, q)
+		proof = shuffle.prove_nizk(ann_list, new_ann_list, pi, beta, g_, h_, g, p, q)
+		assert(shuffle.verify_nizk(proof, ann_list, new_ann_list, g_, h_, g, p, q))
+
+		# the proof is bound to the statement
+		assert(not shuffle.verify_nizk(proof, ann_list, new_ann_list, g_, h_ + 1, g, p, q))
+
+		# and to every message in it
+		tau, sigma = proof[2]
+		bad_proof = proof[:2] + [[(tau + 1) % q, sigma]] + proof[3:]
+		assert(not shuffle.verify_nizk(bad_proof, ann_list, new_ann_list, g_, h_, g, p, q))
+		assert(not shuffle.verify_nizk(proof[:-1], ann_list, new_ann_list, g_, h_, g, p, q))
+
+		# vectors of the wrong length are rejected, not checked on a prefix
+		for bad_sigma in [sigma[:-1], sigma + [0]]:
+			bad_proof = proof[:2] + [[tau, bad_sigma]] + proof[3:]
+			assert(not shuffle.verify_nizk(bad_proof, ann_list, new_ann_list, g_, h_, g, p, q))
+
+
+def test_precomputed():
+	ann_list, new_ann_list, pi, beta, g_, h_ = announcement(20)
+	pool = shuffle.CommitmentPool()
+	pool.fill(20, 1)
+	while pool.filling:
+		time.sleep(0.01)
+
+	pre = pool.take(20)
+	proof = shuffle.prove_nizk(ann_list, new_ann_list, pi, beta, g_, h_, pre=pre)
+	assert(proof[0][0] == pre.A)
+	assert(shuffle.verify_nizk(proof, ann_list, new_ann_list, g_, h_))
+
+	# commitments of the wrong size are not used
+	pre = shuffle.Commitments(19)
+	proof = shuffle.prove_nizk(ann_list, new_ann_list, pi, beta, g_, h_, pre=pre)
+	assert(proof[0][0] != pre.A)
+	assert(shuffle.verify_nizk(proof, ann_list, new_ann_list, g_, h_))
+
+
+def test_simple_proof_challenge():
+	g, p, q = Constants.G, Constants.P, Constants.Q
+	n = 4
+	Gamma = pow(g, randrange(1, q), p)
+	R = [pow(g, randrange(1, q), p) for _ in range(n)]
+	S = [pow(g, randrange(1, q), p) for _ in range(n)]
+
+	# pick alpha first and solve the equations for Theta, over unrelated R and S
+	t = Transcript('statement', q=q).challenge()
+	R_hat = [(x * pow(g, -t % q, p)) % p for x in R]
+	S_hat = [(x * pow(Gamma, -t % q, p)) % p for x in S]
+	alpha = [randrange(q) for _ in range(2 * n)]
+	Theta = []
+	for i in range(2 * n):
+		bases = [R_hat[i], S_hat[i]] if i < n else [Gamma, g]
+		Theta.append((pow(bases[0], alpha[i], p) *
+			pow(bases[1], -alpha[(i + 1) % (2 * n)] % q, p)) % p)
+
+	# alpha[0] is not the challenge, so the proof is rejected
+	chan = Transcript('statement', [Theta, alpha], q)
+	assert(not shuffle._verify_simple(chan, Gamma, R, S, g, p, q))
@@ -0,0 +1,92 @@
+import mmap
+import os
+import socket
+import time
+from threading import Thread
+
+from testing_helpers import channel_pair
+from util import Constants, Channel, recvrequest, send, sendrecv
+
+
+def frame(payload):
+	return len(payload).to_bytes(Constants.INTEGER_SIZE, byteorder='big') + payload
+
+
+def send_chunks(sock, data, size):
+	"""Sends data through sock a few bytes at a time, on another thread."""
+	def run():
+		for i in range(0, len(data), size):
+			sock.sendall(data[i:i + size])
+			time.sleep(0.0001)
+
+	thread = Thread(target=run, daemon=True)
+	thread.start()
+	return thread
+
+
+def test_chunked_frames():
+	a, b = channel_pair()
+	small, large = os.urandom(100), os.urandom(3 * Constants.BUFFER_SIZE)
+
+	# length prefixes and payloads split across many reads, and a frame that
+	# outgrows the channel's buffer
+	thread = send_chunks(a.sock, frame(small) + frame(large) + frame(small), 7)
+	assert(b.recvframe() == small)
+	assert(b.recvframe() == large)
+	assert(b.recvframe() == small)
+	thread.join()
+
+
+def test_spilled_frames():
+	a, b = channel_pair()
+	large, small = os.urandom(Constants.SPILL_SIZE + 1), os.urandom(100)
+	thread = send_chunks(a.sock, frame(large) + frame(small), 65536)
+
+	# a spilled payload is not overwritten by the next frame
+	view = b.recvframe()
+	assert(isinstance(view.obj, mmap.mmap))
+	assert(b.recvframe() == small)
+	assert(view == large)
+	thread.join()
+
+
+def echo_server():
+	"""Starts a server that answers every request with the request itself.
+
+	Returns its address and the list of channels it has accepted.
+	"""
+	ss = socket.socket()
+	ss.bind(('localhost', 0))
+	ss.listen(5)
+	accepted = []
+
+	def serve(chan):
+		while True:
+			try:
+				msg, reply = recvrequest(chan)
+			except (EOFError, OSError):
+				break
+			send(reply, msg)
+		chan.close()
+
+	def run():
+		while True:
+			s, addr = ss.accept()
+			accepted.append(Channel(s, addr))
+			Thread(target=serve, args=(accepted[-1],), daemon=True).start()
+
+	Thread(target=run, daemon=True).start()
+	return ss.getsockname(), accepted
+
+
+def test_pooled_channels():
+	addr, accepted = echo_server()
+	assert(sendrecv(addr, [1, 2]) == [1, 2])
+	assert(sendrecv(addr, ['hello']) == ['hello'])
+	assert(len(accepted) == 1)
+
+	# a pooled channel whose peer has closed it is dialled again
+	accepted[0].sock.shutdown(socket.SHUT_RDWR)
+	time.sleep(0.05)
+	assert(sendrecv(addr, [3]) == [3])
+	assert(len(accepted) == 2)
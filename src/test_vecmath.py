@@ -0,0 +1,51 @@
+from random import randrange
+
+import vecmath
+from testing_helpers import BIG_P
+from util import Constants
+
+
+def check(p, n):
+	a = [randrange(p) for _ in range(n)]
+	b = [randrange(p) for _ in range(n)]
+	exps = [randrange(Constants.Q) for _ in range(n)] + [0]
+	k = randrange(p)
+
+	assert(vecmath.mulmod(a, b, p) == [(x * y) % p for x, y in zip(a, b)])
+	assert(vecmath.mulmod(a, k, p) == [(x * k) % p for x in a])
+	assert(vecmath.powmod(a, k, p) == [pow(x, k, p) for x in a])
+	assert(vecmath.powmod(a, -1, p) == [pow(x, -1, p) for x in a])
+	assert(vecmath.powmod(a + [1], exps, p) == [pow(x, e, p) for x, e in zip(a + [1], exps)])
+	assert(vecmath.powmod(k, exps, p) == [pow(k, e, p) for e in exps])
+
+
+def test_vecmath():
+	for n in [0, 5, 3 * vecmath.NUMPY_MIN]:
+		check(Constants.P, n)
+		check(BIG_P, n)
+
+	# unreduced and negative residues
+	p = Constants.P
+	a = [p + 3, -5, 2 ** 70] * vecmath.NUMPY_MIN
+	assert(vecmath.mulmod(a, a, p) == [(x * x) % p for x in a])
+	assert(vecmath.powmod(a, 3, p) == [pow(x, 3, p) for x in a])
+
+
+def test_fallback():
+	numpy = vecmath.numpy
+	vecmath.numpy = None
+	try:
+		check(Constants.P, 3 * vecmath.NUMPY_MIN)
+	finally:
+		vecmath.numpy = numpy
+
+
+def test_lengths():
+	p = Constants.P
+	for n in [5, 3 * vecmath.NUMPY_MIN]:
+		for func in [vecmath.mulmod, vecmath.powmod]:
+			try:
+				func([2] * n, [3] * (n - 1), p)
+				assert(False)
+			except ValueError:
+				pass
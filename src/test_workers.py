@@ -0,0 +1,94 @@
+import queue
+import time
+from threading import Event
+
+import workers
+from testing_helpers import channel_pair, create_coordinator, create_server
+from util import Constants, recv
+
+
+def blocked_pool(limit):
+	"""Returns a pool of one worker, busy until the returned event is set."""
+	pool = workers.WorkerPool(1, limit, ['RING'])
+	release = Event()
+	pool.submit('RING', release.wait)
+	while pool.depth('RING') > 0:
+		time.sleep(0.01)
+	return pool, release
+
+
+def test_priority_headers_first():
+	pool, release = blocked_pool(10)
+	order = []
+	futures = [pool.submit('CLIENT', order.append, i) for i in range(3)]
+	futures.append(pool.submit('RING', order.append, 'ring'))
+
+	release.set()
+	for future in futures:
+		future.result(timeout=5)
+	assert(order == ['ring', 0, 1, 2])
+
+
+def test_limit():
+	pool, release = blocked_pool(2)
+	futures = [pool.submit('CLIENT', time.sleep, 0.01) for _ in range(2)]
+	try:
+		pool.submit('CLIENT', time.sleep, 0)
+		assert(False)
+	except queue.Full:
+		pass
+	assert(pool.depth('CLIENT') == 2)
+
+	# priority headers are never rejected
+	futures.extend(pool.submit('RING', time.sleep, 0) for _ in range(5))
+	assert(pool.depth('RING') == 5)
+
+	release.set()
+	for future in futures:
+		future.result(timeout=5)
+
+	stats = pool.stats()
+	assert(stats['CLIENT']['submitted'] == 2 and stats['CLIENT']['rejected'] == 1)
+	assert(stats['RING']['submitted'] == 6 and stats['RING']['rejected'] == 0)
+	for header in ['CLIENT', 'RING']:
+		assert(0 < stats[header]['wait_max'] <= stats[header]['wait_total'])
+
+
+def test_precompute_pool():
+	made = []
+
+	def make(key):
+		made.append(key)
+		return key
+
+	pool = workers.PrecomputePool(make)
+	pool.fill('a', 3)
+	while pool.filling:
+		time.sleep(0.01)
+	assert(made == ['a'] * 3)
+	assert(pool.take('b') is None)
+
+	for _ in range(3):
+		assert(pool.take('a') == 'a')
+	assert(pool.take('a') is None)
+
+	# values for another key are dropped
+	pool.fill('a', 1)
+	pool.fill('b', 0)
+	while pool.filling:
+		time.sleep(0.01)
+	assert(pool.take('a') is None)
+
+
+def test_overloaded_server():
+	create_coordinator()
+	server = create_server()
+	server.workers, release = blocked_pool(1)
+	server.workers.submit(Constants.GET_GENERATOR, time.sleep, 0)
+
+	# a client message over the limit is answered with FAIL
+	a, b = channel_pair()
+	assert(server.dispatch(a, [Constants.GET_GENERATOR]) is workers.DONE)
+	reply = recv(b)
+	assert(reply[0] == Constants.FAIL)
+	release.set()
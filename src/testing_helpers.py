@@ -1,4 +1,5 @@
 import config
+import shuffle
 import socket
 import time
 
@@ -8,10 +9,25 @@ from client import Client
 from coordinator_blockchain import BlockchainCoordinator
 from server_blockchain import BlockchainServer
 from client_blockchain import BlockchainClient
-from util import Constants
+from util import Constants, Channel, modinv
 
+from random import randrange
 from threading import Thread
 
+# 2048-bit group (see the commented out values in Constants)
+BIG_G = int('A4D1CBD5C3FD34126765A442EFB99905F8104DD258AC507FD640' +
+		'6CFF14266D31266FEA1E5C41564B777E690F5504F213160217B4B01B' +
+		'886A5E91547F9E2749F4D7FBD7D3B9A92EE1909D0D2263F80A76A6A2' +
+		'4C087A091F531DBF0A0169B6A28AD662A4D18E73AFA32D779D5918D0' +
+		'8BC8858F4DCEF97C2A24855E6EEB22B3B2E5', 16)
+BIG_P = int('B10B8F96A080E01DDE92DE5EAE5D54EC52C99FBCFB06A3C69A6A' +
+		'9DCA52D23B616073E28675A23D189838EF1E2EE652C013ECB4AEA906' +
+		'112324975C3CD49B83BFACCBDD7D90C4BD7098488E9C219A73724EFF' +
+		'D6FAE5644738FAA31A4FF55BCCC0A151AF5F0DC8B4BD45BF37DF365C' +
+		'1A65E68CFDA76D4DA708DF1FB2BC2E4A4371', 16)
+BIG_Q = int('F518AA8781A8DF278ABA4E7D64B7CB9D49462353', 16)
+
+
 def get_free_port():
 	tcp = socket.socket()
 	tcp.bind(('localhost', 0))
@@ -46,7 +62,8 @@ def create_server(port=None, sleep=0.01):
 		port = get_free_port()
 	s = Server('localhost', port)
 	Thread(target=s.run, daemon=True).start()
-	while not s.server_started:
+	# registered once the coordinator has sent the server its id
+	while s.server_id == Constants.INIT_ID:
 		time.sleep(sleep)
 	return s
 
@@ -56,7 +73,8 @@ def create_blockchain_server(port=None, sleep=0.01):
 		port = get_free_port()
 	s = BlockchainServer('localhost', port)
 	Thread(target=s.run, daemon=True).start()
-	while not s.server_started:
+	# registered once the coordinator has sent the server its id
+	while s.server_id == Constants.INIT_ID:
 		time.sleep(sleep)
 	return s
 
@@ -85,7 +103,7 @@ class LocalBaseAnonRep:
 
 		self.co.begin_client_registration()
 		# wait for all servers to update neighbors
-		while sum(s.prev_addr is not None for s in self.servers) == 0:
+		while any(s.prev_addr is None for s in self.servers):
 			time.sleep(0.01)
 
 		for i, num in enumerate(num_clients):
@@ -140,7 +158,7 @@ class LocalBlockchainAnonRep(LocalBaseAnonRep):
 
 		self.co.begin_client_registration()
 		# wait for all servers to update neighbors
-		while sum(s.prev_addr is not None for s in self.servers) == 0:
+		while any(s.prev_addr is None for s in self.servers):
 			time.sleep(0.01)
 
 		for i, num in enumerate(num_clients):
@@ -162,3 +180,58 @@ class LocalBlockchainAnonRep(LocalBaseAnonRep):
 			return
 		while len(self.co.board.board) == old_len:
 			time.sleep(sleep)
+
+
+#############################
+# Shuffle fixtures
+#############################
+
+def channel_pair():
+	"""Returns two channels connected to each other over loopback TCP."""
+	ss = socket.socket()
+	ss.bind(('localhost', 0))
+	ss.listen(1)
+	a = socket.create_connection(ss.getsockname())
+	b, _ = ss.accept()
+	ss.close()
+	return Channel(a), Channel(b)
+
+
+def announcement(n, g=Constants.G, p=Constants.P, q=Constants.Q):
+	"""Returns the arguments of one verifiable shuffle of n announcements.
+
+	Mirrors one hop of Server.new_announcement().
+	"""
+	secret = pow(g, randrange(1, q), p)
+	eph_key = randrange(1, q)
+	secret_inv = modinv(secret, p)
+	ann_list = [[pow(g, randrange(1, q), p) for _ in range(n)],
+		[(secret, pow(g, randrange(1, q), p)) for _ in range(n)]]
+	new_ann_list = [[pow(nym, eph_key, p) for nym in ann_list[0]],
+		[(sec, (rep * secret_inv) % p) for sec, rep in ann_list[1]]]
+	pi = shuffle.generate_permutation(n)
+	new_ann_list = [shuffle.shuffle(elts, pi) for elts in new_ann_list]
+	return ann_list, new_ann_list, pi, 1, 1, secret_inv
+
+
+def shuffle_proof(ann_list, new_ann_list, pi, beta, g_, h_,
+		g=Constants.G, p=Constants.P, q=Constants.Q):
+	"""Runs one shuffle proof and returns whether it verified.
+
+	Raises EOFError if the prover gave up.
+	"""
+	prover, verifier = channel_pair()
+
+	def prove():
+		try:
+			shuffle.prove(prover, ann_list, new_ann_list, pi, beta, g_, h_, g, p, q)
+		finally:
+			prover.close()
+
+	thread = Thread(target=prove)
+	thread.start()
+	try:
+		return shuffle.verify(verifier, ann_list, new_ann_list, g_, h_, g, p, q)
+	finally:
+		thread.join()
+		verifier.close()
@@ -0,0 +1,93 @@
+# Message flow of interactive proofs.
+#
+# Proofs are written as a conversation between a prover and a verifier: the
+# prover sends commitments and responses, and the verifier answers with random
+# challenges. Interactive holds that conversation over a socket. Transcript
+# holds it without a verifier (Fiat-Shamir): every challenge is a hash of the
+# statement and everything sent before it, so the prover can write the whole
+# proof on its own and anyone can check it later.
+
+import hashlib
+
+from util import Constants, encode, send, recv, randkey
+
+
+class Interactive:
+	"""Conversation with the other party through socket sock."""
+
+	def __init__(self, sock, prover, q=Constants.Q):
+		self.sock = sock
+		self.prover = prover
+		self.q = q
+
+	def send(self, value):
+		send(self.sock, value)
+
+	def recv(self):
+		return recv(self.sock)
+
+	def challenge(self, n=None):
+		"""Returns a random challenge mod q, or a list of n of them.
+
+		The verifier picks the challenge and sends it to the prover.
+		"""
+		if self.prover:
+			return recv(self.sock)
+
+		if n is None:
+			value = randkey(0, self.q - 1)
+		else:
+			value = [randkey(0, self.q - 1) for _ in range(n)]
+		send(self.sock, value)
+		return value
+
+
+class Transcript:
+	"""Non-interactive conversation (Fiat-Shamir).
+
+	The prover sends into a transcript without a proof, and the messages it sent
+	make up the proof. The verifier receives from a transcript of that proof.
+	Both sides must start from the same statement.
+	"""
+
+	def __init__(self, statement, proof=None, q=Constants.Q):
+		self.q = q
+		self.proof = [] if proof is None else proof
+		self.pos = 0 # next message of the proof to receive
+		self.hash = hashlib.sha256()
+		self.absorb(statement)
+
+	def absorb(self, value):
+		"""Adds value to the transcript."""
+		payload = encode(value, Constants.BINARY)
+		self.hash.update(
+			len(payload).to_bytes(Constants.INTEGER_SIZE, byteorder='big') + payload)
+
+	def send(self, value):
+		self.absorb(value)
+		self.proof.append(value)
+
+	def recv(self):
+		if self.pos >= len(self.proof):
+			raise ValueError('Proof is too short.')
+		value = self.proof[self.pos]
+		self.pos += 1
+		self.absorb(value)
+		return value
+
+	def challenge(self, n=None):
+		"""Returns a challenge mod q, or a list of n of them.
+
+		Challenges are derived from the transcript so far, and then added to it.
+		"""
+		seed = self.hash.digest()
+		values = [int.from_bytes(hashlib.sha256(seed + i.to_bytes(
+			Constants.INTEGER_SIZE, byteorder='big')).digest(), byteorder='big') % self.q
+			for i in range(1 if n is None else n)]
+		value = values[0] if n is None else values
+		self.absorb(value)
+		return value
+
+	def finished(self):
+		"""Returns whether every message of the proof was received."""
+		return self.pos == len(self.proof)
@@ -1,8 +1,19 @@
+import json
+import math
+import mmap
+import select
 import socket
 import sys
-import json
-from random import randint
+import tempfile
+from concurrent.futures import Future
+from contextlib import contextmanager
 from functools import singledispatch
+from random import randint
+from threading import Lock, Thread
+
+import arith
+import codec
+import fixedbase
 
 
 class Constants:
@@ -27,7 +38,10 @@ class Constants:
 	Q = 666683
 
 	INTEGER_SIZE = 8  # number of bytes that will be used to denote the size of payload
-	BUFFER_SIZE = 4096  # socket buffer receive buffer size
+	BUFFER_SIZE = 4096  # initial size of a channel's receive buffer
+	SPILL_SIZE = 2 ** 20  # payloads larger than this are received into a temp file
+	POOL_SIZE = 8  # maximum number of idle pooled channels per peer
+	MUX = b'\x01'  # first byte of a payload tagged with a request id
 	ENCODING = 'UTF-8'  # socket encoding
 	INIT_SECRET = 1  # initial secret
 	INIT_REPUTATION = 1  # initial reputation
@@ -36,6 +50,21 @@ class Constants:
 
 	AES_KEY_LENGTH = 16  # length of AES key for CoinShuffle
 	RSA_KEY_LENGTH = 2048  # length of RSA key for CoinShuffle
+	BATCH_BITS = 64  # bits of the random exponents in batch verification
+	BATCH_WINDOW = 5  # values per table of subset products in batched subgroup checks
+
+	# codecs
+	BINARY = 'binary'
+	JSON = 'json'
+	CODEC = BINARY  # codec proposed on new channels
+
+	# runtimes (see config.RUNTIME)
+	THREADED = 'threaded'
+	ASYNCIO = 'asyncio'
+
+	# shuffle proof modes (see config.SHUFFLE_PROOF)
+	INTERACTIVE = 'interactive'
+	NIZK = 'nizk'
 
 	# general headers
 	SUCCESS = 'SUCCESS'
@@ -55,6 +84,8 @@ class Constants:
 	# coordinator server headers
 	NEW_SERVER = 'NEW_SERVER'
 	END_ANNOUNCEMENT_PHASE = 'END_ANNOUNCEMENT_PHASE'
+	NEW_TRANSCRIPT = 'NEW_TRANSCRIPT'
+	SHUFFLE_FAILED = 'SHUFFLE_FAILED'
 
 	# blockchain coordinator server headers
 	GET_CONTRACT_ADDRESS = 'GET_CONTRACT_ADDRESS'
@@ -63,6 +94,7 @@ class Constants:
 	PARTICIPATION_STATUS = 'PARTICIPATION_STATUS'
 	KEYS = 'KEYS'
 	SHUFFLE = 'SHUFFLE'
+	SHUFFLE_PAYLOAD = 'SHUFFLE_PAYLOAD'
 
 	# server message headers
 	NEW_CLIENT = 'NEW_CLIENT'
@@ -77,9 +109,12 @@ class Constants:
 	UPDATE_NEIGHBORS = 'UPDATE_NEIGHBORS'
 	GET_GENERATOR = 'GET_GENERATOR'
 	GET_STP_ARRAY = 'GET_STP_ARRAY'
+	GET_ROUND_STATE = 'GET_ROUND_STATE'
 	GET_CIPHERTEXTS = 'GET_CIPHERTEXTS'
 	GET_CLIENTS = 'GET_CLIENTS'
 	UPDATE_CLIENTS = 'UPDATE_CLIENTS'
+	AUDIT_ROUND = 'AUDIT_ROUND'
+	ABORT_ROUND = 'ABORT_ROUND'
 
 	# blockchain server message headers
 	GET_LTP_ARRAY = 'GET_LTP_ARRAY'
@@ -96,17 +131,36 @@ class Constants:
 			REV_ANNOUNCEMENT,
 			GET_GENERATOR,
 			GET_STP_ARRAY,
+			GET_ROUND_STATE,
 			GET_LTP_ARRAY,
 			DISP_BOARD,
 			NEW_FEEDBACK,
 			GET_CONTRACT_ADDRESS,
 			PARTICIPATION_STATUS,
 			KEYS,
+			SHUFFLE_PAYLOAD,
 			GET_CIPHERTEXTS,
 			GET_CLIENTS,
 			UPDATE_CLIENTS,
+			AUDIT_ROUND,
+			ABORT_ROUND,
 			NEW_CLIENT])
 
+	# server headers that are handled before client traffic and never rejected
+	RING = set([
+			NEW_REPUTATION,
+			NEW_ANNOUNCEMENT,
+			REPLACE_STP,
+			REV_ANNOUNCEMENT,
+			REPLACE_LTP,
+			UPDATE_ID,
+			UPDATE_NEIGHBORS,
+			GET_CIPHERTEXTS,
+			GET_CLIENTS,
+			UPDATE_CLIENTS,
+			AUDIT_ROUND,
+			ABORT_ROUND])
+
 	# message board keys
 	MSG = 'msg' # message
 	NYM = 'nym' # short-term pseudonym
@@ -114,60 +168,431 @@ class Constants:
 	FB = 'fb' # feedback
 
 
+class Channel:
+	"""Persistent framed connection to a peer.
+
+	A channel carries any number of messages until either side closes it. The
+	side that opens a channel picks the codec; the other side answers in the
+	codec of the last message it received, so JSON-only peers keep getting JSON.
+	"""
+
+	def __init__(self, sock, addr=None, codec=None):
+		if isinstance(sock, socket.socket):
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.sock = sock
+		self.addr = addr
+		self.codec = codec # None until the peer has sent something
+
+		# receive buffers, reused for every frame
+		self.header = bytearray(Constants.INTEGER_SIZE)
+		self.buf = bytearray(Constants.BUFFER_SIZE)
+
+		# replies to multiplexed requests may be sent from several threads
+		self.lock = Lock()
+
+	def sendframe(self, payload):
+		"""Sends one frame, atomically with respect to other senders."""
+		with self.lock:
+			_sendframe(self.sock, payload)
+
+	def recvframe(self):
+		"""Receives one frame into the channel's buffer.
+
+		Returns a memoryview of the payload, which is only valid until the next
+		frame is received. Payloads larger than SPILL_SIZE go to a memory-mapped
+		temp file instead, and their view stays valid.
+		"""
+		size = _recvsize(self.sock, self.header)
+		if size > Constants.SPILL_SIZE:
+			view = _spill(size)
+		else:
+			if len(self.buf) < size:
+				self.buf = bytearray(max(size, 2 * len(self.buf)))
+			view = memoryview(self.buf)[:size]
+		_recvinto(self.sock, view)
+		return view
+
+	def alive(self):
+		"""Returns whether an idle channel can still be used.
+
+		An idle channel has nothing to read, so a readable socket means that the
+		peer has closed it (or sent something nobody asked for).
+		"""
+		try:
+			readable, _, __ = select.select([self.sock], [], [], 0)
+		except (OSError, ValueError):
+			return False
+		return len(readable) == 0
+
+	def close(self):
+		"""Closes the channel."""
+		self.sock.close()
+
+
+class ChannelPool:
+	"""Idle channels keyed by peer address."""
+
+	def __init__(self, size=Constants.POOL_SIZE):
+		self.size = size # maximum number of idle channels per peer
+		self.idle = {} # (host, port) -> list of idle channels
+		self.lock = Lock()
+
+	def acquire(self, addr):
+		"""Returns an open channel to addr, reusing an idle one if possible."""
+		addr = tuple(addr)
+		while True:
+			with self.lock:
+				chans = self.idle.get(addr)
+				chan = chans.pop() if chans else None
+			if chan is None:
+				break
+			if chan.alive():
+				return chan
+			chan.close()
+
+		self.sweep()
+		s = socket.socket()
+		s.connect(addr)
+		return Channel(s, addr, Constants.CODEC)
+
+	def release(self, chan):
+		"""Returns chan to the pool once its conversation is over."""
+		with self.lock:
+			chans = self.idle.setdefault(chan.addr, [])
+			if len(chans) < self.size:
+				chans.append(chan)
+				return
+		chan.close()
+
+	def sweep(self):
+		"""Closes idle channels whose peers have gone away."""
+		with self.lock:
+			for addr in list(self.idle.keys()):
+				alive = [chan for chan in self.idle[addr] if chan.alive()]
+				for chan in self.idle[addr]:
+					if chan not in alive:
+						chan.close()
+				if len(alive) > 0:
+					self.idle[addr] = alive
+				else:
+					del self.idle[addr]
+
+	def close(self):
+		"""Closes all idle channels."""
+		with self.lock:
+			for chans in self.idle.values():
+				for chan in chans:
+					chan.close()
+			self.idle.clear()
+
+
+pool = ChannelPool()
+
+
+@contextmanager
+def channel(addr):
+	"""Yields a pooled channel to addr for one conversation.
+
+	The channel goes back to the pool afterwards unless the conversation failed.
+	"""
+	chan = pool.acquire(addr)
+	try:
+		yield chan
+	except BaseException:
+		chan.close()
+		raise
+	pool.release(chan)
+
+
+class Reply:
+	"""Destination of the reply to one multiplexed request.
+
+	Handlers get a Reply in place of a channel and answer it with send(). A
+	multiplexed request gets exactly one reply, so only requests that are
+	answered with a single message may be multiplexed.
+	"""
+
+	def __init__(self, chan, req_id, codec):
+		self.chan = chan
+		self.req_id = req_id
+		self.codec = codec
+
+
+class Multiplexer:
+	"""Connection to a peer that carries any number of outstanding requests.
+
+	Every request is tagged with an id, and the peer tags its reply with the same
+	id, so replies can arrive in any order.
+	"""
+
+	def __init__(self, addr):
+		s = socket.socket()
+		s.connect(addr)
+		self.chan = Channel(s, addr, Constants.CODEC)
+		self.pending = {} # request id -> future for the reply
+		self.next_id = 0
+		self.closed = False
+		self.lock = Lock()
+
+		Thread(target=self.read, daemon=True).start()
+
+	def request(self, args):
+		"""Sends a request and returns a future for its reply."""
+		future = Future()
+		with self.lock:
+			if self.closed:
+				raise EOFError('Connection closed by peer.')
+			req_id = self.next_id
+			self.next_id += 1
+			self.pending[req_id] = future
+
+		try:
+			self.chan.sendframe(_mux(req_id, encode(args, self.chan.codec)))
+		except OSError as err:
+			self.close(err)
+			raise
+		return future
+
+	def read(self):
+		"""This is what the reader thread runs."""
+		try:
+			while True:
+				req_id, payload = _demux(self.chan.recvframe())
+				args, _ = decode(payload)
+				with self.lock:
+					future = self.pending.pop(req_id, None)
+				if future is not None:
+					future.set_result(args)
+		except Exception as err:
+			# the connection is gone or its stream can't be trusted any more
+			self.close(err)
+
+	def close(self, err=None):
+		"""Closes the connection and fails every outstanding request."""
+		with self.lock:
+			self.closed = True
+			pending, self.pending = self.pending, {}
+		self.chan.close()
+
+		for future in pending.values():
+			future.set_exception(err or EOFError('Connection closed.'))
+
+
+_multiplexers = {} # (host, port) -> Multiplexer
+_multiplexers_lock = Lock()
+
+
+def multiplexer(addr):
+	"""Returns the shared multiplexed connection to addr, opening it if needed."""
+	addr = tuple(addr)
+	with _multiplexers_lock:
+		mux = _multiplexers.get(addr)
+		if mux is None or mux.closed:
+			mux = _multiplexers[addr] = Multiplexer(addr)
+	return mux
+
+
+def _mux(req_id, payload):
+	"""Tags an encoded payload with a request id."""
+	return Constants.MUX + req_id.to_bytes(
+		Constants.INTEGER_SIZE, byteorder='big') + payload
+
+
+def _demux(payload):
+	"""Splits a payload into its request id (None if untagged) and message."""
+	if payload[:1] != Constants.MUX:
+		return None, payload
+	end = 1 + Constants.INTEGER_SIZE
+	return int.from_bytes(payload[1:end], byteorder='big'), payload[end:]
+
+
+def _sendframe(s, msg):
+	"""Send one length-prefixed frame through socket s."""
+	s.sendall(len(msg).to_bytes(Constants.INTEGER_SIZE, byteorder='big') + msg)
+
+
+def _recvinto(s, view):
+	"""Fills view with bytes received through socket s."""
+	while len(view) > 0:
+		size = s.recv_into(view)
+		if size == 0:
+			raise EOFError('Connection closed by peer.')
+		view = view[size:]
+
+
+def _recvsize(s, header):
+	"""Receives the length prefix of a frame into header and returns it."""
+	_recvinto(s, memoryview(header))
+	return int.from_bytes(header, byteorder='big')
+
+
+def _spill(size):
+	"""Returns a writable view of a memory-mapped temp file of size bytes."""
+	with tempfile.TemporaryFile() as f:
+		f.truncate(size)
+		return memoryview(mmap.mmap(f.fileno(), size))
+
+
+def _recvframe(s):
+	"""Receive one length-prefixed frame through socket s.
+
+	Returns a memoryview of the payload.
+	"""
+	size = _recvsize(s, bytearray(Constants.INTEGER_SIZE))
+	view = _spill(size) if size > Constants.SPILL_SIZE else memoryview(bytearray(size))
+	_recvinto(s, view)
+	return view
+
+
+class Encoded:
+	"""Arguments that are sent many times, encoded once per codec."""
+
+	def __init__(self, args):
+		self.args = args
+		self.payloads = {} # codec name -> payload
+
+	def payload(self, codec_name):
+		ret = self.payloads.get(codec_name)
+		if ret is None:
+			ret = self.payloads[codec_name] = encode(self.args, codec_name)
+		return ret
+
+
+def encode(args, codec_name=Constants.JSON):
+	"""Encodes arguments with the named codec.
+
+	Falls back to JSON for arguments the binary codec cannot represent.
+	Arguments can also be Encoded, whose payloads are reused.
+	"""
+	if isinstance(args, Encoded):
+		return args.payload(codec_name)
+	if codec_name == Constants.BINARY:
+		try:
+			return codec.dumps(args)
+		except TypeError:
+			pass
+	return json.dumps(args).encode(Constants.ENCODING)
+
+
+def decode(payload):
+	"""Decodes a payload (any bytes-like object) produced by encode().
+
+	Returns the arguments and the name of the codec that was used.
+	"""
+	if codec.is_binary(payload):
+		return codec.loads(payload), Constants.BINARY
+	return json.loads(str(payload, Constants.ENCODING)), Constants.JSON
+
+
 @singledispatch
 def send(s, args):
 	"""Send arguments through socket s."""
-	msg = json.dumps(args).encode(Constants.ENCODING)
-	s.send(len(msg).to_bytes(Constants.INTEGER_SIZE, byteorder='big') + msg)
+	_sendframe(s, encode(args))
+
+
+@send.register(Channel)
+def _(chan, args):
+	chan.sendframe(encode(args, chan.codec))
+
+
+@send.register(Reply)
+def _(reply, args):
+	reply.chan.sendframe(_mux(reply.req_id, encode(args, reply.codec)))
 
 
 @send.register(tuple)
 def _(addr, args):
-	s = socket.socket()
-	s.connect(addr)
-	send(s, args)
+	with channel(addr) as chan:
+		send(chan, args)
+
+
+@singledispatch
+def sendbytes(s, msg):
+	"""Send raw bytes through socket s."""
+	_sendframe(s, msg)
+
+
+@sendbytes.register(Channel)
+def _(chan, msg):
+	chan.sendframe(msg)
 
 
-def sendbytes(addr, msg):
-	"""Send raw bytes to addr."""
-	s = socket.socket()
-	s.connect(addr)
-	s.send(len(msg).to_bytes(Constants.INTEGER_SIZE, byteorder='big') + msg)
+@sendbytes.register(tuple)
+def _(addr, msg):
+	with channel(addr) as chan:
+		sendbytes(chan, msg)
 
 
+@singledispatch
 def recv(s):
 	"""Receive arguments through socket s."""
-	remaining = int.from_bytes(s.recv(Constants.INTEGER_SIZE), byteorder='big')
-	chunks = []
-	while remaining > 0:
-		chunk = s.recv(min(Constants.BUFFER_SIZE, remaining))
-		remaining -= len(chunk)
-		chunks.append(chunk)
-	return json.loads(b''.join(chunks).decode(Constants.ENCODING))
+	args, _ = decode(_recvframe(s))
+	return args
+
 
+@recv.register(Channel)
+def _(chan):
+	args, chan.codec = decode(chan.recvframe())
+	return args
 
+
+@singledispatch
 def recvbytes(s):
-	"""Receive bytes through socket s."""
-	remaining = int.from_bytes(s.recv(Constants.INTEGER_SIZE), byteorder='big')
-	chunks = []
-	while remaining > 0:
-		chunk = s.recv(min(Constants.BUFFER_SIZE, remaining))
-		remaining -= len(chunk)
-		chunks.append(chunk)
-	return b''.join(chunks)
+	"""Receive bytes through socket s.
+
+	Returns a bytes-like object.
+	"""
+	return _recvframe(s)
+
+
+@recvbytes.register(Channel)
+def _(chan):
+	view = chan.recvframe()
+
+	# the channel's buffer is reused for the next frame, spilled payloads are not
+	return view if len(view) > Constants.SPILL_SIZE else bytes(view)
+
+
+def unpack_request(chan, payload):
+	"""Decodes a request received on chan.
+
+	Returns the message and what to answer it with: chan itself, or a Reply if
+	the request was multiplexed.
+	"""
+	req_id, payload = _demux(payload)
+	msg, codec_name = decode(payload)
+	if req_id is None:
+		chan.codec = codec_name
+		return msg, chan
+	return msg, Reply(chan, req_id, codec_name)
+
+
+def recvrequest(chan):
+	"""Receives a request on chan (see unpack_request())."""
+	return unpack_request(chan, chan.recvframe())
 
 
 def sendrecv(addr, args):
 	"""Like send() except it waits for a response and returns it."""
-	s = socket.socket()
-	s.connect(addr)
-	send(s, args)
-	return recv(s)
+	with channel(addr) as chan:
+		send(chan, args)
+		return recv(chan)
 
 
 def powm(base, exp, mod=Constants.P):
-	"""Modular exponentiation."""
-	return pow(base, exp, mod)
+	"""Modular exponentiation.
+
+	Uses precomputed powers if base is registered with fixedbase.
+	"""
+	table = fixedbase.lookup(base, mod)
+	if table is not None:
+		return table.pow(exp)
+	return arith.powmod(base, exp, mod)
+
+
+def register_base(base):
+	"""Registers a round generator for fixed-base exponentiation."""
+	return fixedbase.register(base, Constants.P, Constants.Q)
 
 
 def egcd(b, a):
@@ -182,14 +607,12 @@ def egcd(b, a):
 
 def gcd(b, a):
 	"""Returns the greatest common denominator of b and a."""
-	g, _, __ = egcd(b, a)
-	return g
+	return math.gcd(b, a)
 
 
 def modinv(num, mod=Constants.P):
-	"""Modular inverse."""
-	g, inv, _ = egcd(num, mod)
-	return (inv % mod) if g == 1 else None
+	"""Modular inverse, or None if num has none."""
+	return arith.invert(num, mod)
 
 
 def divide(a, b, p=Constants.P):
@@ -198,6 +621,34 @@ def divide(a, b, p=Constants.P):
 	return (m * a) % p if m else None
 
 
+def batch_modinv(nums, mod=Constants.P):
+	"""Modular inverses of all of nums, like modinv() on each of them.
+
+	Uses one inversion and 3n multiplications (Montgomery's trick). Entries
+	without an inverse are None.
+	"""
+	prefix = [] # prefix[i] = product of the nonzero nums[:i + 1]
+	acc = 1
+	for num in nums:
+		num %= mod
+		if num != 0:
+			acc = (acc * num) % mod
+		prefix.append(acc)
+
+	inv = modinv(acc, mod)
+	if inv is None:
+		# some num shares a factor with a composite mod
+		return [modinv(num, mod) for num in nums]
+
+	ret = [None] * len(nums)
+	for i in range(len(nums) - 1, -1, -1):
+		num = nums[i] % mod
+		if num != 0:
+			ret[i] = (inv * prefix[i - 1]) % mod if i > 0 else inv
+			inv = (inv * num) % mod
+	return ret
+
+
 def msg_hash(msg, hash_func, mod=Constants.P):
 	"""Message hash function."""
 	msg = msg.encode(Constants.ENCODING)
@@ -225,3 +676,6 @@ def sprint(name, s):
 def eprint(name, err):
 	"""Prints error."""
 	print('[{}] {}'.format(name, err), file=sys.stderr)
+
+
+fixedbase.register(Constants.G, Constants.P, Constants.Q, pinned=True)
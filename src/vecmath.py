@@ -0,0 +1,104 @@
+# Vector modular arithmetic.
+#
+# Elementwise products and powers of lists of residues, for the per-element
+# work of the announcement phase and the shuffle proof. When numpy is installed
+# and the modulus is below NUMPY_LIMIT (so the product of two residues fits in
+# 64 bits, as in the deployed 24-bit group) they run on arrays, powers by
+# square-and-multiply over the whole array at once. Otherwise, or for short
+# lists, they are plain loops. Either way lists of ints go in and come out.
+
+import arith
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+NUMPY_LIMIT = 2 ** 31  # moduli below this use numpy
+NUMPY_MIN = 64  # shortest list worth converting to an array
+
+
+def _array(values, mod):
+	"""Returns values reduced mod mod as an array, or None if they don't fit."""
+	try:
+		return numpy.array(values, dtype=numpy.uint64) % numpy.uint64(mod)
+	except (OverflowError, TypeError, ValueError):
+		return None
+
+
+def _use_numpy(n, mod):
+	return numpy is not None and n >= NUMPY_MIN and 1 < mod < NUMPY_LIMIT
+
+
+def _check_lengths(a, b):
+	if len(a) != len(b):
+		raise ValueError('vectors of lengths {} and {}'.format(len(a), len(b)))
+
+
+def mulmod(a, b, mod):
+	"""Returns [a[i] * b[i] mod mod], or [a[i] * b mod mod] if b is an int.
+
+	Raises ValueError if a and b are lists of different lengths.
+	"""
+	scalar = isinstance(b, int)
+	if not scalar:
+		_check_lengths(a, b)
+	if _use_numpy(len(a), mod):
+		x = _array(a, mod)
+		y = numpy.uint64(b % mod) if scalar else _array(b, mod)
+		if x is not None and y is not None:
+			return ((x * y) % numpy.uint64(mod)).tolist()
+
+	if scalar:
+		return [(x * b) % mod for x in a]
+	return [(x * y) % mod for x, y in zip(a, b)]
+
+
+def _powmod_shared(x, exp, mod):
+	mod = numpy.uint64(mod)
+	ret = numpy.ones_like(x)
+	while exp > 0:
+		if exp & 1:
+			ret = (ret * x) % mod
+		exp >>= 1
+		if exp > 0:
+			x = (x * x) % mod
+	return ret
+
+
+def _powmod_each(x, e, mod):
+	mod = numpy.uint64(mod)
+	ret = numpy.ones_like(x)
+	while e.any():
+		ret = numpy.where(e & numpy.uint64(1), (ret * x) % mod, ret)
+		e = e >> numpy.uint64(1)
+		x = (x * x) % mod
+	return ret
+
+
+def powmod(bases, exps, mod):
+	"""Returns [bases[i]^exps[i] mod mod].
+
+	Either bases or exps may be a single int shared by all elements. Negative
+	exponents work like in arith.powmod(). Raises ValueError if bases and exps
+	are lists of different lengths.
+	"""
+	if isinstance(exps, int):
+		if _use_numpy(len(bases), mod) and exps >= 0:
+			x = _array(bases, mod)
+			if x is not None:
+				return _powmod_shared(x, exps, mod).tolist()
+		return [arith.powmod(base, exps, mod) for base in bases]
+
+	if isinstance(bases, int):
+		bases = [bases] * len(exps)
+	_check_lengths(bases, exps)
+	if _use_numpy(len(exps), mod) and min(exps, default=0) >= 0:
+		x = _array(bases, mod)
+		try:
+			e = numpy.array(exps, dtype=numpy.uint64)
+		except (OverflowError, TypeError, ValueError):
+			e = None
+		if x is not None and e is not None:
+			return _powmod_each(x, e, mod).tolist()
+	return [arith.powmod(base, exp, mod) for base, exp in zip(bases, exps)]
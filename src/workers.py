@@ -0,0 +1,191 @@
+import queue
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+
+DONE = Future() # already finished future, for work that nobody waits on
+DONE.set_result(None)
+
+
+def log_exception(future):
+	"""Done callback that prints the exception of a background task."""
+	err = future.exception()
+	if err is not None:
+		traceback.print_exception(type(err), err, err.__traceback__)
+
+
+def spawn(func, *args):
+	"""Runs func(*args) on a new thread and returns a future for its result."""
+	future = Future()
+
+	def run():
+		try:
+			future.set_result(func(*args))
+		except BaseException as err:
+			future.set_exception(err)
+
+	Thread(target=run, daemon=True).start()
+	return future
+
+
+def settle(future):
+	"""Returns a future that resolves like future or, if future resolves to
+	another future, like that one.
+
+	This lets handlers answer a request later by returning a future.
+	"""
+	ret = Future()
+
+	def done(f):
+		try:
+			result = f.result()
+		except BaseException as err:
+			ret.set_exception(err)
+			return
+		if isinstance(result, Future):
+			result.add_done_callback(done)
+		else:
+			ret.set_result(result)
+
+	future.add_done_callback(done)
+	return ret
+
+
+class PrecomputePool:
+	"""Values for upcoming work, computed on a background thread.
+
+	Values are computed by make(key) and only serve work with the same key, like
+	the size of a shuffle proof or the generator of a round.
+	"""
+
+	def __init__(self, make):
+		self.make = make
+		self.key = None # key of the pooled values
+		self.count = 0 # number of values to keep ready
+		self.ready = []
+		self.filling = False
+		self.lock = Lock()
+
+	def fill(self, key, count):
+		"""Starts computing values until count of them for key are ready.
+
+		Values for any other key are dropped.
+		"""
+		with self.lock:
+			if key != self.key:
+				self.key, self.ready = key, []
+			self.count = count
+			if self.filling or len(self.ready) >= count:
+				return
+			self.filling = True
+		Thread(target=self._fill, daemon=True).start()
+
+	def _fill(self):
+		while True:
+			with self.lock:
+				key = self.key
+				if len(self.ready) >= self.count:
+					self.filling = False
+					return
+			value = self.make(key)
+			with self.lock:
+				if key == self.key:
+					self.ready.append(value)
+
+	def take(self, key):
+		"""Returns a ready value for key, or None if there is none."""
+		with self.lock:
+			if key == self.key and self.ready:
+				return self.ready.pop()
+		return None
+
+
+class WorkerPool:
+	"""Fixed-size pool of threads fed by one queue per message header.
+
+	Headers in priority_headers are always served before all other headers and
+	are never rejected. Other headers take turns, and each of their queues holds
+	at most limit tasks.
+	"""
+
+	def __init__(self, size, limit, priority_headers):
+		self.limit = limit
+		self.priority_headers = set(priority_headers)
+
+		self.queues = {} # header -> deque of (enqueue time, future, func, args)
+		self.turns = (deque(), deque()) # headers with queued tasks, per priority
+		self.counters = {} # header -> submitted/rejected counts and wait times
+		self.cond = Condition()
+
+		for _ in range(size):
+			Thread(target=self.work, daemon=True).start()
+
+	def submit(self, header, func, *args):
+		"""Queues func(*args) and returns a future for its result.
+
+		Raises queue.Full if the queue for header is full.
+		"""
+		future = Future()
+		with self.cond:
+			stats = self.counters.setdefault(header, {
+					'submitted': 0, 'rejected': 0, 'wait_total': 0.0, 'wait_max': 0.0})
+			tasks = self.queues.setdefault(header, deque())
+			priority = 0 if header in self.priority_headers else 1
+
+			if priority != 0 and len(tasks) >= self.limit:
+				stats['rejected'] += 1
+				raise queue.Full(header)
+
+			stats['submitted'] += 1
+			if len(tasks) == 0:
+				self.turns[priority].append(header)
+			tasks.append((time.perf_counter(), future, func, args))
+			self.cond.notify()
+
+		return future
+
+	def next_task(self):
+		"""Removes and returns the next task to run, waiting for one if needed."""
+		with self.cond:
+			while len(self.turns[0]) == 0 and len(self.turns[1]) == 0:
+				self.cond.wait()
+
+			turns = self.turns[0] if len(self.turns[0]) > 0 else self.turns[1]
+			header = turns.popleft()
+			tasks = self.queues[header]
+			queued_at, future, func, args = tasks.popleft()
+			if len(tasks) > 0:
+				turns.append(header)
+
+			wait = time.perf_counter() - queued_at
+			stats = self.counters[header]
+			stats['wait_total'] += wait
+			stats['wait_max'] = max(stats['wait_max'], wait)
+
+		return future, func, args
+
+	def work(self):
+		"""This is what each worker thread runs."""
+		while True:
+			future, func, args = self.next_task()
+			if not future.set_running_or_notify_cancel():
+				continue
+			try:
+				future.set_result(func(*args))
+			except BaseException as err:
+				future.set_exception(err)
+
+	def depth(self, header):
+		"""Returns the number of queued tasks for header."""
+		with self.cond:
+			return len(self.queues.get(header, ()))
+
+	def stats(self):
+		"""Returns a copy of the counters of every header.
+
+		Wait times are in seconds, measured from submit() until a worker starts.
+		"""
+		with self.cond:
+			return {header: dict(stats) for header, stats in self.counters.items()}